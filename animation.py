@@ -0,0 +1,93 @@
+import struct
+
+from aseprite import numpy
+
+# bytes of each run header in pack_tilemap_deltas(): u32 address, u16 size
+run_header_size = 6
+max_run_size = 0xffff
+
+def changed_entries(previous, current, entry_size):
+    """
+    Indices of the entries that differ between two tables of the same size.
+    """
+    assert len(previous) == len(current), (len(previous), len(current))
+    if numpy is not None:
+        dtype = ">u4" if entry_size == 4 else ">u2"
+        a = numpy.frombuffer(previous, dtype=dtype)
+        b = numpy.frombuffer(current, dtype=dtype)
+        return numpy.flatnonzero(a != b).tolist()
+
+    changed = []
+    for offset in range(0, len(current), entry_size):
+        if previous[offset:offset + entry_size] != current[offset:offset + entry_size]:
+            changed.append(offset // entry_size)
+    return changed
+
+def diff_runs(previous, current, entry_size):
+    """
+    [(byte offset, data), ...] covering every entry of current that differs
+    from previous. Runs separated by fewer unchanged bytes than a run header
+    are merged, as writing those is cheaper than starting a new run, and
+    runs are split to at most max_run_size bytes.
+    """
+    max_gap = run_header_size // entry_size
+    max_entries = max_run_size // entry_size
+    runs = []
+    start = end = None
+    for index in changed_entries(previous, current, entry_size):
+        if start is not None and index - end <= max_gap and index + 1 - start <= max_entries:
+            end = index + 1
+            continue
+        if start is not None:
+            runs.append((start * entry_size, current[start * entry_size:end * entry_size]))
+        start, end = index, index + 1
+    if start is not None:
+        runs.append((start * entry_size, current[start * entry_size:end * entry_size]))
+    return runs
+
+def tilemap_deltas(tables, entry_size):
+    """
+    Diff the pattern name table of each frame against the previous frame,
+    and the first frame against the last one so that animations loop.
+    Yields (frame index, runs) for every frame that changes anything.
+    tables may be an iterator, and only the first and previous tables are
+    kept while diffing.
+    """
+    tables = iter(tables)
+    first = previous = next(tables, None)
+    if first is None:
+        return
+    for frame_index, current in enumerate(tables, 1):
+        if current is not previous:
+            runs = diff_runs(previous, current, entry_size)
+            if runs:
+                yield frame_index, runs
+        previous = current
+    if previous is not first:
+        runs = diff_runs(previous, first, entry_size)
+        if runs:
+            yield 0, runs
+
+def frame_size(runs):
+    """
+    Bytes a frame of runs transfers, run headers included.
+    """
+    return sum(run_header_size + len(data) for _, data in runs)
+
+def pack_tilemap_deltas(deltas, address=0):
+    """
+    Serialize tilemap_deltas() as a big-endian stream:
+
+      u16 number of frames
+      per frame:  u16 frame index, u16 number of runs
+      per run:    u32 VRAM address (address + byte offset in the table),
+                  u16 number of bytes, data
+    """
+    deltas = list(deltas)
+    buf = bytearray(struct.pack(">H", len(deltas)))
+    for frame_index, runs in deltas:
+        buf += struct.pack(">HH", frame_index, len(runs))
+        for offset, data in runs:
+            buf += struct.pack(">IH", address + offset, len(data))
+            buf += data
+    return bytes(buf)
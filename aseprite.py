@@ -1,41 +1,174 @@
 import struct
 import sys
-from dataclasses import dataclass
+import os
+import weakref
+import mmap
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
 from typing import Union, Optional
 import zlib
+from array import array
+
+import instrument
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def as_memoryview(source):
+    """
+    A memoryview of source, which is either a bytes-like object (including
+    an mmap) or a binary file object. Files are memory-mapped read-only when
+    possible, and read into memory otherwise.
+    """
+    try:
+        return memoryview(source)
+    except TypeError:
+        pass
+    try:
+        source = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # not a regular file (or an empty one); pipes are read from where
+        # they are
+        if source.seekable():
+            source.seek(0)
+        source = source.read()
+    return memoryview(source)
+
+def map_file(filename):
+    """
+    Memory-map filename read-only, as a memoryview.
+    """
+    with open(filename, "rb") as f:
+        return as_memoryview(f)
+
+_uint32_typecode = "I" if array("I").itemsize == 4 else "L"
+
+def hex_field():
+    """
+    A record field that is a plain int, but is shown in hex by repr().
+    """
+    return field(metadata={"format": hex})
+
+def _record_repr(self):
+    values = ", ".join(
+        f"{f.name}={f.metadata.get('format', repr)(getattr(self, f.name))}"
+        for f in fields(self)
+    )
+    return f"{type(self).__name__}({values})"
+
+def record(*extra_slots):
+    """
+    A dataclass with __slots__ (the fields plus extra_slots) instead of a
+    per-instance __dict__, like dataclass(slots=True) on Python >= 3.10.
+    Classes that define __post_init__ use it to initialize extra_slots.
+    """
+    def wrap(cls):
+        cls = dataclass(cls, repr=False)
+        field_names = tuple(f.name for f in fields(cls))
+        cls_dict = dict(cls.__dict__)
+        for name in field_names:
+            cls_dict.pop(name, None)
+        cls_dict.pop("__dict__", None)
+        cls_dict.pop("__weakref__", None)
+        cls_dict["__slots__"] = field_names + extra_slots
+        cls_dict["__repr__"] = _record_repr
+        return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    return wrap
+
+class ZlibData:
+    """
+    A zlib stream, kept as a zero-copy view of the chunk that contains it.
+
+    Nothing is decompressed until the data is first accessed; the result is
+    cached. prefix() and rows() stream through a decompressobj, and only
+    decode as far into the stream as the requested range.
+
+    compressed is None for new data (see uncompressed()), which is only
+    compressed when written.
+    """
+
+    __slots__ = ("compressed", "_data", "_decompressobj", "_partial")
+
+    def __init__(self, compressed):
+        self.compressed = compressed
+        self._data = None
+        self._decompressobj = None
+        self._partial = None
+
+    @classmethod
+    def uncompressed(cls, data):
+        zlib_data = cls(None)
+        zlib_data._data = bytes(data)
+        return zlib_data
 
-class CustomInt:
-    value: int
-
-    def __init__(self, value):
-        self.value = value
-
-    def __int__(self):
-        return self.value
-
-    def __eq__(self, other):
-        return self.value == other
-
-    def __eq__(self, other):
-        return self.value == other
-
-class HexInt(CustomInt):
     def __repr__(self):
-        return hex(self.value)
+        if self.compressed is None:
+            return f"ZlibData({len(self._data)} bytes, uncompressed)"
+        state = "decompressed" if self._data is not None else "compressed"
+        return f"ZlibData({len(self.compressed)} bytes, {state})"
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def data(self):
+        if self._data is None:
+            with instrument.stage("decompress", len(self.compressed)) as measurement:
+                if self._decompressobj is None:
+                    self._data = zlib.decompress(self.compressed)
+                else:
+                    self._partial += self._decompressobj.decompress(self._decompressobj.unconsumed_tail)
+                    self._partial += self._decompressobj.flush()
+                    self._data = bytes(self._partial)
+                measurement.bytes_out = len(self._data)
+            self._decompressobj = None
+            self._partial = None
+        return self._data
+
+    def prefix(self, length):
+        """
+        Return (at least) the first length bytes of the decompressed data.
+        """
+        return self.rows(1, 0, length)
+
+    def rows(self, row_size, start, stop):
+        """
+        Return decompressed rows [start, stop), each row_size bytes long.
+        Only the stream up to row stop is decoded, and only the requested
+        rows are copied.
+        """
+        start *= row_size
+        length = stop * row_size
+        if self._data is not None:
+            return self._data[start:length]
+
+        if self._decompressobj is None:
+            self._decompressobj = zlib.decompressobj()
+            self._partial = bytearray()
+            tail = self.compressed
+        else:
+            tail = self._decompressobj.unconsumed_tail
 
-class BinInt(CustomInt):
-    def __repr__(self):
-        return bin(self.value)
+        while len(self._partial) < length and not self._decompressobj.eof:
+            buf = self._decompressobj.decompress(tail, length - len(self._partial))
+            tail = self._decompressobj.unconsumed_tail
+            if not buf and not tail:
+                break
+            self._partial += buf
+
+        return bytes(self._partial[start:length])
 
-@dataclass
+@record()
 class Header:
     file_size: int
-    magic_number: HexInt
+    magic_number: int = hex_field()
     frames: int
     width_in_pixels: int
     height_in_pixels: int
     color_depth: int
-    flags: HexInt
+    flags: int = hex_field()
     speed: int
     transparent_palette_index: int
     number_of_colors: int
@@ -46,55 +179,61 @@ class Header:
     grid_width: int
     grid_height: int
 
-def dword(mem):
-    return struct.unpack("<I", mem[0:4])[0], mem[4:]
-
-def word(mem):
-    return struct.unpack("<H", mem[0:2])[0], mem[2:]
-
-def short(mem):
-    return struct.unpack("<h", mem[0:2])[0], mem[2:]
-
-def byte(mem):
-    return struct.unpack("<B", mem[0:1])[0], mem[1:]
-
-def skip(mem, i):
-    return mem[i:]
-
-def uuid(mem):
-    return bytes(mem[0:16]), mem[16:]
-
-def string(mem):
-    string_length, mem = word(mem)
-    byte = bytes(mem[0:string_length])
-    return byte, mem[string_length:]
-
-def parse_header(mem):
-    file_size, mem = dword(mem)
-    magic_number, mem = word(mem)
-    frames, mem = word(mem)
-    width_in_pixels, mem = word(mem)
-    height_in_pixels, mem = word(mem)
-    color_depth, mem = word(mem)
-    flags, mem = dword(mem)
-    speed, mem = word(mem)
-    mem = skip(mem, 8)
-    transparent_palette_index, mem = byte(mem)
-    mem = skip(mem, 3)
-    number_of_colors, mem = word(mem)
-    pixel_width, mem = byte(mem)
-    pixel_height, mem = byte(mem)
-    x_position_of_grid, mem = short(mem)
-    y_position_of_grid, mem = short(mem)
-    grid_width, mem = word(mem)
-    grid_height, mem = word(mem)
-    mem = skip(mem, 84)
+_header_struct = struct.Struct("<IHHHHHIH8xB3xHBBhhHH84x")
+_frame_header_struct = struct.Struct("<IHHH2xI")
+_chunk_header_struct = struct.Struct("<IH")
+_old_palette_packet_struct = struct.Struct("<BB")
+_palette_header_struct = struct.Struct("<III8x")
+_palette_entry_struct = struct.Struct("<HBBBB")
+_tileset_header_struct = struct.Struct("<IIIHHh14x")
+_layer_header_struct = struct.Struct("<HHHHHHB3x")
+_cel_header_struct = struct.Struct("<HhhBHh5x")
+_cel_image_header_struct = struct.Struct("<HH")
+_tilemap_header_struct = struct.Struct("<HHHIIII10x")
+
+_dword_struct = struct.Struct("<I")
+_word_struct = struct.Struct("<H")
+
+def dword(mem, offset):
+    return _dword_struct.unpack_from(mem, offset)[0], offset + 4
+
+def word(mem, offset):
+    return _word_struct.unpack_from(mem, offset)[0], offset + 2
+
+def uuid(mem, offset):
+    return bytes(mem[offset:offset + 16]), offset + 16
+
+def string(mem, offset):
+    string_length, offset = word(mem, offset)
+    byte = bytes(mem[offset:offset + string_length])
+    return byte, offset + string_length
+
+def parse_header(mem, offset=0):
+    (
+        file_size,
+        magic_number,
+        frames,
+        width_in_pixels,
+        height_in_pixels,
+        color_depth,
+        flags,
+        speed,
+        transparent_palette_index,
+        number_of_colors,
+        pixel_width,
+        pixel_height,
+        x_position_of_grid,
+        y_position_of_grid,
+        grid_width,
+        grid_height,
+    ) = _header_struct.unpack_from(mem, offset)
+    offset += _header_struct.size
 
     assert magic_number == 0xa5e0, magic_number
 
     header = Header(
         file_size = file_size,
-        magic_number = HexInt(magic_number),
+        magic_number = magic_number,
         frames = frames,
         width_in_pixels = width_in_pixels,
         height_in_pixels = height_in_pixels,
@@ -111,22 +250,24 @@ def parse_header(mem):
         grid_height = grid_height,
     )
 
-    return header, mem
+    return header, offset
 
-@dataclass
+@record()
 class FrameHeader:
     bytes_in_this_frame: int
-    magic_number: HexInt
+    magic_number: int = hex_field()
     number_of_chunks: int
     frame_duration: int
 
-def parse_frame_header(mem):
-    bytes_in_this_frame, mem = dword(mem)
-    magic_number, mem = word(mem)
-    old_number_of_chunks, mem = word(mem)
-    frame_duration, mem = word(mem)
-    mem = skip(mem, 2)
-    new_number_of_chunks, mem = dword(mem)
+def parse_frame_header(mem, offset=0):
+    (
+        bytes_in_this_frame,
+        magic_number,
+        old_number_of_chunks,
+        frame_duration,
+        new_number_of_chunks,
+    ) = _frame_header_struct.unpack_from(mem, offset)
+    offset += _frame_header_struct.size
 
     assert magic_number == 0xf1fa, magic_number
     assert (
@@ -138,58 +279,65 @@ def parse_frame_header(mem):
 
     frame_header = FrameHeader(
         bytes_in_this_frame = bytes_in_this_frame,
-        magic_number = HexInt(magic_number),
+        magic_number = magic_number,
         number_of_chunks = number_of_chunks,
         frame_duration = frame_duration,
     )
 
-    return frame_header, mem
+    return frame_header, offset
 
-@dataclass
+@record()
 class Chunk:
     chunk_size: int
-    chunk_type: HexInt
+    chunk_type: int = hex_field()
     data: memoryview
 
-def parse_chunk(mem):
-    chunk_size, mem = dword(mem)
-    chunk_type, mem = word(mem)
-    assert chunk_size >= 6, chunk_size
-    data = mem[0:chunk_size - 6]
-    mem = skip(mem, chunk_size - 6)
+def parse_chunk(mem, offset=0):
+    chunk_size, chunk_type = _chunk_header_struct.unpack_from(mem, offset)
+    assert chunk_size >= _chunk_header_struct.size, chunk_size
+    data = mem[offset + _chunk_header_struct.size:offset + chunk_size]
+    offset += chunk_size
     chunk = Chunk(
         chunk_size = chunk_size,
-        chunk_type = HexInt(chunk_type),
+        chunk_type = chunk_type,
         data = data
     )
-    return chunk, mem
-
-@dataclass
+    return chunk, offset
+
+def iter_chunks(mem, offset, number_of_chunks):
+    """
+    Yield (chunk offset, Chunk) for number_of_chunks chunks starting at
+    offset. Only the chunk headers are read; the caller decides which chunk
+    payloads to parse.
+    """
+    for _ in range(number_of_chunks):
+        chunk, next_offset = parse_chunk(mem, offset)
+        yield offset, chunk
+        offset = next_offset
+
+@record()
 class PaletteChunkPacket:
     entries_to_skip: int
     number_of_colors: int
     colors: list[tuple[int, int, int]]
 
-@dataclass
+@record()
 class OldPaletteChunk:
     number_of_packets: int
     packets: list[PaletteChunkPacket]
 
-def parse_old_palette_chunk(mem):
-    number_of_packets, mem = word(mem)
+def parse_old_palette_chunk(mem, offset=0):
+    number_of_packets, offset = word(mem, offset)
     packets = []
     for _ in range(number_of_packets):
-        entries_to_skip, mem = byte(mem)
-        number_of_colors, mem = byte(mem)
+        entries_to_skip, number_of_colors = _old_palette_packet_struct.unpack_from(mem, offset)
+        offset += _old_palette_packet_struct.size
 
         assert entries_to_skip == 0, entries_to_skip
 
-        colors = []
-        for _ in range(number_of_colors):
-            red, mem = byte(mem)
-            green, mem = byte(mem)
-            blue, mem = byte(mem)
-            colors.append((red, green, blue))
+        rgb = bytes(mem[offset:offset + number_of_colors * 3])
+        offset += len(rgb)
+        colors = list(zip(rgb[0::3], rgb[1::3], rgb[2::3]))
 
         packets.append(PaletteChunkPacket(
             entries_to_skip = entries_to_skip,
@@ -202,9 +350,9 @@ def parse_old_palette_chunk(mem):
         packets = packets
     )
 
-    return old_palette_chunk, mem
+    return old_palette_chunk, offset
 
-@dataclass
+@record()
 class PaletteChunkEntry:
     red: int
     green: int
@@ -212,15 +360,12 @@ class PaletteChunkEntry:
     alpha: int
     color_name: str
 
-def parse_palette_chunk_entry(mem):
-    flag, mem = word(mem)
-    red, mem = byte(mem)
-    green, mem = byte(mem)
-    blue, mem = byte(mem)
-    alpha, mem = byte(mem)
+def parse_palette_chunk_entry(mem, offset=0):
+    flag, red, green, blue, alpha = _palette_entry_struct.unpack_from(mem, offset)
+    offset += _palette_entry_struct.size
     color_name = None
     if flag & (1 << 0):
-        color_name, mem = string(mem)
+        color_name, offset = string(mem, offset)
     palette_chunk_entry = PaletteChunkEntry(
         red = red,
         green = green,
@@ -228,51 +373,92 @@ def parse_palette_chunk_entry(mem):
         alpha = alpha,
         color_name = color_name
     )
-    return palette_chunk_entry, mem
+    return palette_chunk_entry, offset
 
-@dataclass
+@record()
 class PaletteChunk:
     new_palette_size: int
     first_color_index_to_change: int
     last_color_index_to_change: int
-    entries: list[PaletteChunkEntry]
+    # one byte per entry, struct-of-arrays
+    red: bytes
+    green: bytes
+    blue: bytes
+    alpha: bytes
+    color_names: dict[int, bytes] # by entry index, for named entries only
+
+    def __len__(self):
+        return len(self.red)
+
+    @property
+    def entries(self):
+        return [
+            PaletteChunkEntry(
+                red = red,
+                green = green,
+                blue = blue,
+                alpha = alpha,
+                color_name = self.color_names.get(i),
+            )
+            for i, (red, green, blue, alpha) in enumerate(zip(self.red, self.green, self.blue, self.alpha))
+        ]
 
-def parse_palette_chunk(mem):
-    new_palette_size, mem = dword(mem)
-    first_color_index_to_change, mem = dword(mem)
-    last_color_index_to_change, mem = dword(mem)
-    mem = skip(mem, 8)
+def parse_palette_chunk(mem, offset=0):
+    (
+        new_palette_size,
+        first_color_index_to_change,
+        last_color_index_to_change,
+    ) = _palette_header_struct.unpack_from(mem, offset)
+    offset += _palette_header_struct.size
     length = last_color_index_to_change - first_color_index_to_change
-    assert length > 0, length
-
-    entries = []
-
-    for _ in range(length + 1):
-        palette_chunk_entry, mem = parse_palette_chunk_entry(mem)
-        entries.append(palette_chunk_entry)
+    assert length >= 0, length
+    number_of_entries = length + 1
+
+    entry_size = _palette_entry_struct.size
+    entries = bytes(mem[offset:offset + number_of_entries * entry_size])
+    color_names = dict()
+    if not any(flag & (1 << 0) for flag in entries[0::entry_size]):
+        # no entry has a name, so every entry is the same size
+        assert len(entries) == number_of_entries * entry_size, len(entries)
+        offset += len(entries)
+    else:
+        entries = bytearray()
+        for i in range(number_of_entries):
+            entries += mem[offset:offset + entry_size]
+            palette_chunk_entry, offset = parse_palette_chunk_entry(mem, offset)
+            if palette_chunk_entry.color_name is not None:
+                color_names[i] = palette_chunk_entry.color_name
 
     palette_chunk = PaletteChunk(
         new_palette_size = new_palette_size,
         first_color_index_to_change = first_color_index_to_change,
         last_color_index_to_change = last_color_index_to_change,
-        entries = entries
+        red = bytes(entries[2::entry_size]),
+        green = bytes(entries[3::entry_size]),
+        blue = bytes(entries[4::entry_size]),
+        alpha = bytes(entries[5::entry_size]),
+        color_names = color_names,
     )
-    return palette_chunk, mem
+    return palette_chunk, offset
 
-@dataclass
+@record()
 class TilesetChunkExternal:
     id_of_external_file: int
     tileset_id_in_external_file: int
 
-@dataclass
+@record()
 class TilesetChunkInternal:
     data_length: int
-    pixel: memoryview
+    compressed: ZlibData
 
-@dataclass
+    @property
+    def pixel(self):
+        return self.compressed.data
+
+@record()
 class TilesetChunk:
     tileset_id: int
-    tileset_flags: HexInt
+    tileset_flags: int = hex_field()
     number_of_tiles: int
     tile_width: int
     tile_height: int
@@ -280,42 +466,53 @@ class TilesetChunk:
     name_of_tileset: str
     data: Union[TilesetChunkExternal, TilesetChunkInternal]
 
-def parse_tileset_chunk(mem):
+    def tile(self, tile_index):
+        """
+        Pixels of a single tile; only the tileset rows up to and including
+        this tile are decompressed.
+        """
+        assert type(self.data) is TilesetChunkInternal
+        assert 0 <= tile_index < self.number_of_tiles, tile_index
+        tile_size = self.tile_width * self.tile_height
+        return self.data.compressed.rows(tile_size, tile_index, tile_index + 1)
+
+def parse_tileset_chunk(mem, offset=0):
     _link_to_external_file = (1 << 0)
     _tiles_inside_this_file = (1 << 1)
 
-    tileset_id, mem = dword(mem)
-    tileset_flags, mem = dword(mem)
-    number_of_tiles, mem = dword(mem)
-    tile_width, mem = word(mem)
-    tile_height, mem = word(mem)
-    base_index, mem = short(mem)
-    mem = skip(mem, 14)
-    name_of_tileset, mem = string(mem)
+    (
+        tileset_id,
+        tileset_flags,
+        number_of_tiles,
+        tile_width,
+        tile_height,
+        base_index,
+    ) = _tileset_header_struct.unpack_from(mem, offset)
+    offset += _tileset_header_struct.size
+    name_of_tileset, offset = string(mem, offset)
 
     assert (tileset_flags & 0b11) != 0, tileset_flags
 
     data = None
     if tileset_flags & _link_to_external_file:
-        id_of_external_file, mem = dword(mem)
-        tileset_id_in_external_file, mem = dword(mem)
+        id_of_external_file, offset = dword(mem, offset)
+        tileset_id_in_external_file, offset = dword(mem, offset)
         data = TilesetChunkExternal(
             id_of_external_file,
             tileset_id_in_external_file,
         )
     elif tileset_flags & _tiles_inside_this_file:
-        data_length, mem = dword(mem)
-        pixel = mem[0:data_length]
-
-        mem = skip(mem, data_length)
+        data_length, offset = dword(mem, offset)
+        pixel = mem[offset:offset + data_length]
+        offset += data_length
         data = TilesetChunkInternal(
             data_length,
-            zlib.decompress(pixel),
+            ZlibData(pixel),
         )
 
     tileset_chunk = TilesetChunk(
         tileset_id = tileset_id,
-        tileset_flags = HexInt(tileset_flags),
+        tileset_flags = tileset_flags,
         number_of_tiles = number_of_tiles,
         tile_width = tile_width,
         tile_height = tile_height,
@@ -324,9 +521,9 @@ def parse_tileset_chunk(mem):
         data = data,
     )
 
-    return tileset_chunk, mem
+    return tileset_chunk, offset
 
-@dataclass
+@record()
 class LayerChunk:
     flags: int
     layer_type: int
@@ -339,22 +536,24 @@ class LayerChunk:
     tileset_index: Optional[int]
     layer_uuid: Optional[bytes]
 
-def parse_layer_chunk(mem, header_flags):
-    flags, mem = word(mem)
-    layer_type, mem = word(mem)
-    layer_child_level, mem = word(mem)
-    default_layer_width_in_pixels, mem = word(mem)
-    default_layer_height_in_pixels, mem = word(mem)
-    blend_mode, mem = word(mem)
-    opacity, mem = byte(mem)
-    mem = skip(mem, 3)
-    layer_name, mem = string(mem)
+def parse_layer_chunk(mem, header_flags, offset=0):
+    (
+        flags,
+        layer_type,
+        layer_child_level,
+        default_layer_width_in_pixels,
+        default_layer_height_in_pixels,
+        blend_mode,
+        opacity,
+    ) = _layer_header_struct.unpack_from(mem, offset)
+    offset += _layer_header_struct.size
+    layer_name, offset = string(mem, offset)
     tileset_index = None
     if layer_type == 2:
-        tileset_index, mem = dword(mem)
+        tileset_index, offset = dword(mem, offset)
     layer_uuid = None
     if header_flags & (1 << 3):
-        layer_uuid, mem = uuid(mem)
+        layer_uuid, offset = uuid(mem, offset)
 
     layer_chunk = LayerChunk(
         flags = flags,
@@ -369,36 +568,120 @@ def parse_layer_chunk(mem, header_flags):
         layer_uuid = layer_uuid,
     )
 
-    return layer_chunk, mem
+    return layer_chunk, offset
 
-@dataclass
+@record()
 class CelChunk_RawImageData:
     width_in_pixels: int
     height_in_pixes: int
     pixel: memoryview
 
-@dataclass
+@record()
 class CelChunk_LinkedCell:
     frame_position: int
 
-@dataclass
+@record()
 class CelChunk_CompressedImage:
     width_in_pixels: int
     height_in_pixels: int
-    pixel: memoryview
+    compressed: ZlibData
+
+    @property
+    def pixel(self):
+        return memoryview(self.compressed.data)
+
+    def rows(self, start, stop):
+        return self.compressed.rows(self.width_in_pixels, start, stop)
 
-@dataclass
+@record("_tile")
 class CelChunk_CompressedTilemap:
     width_in_number_of_tiles: int
     height_in_number_of_tiles: int
     bits_per_tile: int
-    bitmask_for_tile_id: int
-    bitmask_for_x_flip: int
-    bitmask_for_y_flip: int
-    bitmask_for_diagonal_flip: int
-    tile: memoryview
-
-@dataclass
+    bitmask_for_tile_id: int = hex_field()
+    bitmask_for_x_flip: int = hex_field()
+    bitmask_for_y_flip: int = hex_field()
+    bitmask_for_diagonal_flip: int = hex_field()
+    compressed: ZlibData
+
+    def __post_init__(self):
+        self._tile = None
+
+    @property
+    def tile(self):
+        """
+        Flat, row-major uint32 view of the tilemap: a numpy '<u4' array when
+        numpy is available, otherwise an array('I').
+        """
+        if self._tile is not None:
+            return self._tile
+        tile_mem = self.compressed.data
+        assert len(tile_mem) % 4 == 0
+        if numpy is not None:
+            tile = numpy.frombuffer(tile_mem, dtype="<u4")
+        else:
+            tile = array(_uint32_typecode)
+            tile.frombytes(tile_mem)
+            if sys.byteorder != "little":
+                tile.byteswap()
+        self._tile = tile
+        return tile
+
+    @tile.setter
+    def tile(self, tile):
+        """
+        Replace the tilemap with tile (flat and row-major, like the getter
+        returns); it is compressed again when written.
+        """
+        assert len(tile) == self.width_in_number_of_tiles * self.height_in_number_of_tiles, len(tile)
+        assert self.bits_per_tile == 32, self.bits_per_tile
+        if numpy is not None:
+            tile = numpy.asarray(tile, dtype="<u4")
+            data = tile.tobytes()
+        else:
+            tile = array(_uint32_typecode, tile)
+            if sys.byteorder != "little":
+                swapped = array(_uint32_typecode, tile)
+                swapped.byteswap()
+                data = swapped.tobytes()
+            else:
+                data = tile.tobytes()
+        self.compressed = ZlibData.uncompressed(data)
+        self._tile = tile
+
+    @property
+    def tile_map(self):
+        """
+        The tilemap as a 2D [y, x] uint32 array, sharing memory with tile.
+        """
+        shape = (self.height_in_number_of_tiles, self.width_in_number_of_tiles)
+        if numpy is not None:
+            return self.tile.reshape(shape)
+        return memoryview(self.tile).cast("B").cast(_uint32_typecode, shape)
+
+    def _masked(self, mask):
+        if numpy is not None:
+            return self.tile & numpy.uint32(mask)
+        return array(_uint32_typecode, [t & mask for t in self.tile])
+
+    def _flag(self, mask):
+        if numpy is not None:
+            return self._masked(mask) != 0
+        return array("B", [(t & mask) != 0 for t in self.tile])
+
+    def tile_id(self):
+        return self._masked(self.bitmask_for_tile_id)
+
+    def x_flip(self):
+        return self._flag(self.bitmask_for_x_flip)
+
+    def y_flip(self):
+        return self._flag(self.bitmask_for_y_flip)
+
+    def diagonal_flip(self):
+        return self._flag(self.bitmask_for_diagonal_flip)
+
+@record("__weakref__")
 class CelChunk:
     layer_index: int
     x_position: int
@@ -412,63 +695,65 @@ class CelChunk:
                 CelChunk_CompressedImage,
                 CelChunk_CompressedTilemap]
 
-def parse_cel_chunk(mem):
-    layer_index, mem = word(mem)
-    x_position, mem = short(mem)
-    y_position, mem = short(mem)
-    opacity_level, mem = byte(mem)
-    cel_type, mem = word(mem)
-    z_index, mem = short(mem)
-    mem = skip(mem, 5)
+def parse_cel_chunk(mem, offset=0):
+    (
+        layer_index,
+        x_position,
+        y_position,
+        opacity_level,
+        cel_type,
+        z_index,
+    ) = _cel_header_struct.unpack_from(mem, offset)
+    offset += _cel_header_struct.size
 
     assert cel_type in {0, 1, 2, 3}, cel_type
 
     data = None
     if cel_type == 0:
-        width_in_pixels, mem = word(mem)
-        height_in_pixels, mem = word(mem)
-        pixel = mem
+        width_in_pixels, height_in_pixels = _cel_image_header_struct.unpack_from(mem, offset)
+        offset += _cel_image_header_struct.size
+        pixel = mem[offset:]
+        offset = len(mem)
         data = CelChunk_RawImageData(
             width_in_pixels,
             height_in_pixels,
             pixel,
         )
     if cel_type == 1:
-        frame_position, mem = word(mem)
+        frame_position, offset = word(mem, offset)
         data = CelChunk_LinkedCell(frame_position)
     if cel_type == 2:
-        width_in_pixels, mem = word(mem)
-        height_in_pixels, mem = word(mem)
-        pixel = memoryview(zlib.decompress(mem))
+        width_in_pixels, height_in_pixels = _cel_image_header_struct.unpack_from(mem, offset)
+        offset += _cel_image_header_struct.size
+        compressed = ZlibData(mem[offset:])
+        offset = len(mem)
         data = CelChunk_CompressedImage(
             width_in_pixels,
             height_in_pixels,
-            pixel,
+            compressed,
         )
     if cel_type == 3:
-        width_in_number_of_tiles, mem = word(mem)
-        height_in_number_of_tiles, mem = word(mem)
-        bits_per_tile, mem = word(mem)
-        bitmask_for_tile_id, mem = dword(mem)
-        bitmask_for_x_flip, mem = dword(mem)
-        bitmask_for_y_flip, mem = dword(mem)
-        bitmask_for_diagonal_flip, mem = dword(mem)
-        mem = skip(mem, 10)
-        tile_mem = memoryview(zlib.decompress(mem))
-        assert len(tile_mem) % 4 == 0
-        tile = [
-            struct.unpack("<I", tile_mem[i*4:i*4+4])[0]
-            for i in range(len(tile_mem) // 4)
-        ]
+        (
+            width_in_number_of_tiles,
+            height_in_number_of_tiles,
+            bits_per_tile,
+            bitmask_for_tile_id,
+            bitmask_for_x_flip,
+            bitmask_for_y_flip,
+            bitmask_for_diagonal_flip,
+        ) = _tilemap_header_struct.unpack_from(mem, offset)
+        offset += _tilemap_header_struct.size
+        compressed = ZlibData(mem[offset:])
+        offset = len(mem)
         data = CelChunk_CompressedTilemap(
             width_in_number_of_tiles = width_in_number_of_tiles,
             height_in_number_of_tiles = height_in_number_of_tiles,
             bits_per_tile = bits_per_tile,
-            bitmask_for_tile_id = HexInt(bitmask_for_tile_id),
-            bitmask_for_x_flip = HexInt(bitmask_for_x_flip),
-            bitmask_for_y_flip = HexInt(bitmask_for_y_flip),
-            bitmask_for_diagonal_flip = HexInt(bitmask_for_diagonal_flip),
-            tile = tile,
+            bitmask_for_tile_id = bitmask_for_tile_id,
+            bitmask_for_x_flip = bitmask_for_x_flip,
+            bitmask_for_y_flip = bitmask_for_y_flip,
+            bitmask_for_diagonal_flip = bitmask_for_diagonal_flip,
+            compressed = compressed,
         )
 
     cel_chunk = CelChunk(
@@ -481,15 +766,21 @@ def parse_cel_chunk(mem):
         data = data,
     )
 
-    return cel_chunk, mem
+    return cel_chunk, offset
 
 
-def parse_file(mem):
-    header, mem = parse_header(mem)
-    #pprint(header)
-    assert header.color_depth == 8, header.color_depth
+@record()
+class Frame:
+    frame_index: int
+    frame_header: FrameHeader
+    tilesets: dict[int, TilesetChunk] # by tileset id
+    layers: list[LayerChunk]
+    palette: Optional[Union[PaletteChunk, OldPaletteChunk]]
+    cel_chunks: dict[int, CelChunk] # by layer index
 
-    frame_header, mem = parse_frame_header(mem)
+def parse_frame(mem, header, frame_index, offset):
+    frame_offset = offset
+    frame_header, offset = parse_frame_header(mem, offset)
     #pprint(frame_header)
 
     tilesets = dict() # by tileset id
@@ -497,9 +788,9 @@ def parse_file(mem):
     palette = None
     cel_chunks = dict() # by layer index
 
-    for _ in range(frame_header.number_of_chunks):
-        chunk, mem = parse_chunk(mem)
+    for _, chunk in iter_chunks(mem, offset, frame_header.number_of_chunks):
         #pprinti(chunk, 1)
+        instrument.count(f"chunk {chunk.chunk_type:#06x}")
         if chunk.chunk_type == 0x4:
             old_palette_chunk, _ = parse_old_palette_chunk(chunk.data)
             #pprinti(old_palette_chunk, 2)
@@ -517,7 +808,8 @@ def parse_file(mem):
             #pprinti(tileset_chunk, 2)
         elif chunk.chunk_type == 0x2004:
             layer_chunk, _ = parse_layer_chunk(chunk.data, header.flags)
-            assert layer_chunk.layer_type == 2
+            # normal (image), group or tilemap
+            assert layer_chunk.layer_type in {0, 1, 2}, layer_chunk.layer_type
             layers.append(layer_chunk)
             #pprinti(layer_chunk, 2)
         elif chunk.chunk_type == 0x2005:
@@ -532,9 +824,283 @@ def parse_file(mem):
             # color profile
             pass
         else:
-            print("unhandled chunk: ")
-            pprinti(chunk, 1)
+            print("unhandled chunk:", chunk.chunk_type, file=sys.stderr)
+
+    frame = Frame(
+        frame_index = frame_index,
+        frame_header = frame_header,
+        tilesets = tilesets,
+        layers = layers,
+        palette = palette,
+        cel_chunks = cel_chunks,
+    )
+
+    return frame, frame_offset + frame_header.bytes_in_this_frame
+
+class FrameSequence:
+    """
+    Random-access, lazily parsed view of every frame in an .aseprite file.
+
+    Frame offsets are found by following FrameHeader.bytes_in_this_frame, so
+    indexing frame N only parses frame N. Cels are shared through weak
+    references while any frame still holds them; beyond that only the
+    linked_cel_cache_size most recently used link targets are kept, so
+    memory stays bounded however long the animation is.
+    """
+
+    linked_cel_cache_size = 4
+
+    def __init__(self, mem):
+        self.mem = as_memoryview(mem)
+        self.header, offset = parse_header(self.mem)
+        assert self.header.color_depth == 8, self.header.color_depth
+
+        self.offsets = []
+        for _ in range(self.header.frames):
+            self.offsets.append(offset)
+            bytes_in_this_frame, _ = dword(self.mem, offset)
+            assert bytes_in_this_frame >= _frame_header_struct.size, bytes_in_this_frame
+            offset += bytes_in_this_frame
+
+        # (frame index, layer index) -> CelChunk
+        self._cels = weakref.WeakValueDictionary()
+        # the most recently resolved link targets, oldest first
+        self._linked_cels = OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, frame_index):
+        if frame_index < 0:
+            frame_index += len(self.offsets)
+        if not (0 <= frame_index < len(self.offsets)):
+            raise IndexError(frame_index)
+
+        frame, _ = parse_frame(self.mem, self.header, frame_index, self.offsets[frame_index])
+        for layer_index, cel_chunk in frame.cel_chunks.items():
+            if type(cel_chunk.data) is CelChunk_LinkedCell:
+                frame.cel_chunks[layer_index] = self.linked_cel(cel_chunk)
+            else:
+                self._cels[(frame_index, layer_index)] = cel_chunk
+        return frame
+
+    def __iter__(self):
+        for frame_index in range(len(self.offsets)):
+            yield self[frame_index]
+
+    def cel(self, frame_index, layer_index):
+        """
+        Parse only the cel for layer_index in frame_index, or None if that
+        frame has no cel for the layer.
+        """
+        key = (frame_index, layer_index)
+        cel_chunk = self._cels.get(key)
+        if cel_chunk is not None:
+            return cel_chunk
+
+        frame_header, offset = parse_frame_header(self.mem, self.offsets[frame_index])
+        for _, chunk in iter_chunks(self.mem, offset, frame_header.number_of_chunks):
+            if chunk.chunk_type != 0x2005:
+                continue
+            chunk_layer_index, _ = word(chunk.data, 0)
+            if chunk_layer_index != layer_index:
+                continue
+            cel_chunk, _ = parse_cel_chunk(chunk.data)
+            self._cels[key] = cel_chunk
+            return cel_chunk
+        return None
+
+    def linked_cel(self, cel_chunk):
+        """
+        Resolve a CelChunk_LinkedCell to the CelChunk it refers to.
+        """
+        key = (cel_chunk.data.frame_position, cel_chunk.layer_index)
+        linked = self._linked_cels.get(key)
+        if linked is not None:
+            self._linked_cels.move_to_end(key)
+            return linked
+        linked = self.cel(*key)
+        assert linked is not None, key
+        assert type(linked.data) is not CelChunk_LinkedCell, key
+        self._linked_cels[key] = linked
+        if len(self._linked_cels) > self.linked_cel_cache_size:
+            self._linked_cels.popitem(last=False)
+        return linked
+
+class ChunkIndex:
+    """
+    Table of contents of an .aseprite file: the frame, type, offset and
+    size of every chunk, plus the layer index of every cel chunk (-1 for
+    other chunks). Stored as parallel arrays; cel(), find() and chunk()
+    seek straight to the chunk bytes.
+    """
+
+    _magic = b"ACIX"
+    _version = 2
+    # magic, version, number of chunks, file size, file modification time
+    _header_struct = struct.Struct("<4sHIQQ")
+    _typecodes = (
+        ("frame_index", _uint32_typecode),
+        ("chunk_type", "H"),
+        ("offset", "Q"),
+        ("chunk_size", _uint32_typecode),
+        ("layer_index", "i"),
+    )
+
+    def __init__(self, file_size=0, mtime_ns=0):
+        self.file_size = file_size
+        # st_mtime_ns of the indexed file, when known
+        self.mtime_ns = mtime_ns
+        for name, typecode in self._typecodes:
+            setattr(self, name, array(typecode))
+        self._cels = None
+
+    def __len__(self):
+        return len(self.offset)
+
+    @classmethod
+    def build(cls, mem):
+        mem = as_memoryview(mem)
+        index = cls(len(mem))
+        header, offset = parse_header(mem)
+        for frame_index in range(header.frames):
+            frame_header, chunk_offset = parse_frame_header(mem, offset)
+            for chunk_offset, chunk in iter_chunks(mem, chunk_offset, frame_header.number_of_chunks):
+                layer_index = -1
+                if chunk.chunk_type == 0x2005:
+                    layer_index, _ = word(chunk.data, 0)
+                index.frame_index.append(frame_index)
+                index.chunk_type.append(chunk.chunk_type)
+                index.offset.append(chunk_offset)
+                index.chunk_size.append(chunk.chunk_size)
+                index.layer_index.append(layer_index)
+            offset += frame_header.bytes_in_this_frame
+        return index
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self._header_struct.pack(self._magic, self._version, len(self), self.file_size, self.mtime_ns))
+            for name, _ in self._typecodes:
+                a = getattr(self, name)
+                if sys.byteorder != "little":
+                    a = array(a.typecode, a)
+                    a.byteswap()
+                a.tofile(f)
+
+    @classmethod
+    def load(cls, filename, mem=None, mtime_ns=None):
+        """
+        Load a sidecar written by save(). Returns None if it does not exist,
+        is not a chunk index, or was built from a file of a different size
+        than mem or a different modification time than mtime_ns (when
+        given).
+        """
+        try:
+            with open(filename, "rb") as f:
+                buf = f.read()
+        except FileNotFoundError:
+            return None
+        if len(buf) < cls._header_struct.size:
+            return None
+        magic, version, length, file_size, file_mtime_ns = cls._header_struct.unpack_from(buf, 0)
+        if magic != cls._magic or version != cls._version:
+            return None
+        if mem is not None and len(mem) != file_size:
+            return None
+        # an edit can move chunks without changing the file size
+        if mtime_ns is not None and mtime_ns != file_mtime_ns:
+            return None
+
+        index = cls(file_size, file_mtime_ns)
+        offset = cls._header_struct.size
+        for name, _ in cls._typecodes:
+            a = getattr(index, name)
+            size = length * a.itemsize
+            if offset + size > len(buf):
+                return None
+            a.frombytes(buf[offset:offset + size])
+            if sys.byteorder != "little":
+                a.byteswap()
+            offset += size
+        return index
+
+    @classmethod
+    def for_file(cls, filename, mem=None, persist=True):
+        """
+        The chunk index for filename, from its "<filename>.idx" sidecar when
+        it was built from a file of the same size and modification time,
+        otherwise built (and, if persist, saved).
+        """
+        # before mapping, so that an edit made meanwhile is not recorded as
+        # indexed
+        mtime_ns = os.stat(filename).st_mtime_ns
+        if mem is None:
+            mem = map_file(filename)
+        sidecar = filename + ".idx"
+        index = cls.load(sidecar, mem, mtime_ns)
+        if index is None:
+            index = cls.build(mem)
+            index.mtime_ns = mtime_ns
+            if persist:
+                index.save(sidecar)
+        return index
+
+    def find(self, chunk_type, frame_index=None):
+        """
+        Positions in the index of every chunk of chunk_type, optionally only
+        within frame_index.
+        """
+        return [
+            i for i, t in enumerate(self.chunk_type)
+            if t == chunk_type and (frame_index is None or self.frame_index[i] == frame_index)
+        ]
+
+    def chunk(self, mem, i):
+        chunk, _ = parse_chunk(mem, self.offset[i])
+        return chunk
+
+    def cel(self, mem, layer_index, frame_index):
+        """
+        Parse the cel for layer_index in frame_index, or return None if that
+        frame has no cel for the layer.
+        """
+        if self._cels is None:
+            self._cels = {
+                (self.frame_index[i], self.layer_index[i]): i
+                for i in range(len(self))
+                if self.layer_index[i] >= 0
+            }
+        i = self._cels.get((frame_index, layer_index))
+        if i is None:
+            return None
+        cel_chunk, _ = parse_cel_chunk(self.chunk(mem, i).data)
+        return cel_chunk
+
+def iter_frames(mem):
+    return iter(FrameSequence(mem))
+
+def iter_file_chunks(mem):
+    """
+    Yield (frame index, Chunk) for every chunk of every frame, in file
+    order. The chunk payloads are zero-copy views of mem, so when mem is
+    memory-mapped, stopping early never pages in the rest of the file.
+    """
+    mem = as_memoryview(mem)
+    header, offset = parse_header(mem)
+    for frame_index in range(header.frames):
+        frame_header, chunk_offset = parse_frame_header(mem, offset)
+        for _, chunk in iter_chunks(mem, chunk_offset, frame_header.number_of_chunks):
+            yield frame_index, chunk
+        offset += frame_header.bytes_in_this_frame
+
+def parse_file(mem):
+    mem = as_memoryview(mem)
+    header, offset = parse_header(mem)
+    #pprint(header)
+    assert header.color_depth == 8, header.color_depth
+
+    frame, _ = parse_frame(mem, header, 0, offset)
 
-    assert palette is not None
+    assert frame.palette is not None
 
-    return tilesets, layers, palette, cel_chunks
+    return frame.tilesets, frame.layers, frame.palette, frame.cel_chunks
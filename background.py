@@ -1,168 +1,1150 @@
+import io
 import sys
+import os
+import glob
+import argparse
+import json
+import functools
+import itertools
+import contextlib
+from dataclasses import dataclass, asdict, replace
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pprint import pprint, pformat
 import textwrap
-import struct
 from operator import itemgetter
+from array import array
 
-from aseprite import parse_file
-from aseprite import PaletteChunk, OldPaletteChunk, TilesetChunkInternal, CelChunk_CompressedTilemap
+from aseprite import parse_header, parse_file, map_file, numpy, _uint32_typecode, FrameSequence
+from aseprite import TilesetChunkInternal, CelChunk, CelChunk_CompressedTilemap, CelChunk_LinkedCell
+from cache import BuildCache
+import animation
+import bank
+import bundle
+import compress
+import cram
+import dedup
+import instrument
+import plane
+import sprite
+import tilize
+import vram
 
 def pprinti(o, i):
     s = pformat(o)
     print(textwrap.indent(s, '    ' * i))
 
-def pack_bgr555(red, green, blue):
-    bgr = (
-        ((red >> 3) << 0) |
-        ((green >> 3) << 5) |
-        ((blue >> 3) << 10)
+@dataclass
+class Options:
+    cram_mode: int = 0
+    quantize: str = "truncate"
+    dedup: bool = False
+    one_word: bool = False
+    character_base: int = 0
+    # plane size in pages, (width, height); None to choose from the map size
+    plane_size: tuple = None
+    strips: bool = False
+    bpp: int = 8
+    plan: bool = False
+    # color RAM index palette.bin is loaded at
+    cram_offset: int = 0
+    # "rle" or "lzss" for character patterns and pattern name tables
+    compress: str = None
+    compress_level: int = 6
+    sprites: bool = False
+    # VDP1 VRAM address of sprite_characters.bin
+    sprite_address: int = 0
+    tilemap_deltas: bool = False
+    # bytes of pattern name data a frame may write during VBlank
+    vblank_budget: int = 4096
+    # (tile width, tile height) to slice image layers into tilesets and
+    # tilemaps
+    tilize: tuple = None
+    # print statistics (tiles, banks, layouts, formats) on stderr; they are
+    # recorded in the instrument report either way
+    verbose: bool = False
+
+def write_output(filename, data):
+    with open(filename, "wb") as f:
+        f.write(data)
+
+        print(filename, f.tell(), file=sys.stderr)
+
+def pack_palette(filename, palette, options=Options()):
+    write_output(filename, cram.pack_palette(palette, options.cram_mode, options.quantize))
+
+def pack_character_cells(pixel, tile_width, tile_height, number_of_tiles):
+    """
+    Reorder tile-major, row-major pixel data into VDP2 character order: each
+    tile becomes its (tile_width // 8) x (tile_height // 8) grid of 8x8
+    cells, left to right then top to bottom, each cell row-major.
+    """
+    assert tile_width % 8 == 0, tile_width
+    assert tile_height % 8 == 0, tile_height
+    x_cells = tile_width // 8
+    y_cells = tile_height // 8
+    tile_size = tile_width * tile_height
+    assert len(pixel) >= tile_size * number_of_tiles, (len(pixel), tile_size, number_of_tiles)
+    pixel = memoryview(pixel)[:tile_size * number_of_tiles]
+
+    if x_cells == 1:
+        # a single column of cells is already in character order
+        return bytes(pixel)
+
+    if numpy is not None:
+        a = numpy.frombuffer(pixel, dtype=numpy.uint8)
+        a = a.reshape(number_of_tiles, y_cells, 8, x_cells, 8)
+        return a.transpose(0, 1, 3, 2, 4).tobytes()
+
+    # one strided copy per byte position within a tile, across every tile
+    buf = bytearray(tile_size * number_of_tiles)
+    for cell_y in range(y_cells):
+        for cell_x in range(x_cells):
+            cell_ix = cell_y * x_cells + cell_x
+            for y in range(8):
+                for x in range(8):
+                    src = (cell_y * 8 + y) * tile_width + cell_x * 8 + x
+                    dst = cell_ix * 8 * 8 + y * 8 + x
+                    buf[dst::tile_size] = pixel[src::tile_size]
+    return bytes(buf)
+
+def character_patterns(tileset_chunk):
+    assert type(tileset_chunk.data) == TilesetChunkInternal
+    return pack_character_cells(
+        tileset_chunk.data.pixel,
+        tileset_chunk.tile_width,
+        tileset_chunk.tile_height,
+        tileset_chunk.number_of_tiles,
     )
-    return struct.pack(">H", bgr)
 
-def pack_index(i):
-    return struct.pack(">I", i)
+def pack_character_patterns(filename, tileset_chunk):
+    write_output(filename, character_patterns(tileset_chunk))
+
+def pattern_name_data(tilemap, remap=None):
+    """
+    2-word pattern name data for every cell of a CelChunk_CompressedTilemap,
+    in map (row-major) order. remap (see dedup.deduplicate) replaces each
+    tile id with the pattern name data of its deduplicated tile, whose flips
+    are combined with the flips of the cell.
+    """
+    tile_id_mask = tilemap.bitmask_for_tile_id
+    x_flip_mask = tilemap.bitmask_for_x_flip
+    y_flip_mask = tilemap.bitmask_for_y_flip
+
+    if numpy is not None:
+        pattern = tilemap.tile_id()
+        if remap is not None:
+            pattern = numpy.frombuffer(remap, dtype=numpy.uint32)[pattern]
+        pattern ^= tilemap.x_flip().astype(numpy.uint32) << numpy.uint32(30)
+        pattern ^= tilemap.y_flip().astype(numpy.uint32) << numpy.uint32(31)
+        return pattern
+
+    def tile_pattern(tile_id):
+        return tile_id if remap is None else remap[tile_id]
+
+    # maps are made of relatively few distinct tiles; translate each distinct
+    # value once and map the whole tilemap through the lookup
+    lookup = {
+        tile_data: (
+            (int((tile_data & y_flip_mask) != 0) << 31)
+            ^ (int((tile_data & x_flip_mask) != 0) << 30)
+            ^ tile_pattern(tile_data & tile_id_mask)
+        )
+        for tile_data in set(tilemap.tile)
+    }
+    return array(_uint32_typecode, map(lookup.__getitem__, tilemap.tile))
+
+def paged_pattern_name_data(cel_chunk, x_cells, y_cells, remap=None, plane_size=None):
+    """
+    pattern_name_data() for cel_chunk, with the map split into x_cells by
+    y_cells pages, in page order (see plane.page_order()).
+    """
+    assert type(cel_chunk.data) == CelChunk_CompressedTilemap
+    layout = plane.plane_layout(
+        cel_chunk.data.width_in_number_of_tiles,
+        cel_chunk.data.height_in_number_of_tiles,
+        x_cells,
+        y_cells,
+        plane_size,
+    )
+    return plane.page_order(pattern_name_data(cel_chunk.data, remap), layout)
+
+def resolve_character_numbers(table, character_base, character_units):
+    """
+    Replace the tile id in each of the 2-word pattern name data in table
+    with its character number: character_base + tile id * character_units.
+    Raises ValueError if a character number is wider than 15 bits.
+    """
+    if numpy is not None:
+        character = (table & numpy.uint32(0x7fff)) * numpy.uint32(character_units) + numpy.uint32(character_base)
+        if len(character) and int(character.max()) > 0x7fff:
+            raise ValueError(f"character number {int(character.max()):#x} is wider than 15 bits")
+        return (table & numpy.uint32(0xffff8000)) | character
+
+    lookup = dict()
+    for pattern in set(table):
+        character = character_base + (pattern & 0x7fff) * character_units
+        if character > 0x7fff:
+            raise ValueError(f"character number {character:#x} is wider than 15 bits")
+        lookup[pattern] = (pattern & 0xffff8000) | character
+    return array(_uint32_typecode, map(lookup.__getitem__, table))
+
+def pattern_name_table(cel_chunk, x_cells, y_cells, remap=None, plane_size=None,
+                       character_base=None, character_units=1):
+    """
+    Big-endian 2-word pattern name table for cel_chunk, as bytes, with the
+    map split into x_cells by y_cells pages written in page order. Entries
+    hold tile ids, or with a character_base, character numbers (see
+    resolve_character_numbers()).
+    """
+    table = paged_pattern_name_data(cel_chunk, x_cells, y_cells, remap, plane_size)
+    if character_base is not None:
+        table = resolve_character_numbers(table, character_base, character_units)
+    if numpy is not None:
+        return table.astype(">u4").tobytes()
+    if sys.byteorder == "little":
+        table.byteswap()
+    return table.tobytes()
+
+@dataclass
+class OneWordPatternNameTable:
+    # big-endian 1-word pattern name data, in page order
+    data: bytes
+    # PNCN "auxiliary mode": 0 (x/y flip, 10-bit character numbers) or 1
+    # (no flip, 12-bit character numbers)
+    auxiliary_mode: int
+    # PNCN supplementary character number (SCN4-SCN0)
+    supplementary_character_number: int
 
-def pack_old_palette_chunk(old_palette_chunk):
-    with open("palette.bin", "wb") as f:
-        for color in old_palette_chunk.packets[0].colors:
-            f.write(pack_bgr555(*color))
+# how the 15-bit character number is split between 1-word pattern name data
+# and the 5-bit supplementary character number, by (auxiliary mode,
+# character size):
+#   (pattern name data bits, low character bits taken from SCN1-SCN0,
+#    position in SCN4-SCN0 of the character bits above the pattern name data)
+_one_word_layouts = {
+    (0, 1): (10, 0, 0),
+    (0, 2): (10, 2, 2),
+    (1, 1): (12, 0, 2),
+    (1, 2): (12, 2, 4),
+}
 
-def pack_palette_chunk(palette_chunk):
-    with open("palette.bin", "wb") as f:
-        assert palette_chunk.first_color_index_to_change == 0
+def _one_word_entry(pattern, auxiliary_mode, character_size, character_base, character_units, colors):
+    """
+    Convert one 2-word pattern name data value to 1-word, returning (1-word
+    value, supplementary character number). Raises ValueError if the value
+    cannot be represented.
+    """
+    field_bits, low_bits, high_shift = _one_word_layouts[(auxiliary_mode, character_size)]
+    y_flip = (pattern >> 31) & 1
+    x_flip = (pattern >> 30) & 1
+    palette = (pattern >> 16) & 0x7f
+    character = character_base + (pattern & 0x7fff) * character_units
 
-        for entry in palette_chunk.entries:
-            color = (entry.red, entry.green, entry.blue)
-            f.write(pack_bgr555(*color))
+    if character > 0x7fff:
+        raise ValueError(f"character number {character:#x} is wider than 15 bits")
+    if auxiliary_mode == 1 and (x_flip or y_flip):
+        raise ValueError("flipped cells need auxiliary mode 0")
 
-        print("palette.bin", f.tell(), file=sys.stderr)
+    low = character & ((1 << low_bits) - 1)
+    field = (character >> low_bits) & ((1 << field_bits) - 1)
+    high = character >> (low_bits + field_bits)
+    supplementary = (high << high_shift) | low
 
-def pack_palette(palette):
-    if type(palette) is PaletteChunk:
-        pack_palette_chunk(palette)
-    elif type(palette) is OldPaletteChunk:
-        pack_old_palette_chunk(palette)
+    if colors == 16:
+        if palette > 0xf:
+            raise ValueError(f"palette number {palette:#x} is wider than 4 bits")
+        palette_bits = palette << 12
     else:
-        assert False, type(palette)
+        if palette & 0xf:
+            raise ValueError(f"palette number {palette:#x} is not a multiple of 16")
+        palette_bits = (palette >> 4) << 12
 
-def pack_character_2x2(tileset_chunk, offset):
-    #tileset_chunk.number_of_tiles,
-    #tileset_chunk.tile_width,
-    #tileset_chunk.tile_height,
+    if auxiliary_mode == 0:
+        value = palette_bits | (y_flip << 11) | (x_flip << 10) | field
+    else:
+        value = palette_bits | field
+    return value, supplementary
 
-    assert tileset_chunk.tile_width == 16
-    assert tileset_chunk.tile_height == 16
-    assert type(tileset_chunk.data) == TilesetChunkInternal
+def one_word_pattern_name_table(cel_chunk, x_cells, y_cells, character_size, character_units,
+                                character_base=0, colors=256, remap=None, plane_size=None):
+    """
+    Big-endian 1-word pattern name table for cel_chunk, in the same page order
+    as pattern_name_table(). Tile ids are converted to character numbers
+    (character_base + tile id * character_units, in 0x20-byte units);
+    character_size is 1 for 1x1 cells or 2 for 2x2 cells.
+
+    Auxiliary mode 0 is used when it fits, otherwise mode 1 (which has no
+    flips). Raises ValueError, with the reason, when the layer cannot be
+    represented in either mode.
+    """
+    assert character_size in (1, 2), character_size
+    assert colors in (16, 256), colors
+    table = paged_pattern_name_data(cel_chunk, x_cells, y_cells, remap, plane_size)
 
-    buf = bytearray(16 * 16)
+    # convert each distinct value once
+    if numpy is not None:
+        distinct, inverse = numpy.unique(table, return_inverse=True)
+        distinct = distinct.tolist()
+    else:
+        distinct = sorted(set(table))
 
-    for cell_ix in range(4):
-        for y in range(8):
-            for x in range(8):
-                tileset_x = 8 * (cell_ix % 2) + x
-                tileset_y = 8 * (cell_ix // 2) + y
-                px = tileset_chunk.data.pixel[offset + tileset_y * 16 + tileset_x]
-                buf[cell_ix * 8 * 8 + y * 8 + x] = px
+    errors = []
+    for auxiliary_mode in (0, 1):
+        try:
+            lookup = dict()
+            supplementary = None
+            for pattern in distinct:
+                value, pattern_supplementary = _one_word_entry(
+                    pattern, auxiliary_mode, character_size, character_base, character_units, colors,
+                )
+                if supplementary is None:
+                    supplementary = pattern_supplementary
+                elif supplementary != pattern_supplementary:
+                    raise ValueError(
+                        f"character numbers need different supplementary character numbers "
+                        f"({supplementary:#x} and {pattern_supplementary:#x})"
+                    )
+                lookup[pattern] = value
+        except ValueError as e:
+            errors.append(f"auxiliary mode {auxiliary_mode}: {e}")
+            continue
 
-    return bytes(buf)
+        if numpy is not None:
+            values = numpy.array([lookup[pattern] for pattern in distinct], dtype=">u2")
+            data = values[inverse.reshape(-1)].tobytes()
+        else:
+            values = array("H", map(lookup.__getitem__, table))
+            if sys.byteorder == "little":
+                values.byteswap()
+            data = values.tobytes()
+
+        return OneWordPatternNameTable(
+            data = data,
+            auxiliary_mode = auxiliary_mode,
+            supplementary_character_number = supplementary or 0,
+        )
 
-def pack_character_1x1(tileset_chunk, offset):
-    assert tileset_chunk.tile_width == 8
-    assert tileset_chunk.tile_height == 8
+    raise ValueError("; ".join(errors))
+
+def pack_pattern_name_table(filename, cel_chunk, x_cells, y_cells, plane_size=None):
+    write_output(filename, pattern_name_table(cel_chunk, x_cells, y_cells, plane_size=plane_size))
+
+def zlib_key(zlib_data):
+    # new data (see ZlibData.uncompressed()) has no compressed stream
+    return zlib_data.data if zlib_data.compressed is None else zlib_data.compressed
+
+def tileset_key(cache, tileset_chunk):
     assert type(tileset_chunk.data) == TilesetChunkInternal
+    return cache.key(
+        "character_pattern",
+        [tileset_chunk.tile_width, tileset_chunk.tile_height, tileset_chunk.number_of_tiles],
+        zlib_key(tileset_chunk.data.compressed),
+    )
 
-    buf = bytearray(8 * 8)
+def layer_key(cache, cel_chunk, x_cells, y_cells, remap=None, options=Options(), kind="pattern_name_table",
+              character_base=None):
+    tilemap = cel_chunk.data
+    assert type(tilemap) == CelChunk_CompressedTilemap
+    return cache.key(
+        kind,
+        [
+            x_cells,
+            y_cells,
+            options.one_word,
+            options.character_base,
+            character_base,
+            options.plane_size,
+            options.bpp,
+            tilemap.width_in_number_of_tiles,
+            tilemap.height_in_number_of_tiles,
+            tilemap.bitmask_for_tile_id,
+            tilemap.bitmask_for_x_flip,
+            tilemap.bitmask_for_y_flip,
+        ],
+        zlib_key(tilemap.compressed),
+        b"" if remap is None else remap.tobytes(),
+    )
 
-    for y in range(8):
-        for x in range(8):
-            tileset_x = x
-            tileset_y = y
-            px = tileset_chunk.data.pixel[offset + tileset_y * 8 + tileset_x]
-            buf[y * 8 + x] = px
+def layer_pattern_name_table(filename, cel_chunk, tileset_chunk, x_cells, y_cells, remap, options,
+                             character_base=None, info=None, quiet=False):
+    """
+    The pattern name table for one layer: 1-word if options.one_word and the
+    layer fits, 2-word otherwise. With a character_base, entries hold final
+    character numbers in either format; otherwise 2-word entries hold tile
+    ids, and 1-word entries count from options.character_base. info, if
+    given, is filled with the entry size and the 1-word PNCN settings.
+    Unless quiet, the reason a layer falls back to 2-word is printed on
+    stderr, and with options.verbose the 1-word settings chosen.
+    """
+    if info is None:
+        info = dict()
+    character_units = tileset_chunk.tile_width * tileset_chunk.tile_height * options.bpp // 8 // 0x20
+    if options.one_word:
+        try:
+            if (tileset_chunk.tile_width, tileset_chunk.tile_height) not in {(8, 8), (16, 16)}:
+                raise ValueError("1-word pattern name data needs 8x8 or 16x16 tiles")
+            table = one_word_pattern_name_table(
+                cel_chunk,
+                x_cells,
+                y_cells,
+                character_size = tileset_chunk.tile_width // 8,
+                character_units = character_units,
+                character_base = options.character_base if character_base is None else character_base,
+                colors = 16 if options.bpp == 4 else 256,
+                remap = remap,
+                plane_size = options.plane_size,
+            )
+        except ValueError as e:
+            if not quiet:
+                print(f"{filename}: does not fit 1-word pattern name data, writing 2-word: {e}", file=sys.stderr)
+        else:
+            if not quiet:
+                instrument.count("1-word tables")
+            if not quiet and options.verbose:
+                print(
+                    f"{filename}: 1-word, auxiliary mode {table.auxiliary_mode}, "
+                    f"supplementary character number {table.supplementary_character_number:#x}",
+                    file=sys.stderr,
+                )
+            info.update(
+                entry_size = 2,
+                auxiliary_mode = table.auxiliary_mode,
+                supplementary_character_number = table.supplementary_character_number,
+            )
+            return table.data
 
-    return bytes(buf)
+    info.update(entry_size = 4)
+    return pattern_name_table(cel_chunk, x_cells, y_cells, remap, options.plane_size, character_base, character_units)
 
-def pack_character_patterns(filename, tileset_chunk):
-    with open(filename, "wb") as f:
-        for i in range(tileset_chunk.number_of_tiles):
-            offset = tileset_chunk.tile_width * tileset_chunk.tile_height * i
+def frame_pattern_name_tables(frames, layer_index, filename, tileset_chunk, x_cells, y_cells, remap, options,
+                              character_base=None):
+    """
+    The pattern name table of layer_index in each frame of frames (a
+    FrameSequence), all in the format of the first frame, built one frame
+    at a time as they are iterated. Frames without a cel show the layer
+    empty, as a tilemap of tile 0, and a linked cel to the previous frame
+    shares its table. None if the layer is not a tilemap in every frame
+    that has a cel.
+    """
+    def cel(frame_index):
+        cel_chunk = frames.cel(frame_index, layer_index)
+        if cel_chunk is not None and type(cel_chunk.data) is CelChunk_LinkedCell:
+            cel_chunk = frames.linked_cel(cel_chunk)
+        return cel_chunk
+
+    # only the cel headers are parsed here; tilemaps are decompressed later
+    for frame_index in range(len(frames)):
+        cel_chunk = cel(frame_index)
+        if cel_chunk is None and frame_index == 0:
+            return None
+        if cel_chunk is not None and type(cel_chunk.data) is not CelChunk_CompressedTilemap:
+            return None
 
-            if tileset_chunk.tile_width == 8 and tileset_chunk.tile_height == 8:
-                buf = pack_character_1x1(tileset_chunk, offset)
-            elif tileset_chunk.tile_width == 16 and tileset_chunk.tile_height == 16:
-                buf = pack_character_2x2(tileset_chunk, offset)
+    def tables():
+        first = None
+        first_info = None
+        empty = None
+        previous = previous_table = None
+        for frame_index in range(len(frames)):
+            cel_chunk = cel(frame_index)
+            if cel_chunk is None:
+                if empty is None:
+                    width, height = first
+                    tilemap = CelChunk_CompressedTilemap(
+                        width, height, 32, 0x1fffffff, 0x20000000, 0x40000000, 0x80000000, compressed=None,
+                    )
+                    tilemap.tile = [0] * (width * height)
+                    empty = CelChunk(layer_index, 0, 0, 255, 3, 0, tilemap)
+                cel_chunk = empty
+
+            size = (cel_chunk.data.width_in_number_of_tiles, cel_chunk.data.height_in_number_of_tiles)
+            if first is None:
+                first = size
+            elif size != first:
+                raise ValueError(f"{filename}: frame {frame_index} is {size[0]}x{size[1]} tiles, the first frame {first[0]}x{first[1]}")
+
+            if cel_chunk is previous:
+                table = previous_table
             else:
-                assert False, (tileset_chunk.tile_width, tileset_chunk.tile_height)
+                info = dict()
+                table = layer_pattern_name_table(
+                    filename, cel_chunk, tileset_chunk, x_cells, y_cells, remap, options, character_base, info, quiet=True,
+                )
+                if first_info is None:
+                    first_info = info
+                elif info != first_info:
+                    raise ValueError(f"{filename}: frame {frame_index} needs pattern name data {info}, the first frame {first_info}")
+            previous, previous_table = cel_chunk, table
+            yield table
 
-            f.write(buf)
+    return tables()
 
-        print(filename, f.tell(), file=sys.stderr)
+def pattern_name_deltas(filename, tables, entry_size, address, vblank_budget, verbose=False):
+    """
+    Pack the changes between consecutive tables (see animation.py), warning
+    about frames that transfer more than vblank_budget bytes. tables may be
+    an iterator; only the first and the last two tables are held at once.
+    """
+    deltas = list(animation.tilemap_deltas(tables, entry_size))
+    sizes = [animation.frame_size(runs) for _, runs in deltas]
+    for (frame_index, _), size in zip(deltas, sizes):
+        if size > vblank_budget:
+            print(f"{filename}: frame {frame_index} writes {size} bytes, over the VBlank budget of {vblank_budget}", file=sys.stderr)
+    instrument.count("changed frames", len(deltas))
+    if deltas and verbose:
+        print(f"{filename}: {len(deltas)} frames change, at most {max(sizes)} bytes", file=sys.stderr)
+    return animation.pack_tilemap_deltas(deltas, address)
 
-def pack_pattern_name_table(filename, cel_chunk, x_cells, y_cells):
-    with open(filename, "wb") as f:
-        assert type(cel_chunk.data) == CelChunk_CompressedTilemap
-        #assert cel_chunk.data.width_in_number_of_tiles <= 64
-        #assert cel_chunk.data.height_in_number_of_tiles <= 64
+def palette_banks_4bpp(characters, transparent_index, options):
+    """
+    Assign every tile of characters to a 16-color palette bank, returning
+    (PaletteBanks, [bank of each tile, for each of characters]).
+    """
+    colors = []
+    for _, _, pixel, tile_width, tile_height, number_of_tiles in characters:
+        colors += bank.tile_colors(pixel(), tile_width * tile_height, number_of_tiles, transparent_index)
 
-        tile_width = cel_chunk.data.width_in_number_of_tiles
-        tile_height = cel_chunk.data.height_in_number_of_tiles
+    _, max_colors = cram.cram_modes[options.cram_mode]
+    # 2-word pattern name data has 7 palette number bits; banks start at
+    # --cram-offset
+    max_banks = min((max_colors - options.cram_offset) // bank.bank_colors, 0x80 - options.cram_offset // 16)
+    palette_banks, banks = bank.assign_banks(colors, transparent_index, max_banks)
 
-        print(tile_width, tile_height)
+    tile_banks = []
+    for _, _, _, _, _, number_of_tiles in characters:
+        tile_banks.append(banks[:number_of_tiles])
+        banks = banks[number_of_tiles:]
+    return palette_banks, tile_banks
 
-        h_pages = ((tile_width + (x_cells - 1)) & (~(x_cells - 1))) // x_cells
-        v_pages = ((tile_height + (y_cells - 1)) & (~(y_cells - 1))) // y_cells
+def staged(name, build, bytes_in=0):
+    """
+    build, recorded as a run of the named instrument stage.
+    """
+    def run():
+        with instrument.stage(name, bytes_in) as measurement:
+            data = build()
+            measurement.bytes_out = len(data)
+        return data
+    return run
 
-        if h_pages > 2:
-            h_pages = 2
-        if v_pages > 2:
-            v_pages = 2
+def convert_data(buf, options=Options(), cache=None):
+    """
+    Convert the .aseprite file in buf, returning a list of (output filename,
+    data, cache key). With a cache, each tileset and layer is only converted
+    if its chunk data changed.
+    """
+    def cached(key, build, stage=None, bytes_in=0):
+        if stage is not None:
+            build = staged(stage, build, bytes_in)
+        if cache is None:
+            return build(), None
+        key = key()
+        instrument.count("cache lookups")
+        return cache.cached(key, build), key
 
-        print("h_pages, v_pages", h_pages, v_pages)
+    with instrument.stage("parse_file", len(buf)):
+        header, _ = parse_header(buf)
+        tilesets, layers, palette, cel_chunks = parse_file(buf)
+    instrument.count("tilesets", len(tilesets))
+    instrument.count("tiles", sum(t.number_of_tiles for t in tilesets.values()))
+    instrument.count("layers", len(layers))
 
-        for v_page in range(v_pages):
-            for h_page in range(h_pages):
-                for y in range(y_cells):
-                    for x in range(x_cells):
-                        tx = (h_page * x_cells) + x
-                        ty = (v_page * y_cells) + y
-                        if tx >= tile_width or ty >= tile_height:
-                            f.write(pack_index(0))
-                        else:
-                            cel_chunk_ix = ty * tile_width + tx
-                            tile_data = cel_chunk.data.tile[cel_chunk_ix]
+    if options.tilize is not None:
+        if options.tilemap_deltas:
+            raise ValueError("tilize only converts the first frame, and cannot be combined with tilemap deltas")
+        tile_width, tile_height = options.tilize
+        for layer_index, layer_chunk in enumerate(layers):
+            if layer_chunk.layer_type != 0 or layer_index not in cel_chunks:
+                continue
+            tileset_id = max(tilesets, default=-1) + 1
+            with instrument.stage("tilize", header.width_in_pixels * header.height_in_pixels):
+                tileset_chunk, cel_chunks[layer_index] = tilize.tilize_cel(
+                    cel_chunks[layer_index],
+                    header.width_in_pixels,
+                    header.height_in_pixels,
+                    tile_width,
+                    tile_height,
+                    header.transparent_palette_index,
+                    tileset_id,
+                    layer_chunk.layer_name,
+                )
+            tilesets[tileset_id] = tileset_chunk
+            layers[layer_index] = replace(layer_chunk, layer_type=2, tileset_index=tileset_id)
+            instrument.count("tilized tiles", tileset_chunk.number_of_tiles)
+            if options.verbose:
+                print(f"tilize layer {layer_index}: {tileset_chunk.number_of_tiles} unique {tile_width}x{tile_height} tiles -> tileset {tileset_id}", file=sys.stderr)
 
-                            tile_id = tile_data & cel_chunk.data.bitmask_for_tile_id.value
-                            x_flip = (tile_data & cel_chunk.data.bitmask_for_x_flip.value) != 0
-                            y_flip = (tile_data & cel_chunk.data.bitmask_for_y_flip.value) != 0
+    outputs = []
 
-                            pattern = (int(y_flip) << 31) | (int(x_flip) << 30) | tile_id
+    # parsed lazily, one frame or cel at a time
+    frames = functools.cache(lambda: FrameSequence(buf))
 
-                            f.write(pack_index(pattern))
+    remaps = dict() # by tileset index
+    # (output filename, cache key, tile pixels, tile width, tile height,
+    #  number of tiles), and the index in characters of each tileset
+    characters = []
+    tileset_characters = dict()
+    if options.dedup:
+        # tilesets with the same tile size share one deduplicated set of tiles
+        groups = dict()
+        for tileset_index, tileset_chunk in sorted(tilesets.items(), key=itemgetter(0)):
+            groups.setdefault((tileset_chunk.tile_width, tileset_chunk.tile_height), []).append(tileset_chunk)
 
-        print(filename, f.tell(), file=sys.stderr)
+        for (tile_width, tile_height), group in groups.items():
+            with instrument.stage("dedup"):
+                tiles = dedup.deduplicate(group)
+            instrument.count("deduplicated tiles", tiles.number_of_tiles)
+            remaps.update(tiles.remap)
+            if options.verbose:
+                print(f"dedup {tile_width}x{tile_height}: {sum(t.number_of_tiles for t in group)} tiles -> {tiles.number_of_tiles}", file=sys.stderr)
+
+            for tileset_chunk in group:
+                tileset_characters[tileset_chunk.tileset_id] = len(characters)
+            characters.append((
+                f"character_pattern__{tile_width}x{tile_height}.bin",
+                lambda tiles=tiles: cache.key("deduplicated_character_pattern", [tiles.tile_width, tiles.tile_height], tiles.pixel),
+                lambda tiles=tiles: tiles.pixel,
+                tile_width,
+                tile_height,
+                tiles.number_of_tiles,
+            ))
+    else:
+        for tileset_index, tileset_chunk in sorted(tilesets.items(), key=itemgetter(0)):
+            tileset_characters[tileset_index] = len(characters)
+            characters.append((
+                f"character_pattern__tileset_{tileset_index}.bin",
+                lambda tileset_chunk=tileset_chunk: tileset_key(cache, tileset_chunk),
+                lambda tileset_chunk=tileset_chunk: tileset_chunk.data.pixel,
+                tileset_chunk.tile_width,
+                tileset_chunk.tile_height,
+                tileset_chunk.number_of_tiles,
+            ))
+
+    if options.bpp == 4:
+        with instrument.stage("palette_banks"):
+            palette_banks, tile_banks = palette_banks_4bpp(characters, header.transparent_palette_index, options)
+        instrument.count("palette banks", len(palette_banks))
+        if options.verbose:
+            print(f"4bpp: {sum(map(len, tile_banks))} tiles in {len(palette_banks)} palette banks", file=sys.stderr)
 
-with open(sys.argv[1], 'rb') as f:
-    buf = f.read()
-    mem = memoryview(buf)
+        # the palette bank of each tile goes into its pattern name data
+        for tileset_index, tileset_chunk in tilesets.items():
+            remap = remaps.get(tileset_index)
+            if remap is None:
+                remap = range(tileset_chunk.number_of_tiles)
+            banks = tile_banks[tileset_characters[tileset_index]]
+            remaps[tileset_index] = array(_uint32_typecode, [
+                pattern | (banks[pattern & 0x7fff] << 16)
+                for pattern in remap
+            ])
 
-tilesets, layers, palette, cel_chunks = parse_file(buf)
+        palette_rgb = bank.banked_palette(palette, palette_banks)
+        changes = bank.banked_changes(palette, cram.palette_changes(buf), palette_banks)
+    else:
+        tile_banks = [None] * len(characters)
+        palette_rgb = palette
+        changes = cram.palette_changes(buf)
+
+    if options.cram_offset:
+        # palette numbers count 16 colors from the start of color RAM
+        alignment = 16 if options.bpp == 4 else 256
+        if options.cram_offset % alignment:
+            raise ValueError(f"--cram-offset {options.cram_offset} is not a multiple of {alignment} colors")
+        _, max_colors = cram.cram_modes[options.cram_mode]
+        first, red, _, _ = cram.palette_rgb(palette_rgb)
+        if options.cram_offset + first + len(red) > max_colors:
+            raise ValueError(f"{first + len(red)} colors at --cram-offset {options.cram_offset} do not fit in {max_colors} color RAM entries")
+        palette_base = options.cram_offset // 16
+        for tileset_index, tileset_chunk in tilesets.items():
+            remap = remaps.get(tileset_index)
+            if remap is None:
+                remap = range(tileset_chunk.number_of_tiles)
+            remaps[tileset_index] = array(_uint32_typecode, [pattern + (palette_base << 16) for pattern in remap])
+
+    with instrument.stage("palette") as measurement:
+        data = cram.pack_palette(palette_rgb, options.cram_mode, options.quantize)
+        measurement.bytes_out = len(data)
+    outputs.append(("palette.bin", *cached(lambda: cache.key("palette", data), lambda: data)))
+
+    with instrument.stage("palette_deltas") as measurement:
+        deltas = list(cram.palette_deltas(palette_rgb, changes, options.cram_mode, options.quantize))
+        deltas = [
+            (frame_index, [(first + options.cram_offset, entries) for first, entries in runs])
+            for frame_index, runs in deltas
+        ]
+        data = cram.pack_palette_deltas(deltas, options.cram_mode)
+        measurement.bytes_out = len(data)
+    if deltas:
+        outputs.append(("palette_deltas.bin", *cached(lambda: cache.key("palette_deltas", data), lambda: data)))
+
+    if options.plan:
+        planner = vram.VramPlanner()
+        entry_size, _ = cram.cram_modes[options.cram_mode]
+        manifest = {
+            "cram": {"name": "palette.bin", "address": options.cram_offset * entry_size, "size": len(outputs[0][1])},
+            "vram": planner.placements,
+            "layers": [],
+        }
+    # first character number of each of characters, with --plan
+    character_bases = [None] * len(characters)
+
+    for i, ((filename, key, pixel, tile_width, tile_height, number_of_tiles), banks) in enumerate(zip(characters, tile_banks)):
+        if options.plan:
+            size = tile_width * tile_height * number_of_tiles * options.bpp // 8
+            placement = planner.place_low(filename, "character_pattern", size)
+            character_bases[i] = placement.address // vram.character_unit
+
+        if banks is None:
+            outputs.append((filename, *cached(
+                key,
+                lambda: pack_character_cells(pixel(), tile_width, tile_height, number_of_tiles),
+                "character_patterns",
+                tile_width * tile_height * number_of_tiles,
+            )))
+        else:
+            outputs.append((filename, *cached(
+                lambda: cache.key("character_pattern_4bpp", key(), bytes(banks), [list(b) for b in palette_banks.banks], palette_banks.transparent_index),
+                lambda: bank.pack_4bpp(
+                    pack_character_cells(pixel(), tile_width, tile_height, number_of_tiles),
+                    tile_width * tile_height,
+                    banks,
+                    palette_banks,
+                ),
+                "character_patterns",
+                tile_width * tile_height * number_of_tiles,
+            )))
+
+    for layer_index, cel_chunk in sorted(cel_chunks.items(), key=itemgetter(0)):
+        if layers[layer_index].layer_type != 2:
+            # image layers are sprites
+            continue
+        filename = f"pattern_name_table__layer_{layer_index}.bin"
+        tileset_chunk = tilesets[layers[layer_index].tileset_index]
+
+        x_cells = 64 // (tileset_chunk.tile_width // 8)
+        y_cells = 64 // (tileset_chunk.tile_height // 8)
+
+        remap = remaps.get(layers[layer_index].tileset_index)
+        character_base = character_bases[tileset_characters[layers[layer_index].tileset_index]]
+        info = dict()
+
+        layout = plane.plane_layout(
+            cel_chunk.data.width_in_number_of_tiles,
+            cel_chunk.data.height_in_number_of_tiles,
+            x_cells,
+            y_cells,
+            options.plane_size,
+        )
+        if options.verbose:
+            print(f"{filename}: {layout}", file=sys.stderr)
+        cells = layout.width * layout.height
+        instrument.count("cells", cells)
+
+        table = functools.cache(
+            lambda: layer_pattern_name_table(
+                filename, cel_chunk, tileset_chunk, x_cells, y_cells, remap, options, character_base, info,
+            )
+        )
+        outputs.append((filename, *cached(
+            lambda: layer_key(cache, cel_chunk, x_cells, y_cells, remap, options, character_base=character_base),
+            table,
+            "pattern_name_table",
+            cells * 4,
+        )))
+
+        if options.plan:
+            data = outputs[-1][1]
+            entry_size = len(data) // layout.number_of_cells
+            # each plane starts on a multiple of its own size
+            plane_bytes = layout.plane_cells * entry_size
+            placement = planner.place_high(filename, "pattern_name_table", len(data), plane_bytes)
+            if not info:
+                # the table came from the cache; only 1-word tables need
+                # rebuilding to recover their PNCN settings
+                if entry_size == 2:
+                    layer_pattern_name_table(
+                        filename, cel_chunk, tileset_chunk, x_cells, y_cells, remap, options, character_base, info,
+                        quiet=True,
+                    )
+                info.update(entry_size = entry_size)
+            manifest["layers"].append({
+                "layer": layer_index,
+                "name": layers[layer_index].layer_name.decode(errors="replace"),
+                "pattern_name_table": filename,
+                "character_base": character_base,
+                "plane_size": [layout.plane_width, layout.plane_height],
+                "planes": [
+                    [placement.address + (v * layout.h_planes + h) * plane_bytes for h in range(layout.h_planes)]
+                    for v in range(layout.v_planes)
+                ],
+                **info,
+            })
+
+        if options.tilemap_deltas and header.frames > 1:
+            deltas_filename = f"pattern_name_deltas__layer_{layer_index}.bin"
+            address = placement.address if options.plan else 0
+
+            def build_deltas():
+                tables = frame_pattern_name_tables(
+                    frames(), layer_index, filename, tileset_chunk, x_cells, y_cells, remap, options, character_base,
+                )
+                if tables is None:
+                    print(f"{deltas_filename}: layer {layer_index} is not a tilemap in every frame", file=sys.stderr)
+                    return animation.pack_tilemap_deltas([])
+                first = next(tables)
+                entry_size = len(first) // layout.number_of_cells
+                tables = itertools.chain([first], tables)
+                return pattern_name_deltas(deltas_filename, tables, entry_size, address, options.vblank_budget, options.verbose)
+
+            data, key = cached(
+                lambda: cache.key(
+                    "pattern_name_deltas",
+                    layer_key(cache, cel_chunk, x_cells, y_cells, remap, options, character_base=character_base),
+                    address,
+                    buf,
+                ),
+                build_deltas,
+                "pattern_name_deltas",
+            )
+            if data != animation.pack_tilemap_deltas([]):
+                outputs.append((deltas_filename, data, key))
+
+        if options.strips:
+            def build_strips():
+                data = table()
+                return plane.strips(data, len(data) // layout.number_of_cells, layout)
+
+            strip_data = functools.cache(build_strips)
+            for i, kind in enumerate(("pattern_name_rows", "pattern_name_columns")):
+                outputs.append((f"{kind}__layer_{layer_index}.bin", *cached(
+                    lambda: layer_key(cache, cel_chunk, x_cells, y_cells, remap, options, kind, character_base),
+                    lambda: strip_data()[i],
+                    "strips",
+                )))
+
+    if options.plan:
+        shared = planner.shared_banks()
+        if shared:
+            print(f"VRAM banks {', '.join(shared)} hold both character patterns and pattern name tables", file=sys.stderr)
+        manifest["vram"] = [placement.manifest() for placement in planner.placements]
+        data = json.dumps(manifest, indent=2).encode()
+        outputs.append(("manifest.json", *cached(lambda: cache.key("manifest", data), lambda: data)))
+
+    if options.sprites:
+        atlas = functools.cache(
+            lambda: sprite.build_atlas(buf, header.transparent_palette_index, options.sprite_address)
+        )
+        outputs.append(("sprite_characters.bin", *cached(
+            lambda: cache.key("sprite_characters", options.sprite_address, buf),
+            lambda: atlas().pixel,
+            "sprites",
+        )))
+        outputs.append(("sprite_table.bin", *cached(
+            lambda: cache.key("sprite_table", options.sprite_address, buf),
+            lambda: sprite.pack_sprite_table(atlas()),
+        )))
+
+    if options.compress is not None:
+        outputs = [
+            compressed_output(cache, output, options) if bundle.kind_of(output[0]) in compressed_kinds else output
+            for output in outputs
+        ]
+
+    return outputs
+
+compressed_kinds = {bundle.kinds[kind] for kind in ("character_pattern", "pattern_name_table", "sprite_characters")}
 
-pack_palette(palette)
+def compressed_output(cache, output, options):
+    """
+    (filename, data, cache key) of output compressed with options.compress.
+    """
+    filename, data, key = output
 
-for tileset_index, tileset_chunk in sorted(tilesets.items(), key=itemgetter(0)):
-    filename = f"character_pattern__tileset_{tileset_index}.bin"
-    pack_character_patterns(filename, tileset_chunk)
+    def build():
+        with instrument.stage("compress", len(data)) as measurement:
+            compressed = compress.compress(data, options.compress, options.compress_level)
+            measurement.bytes_out = len(compressed)
+        return compressed
+
+    if cache is None:
+        compressed, key = build(), None
+    else:
+        key = cache.key("compressed", options.compress, options.compress_level, key)
+        compressed = cache.cached(key, build)
+    # recorded on cache hits too, unlike the compress stage
+    instrument.count("bytes before compression", len(data))
+    instrument.count("bytes after compression", len(compressed))
+    if options.verbose:
+        ratio = len(compressed) / len(data) if data else 1
+        print(f"{filename}: {len(data)} -> {len(compressed)} bytes ({ratio:.2f})", file=sys.stderr)
+    return filename, compressed, key
+
+def cached_outputs(cache, file_key):
+    manifest = cache.get(file_key)
+    if manifest is None:
+        return None
+    outputs = []
+    for filename, key in json.loads(manifest):
+        data = cache.get(key)
+        if data is None:
+            return None
+        outputs.append((filename, data, key))
+    return outputs
+
+def convert(input_filename, output_dir, options=Options(), cache=None, instrumented=False,
+            bundle_filename=None, bundle_alignment=bundle.default_alignment):
+    """
+    Convert input_filename into output_dir, or into a single bundle named
+    bundle_filename within it. Returns (the cache entries that were used, if
+    any, so that a parent process can update the cache index; the
+    instrument report of the conversion, if instrumented).
+    """
+    with instrument.instrumented() if instrumented else contextlib.nullcontext() as recorder:
+        with instrument.stage("convert"):
+            buf = map_file(input_filename)
+
+            outputs = None
+            if cache is not None:
+                file_key = cache.key("file", asdict(replace(options, verbose=False)), buf)
+                outputs = cached_outputs(cache, file_key)
+                instrument.count("cached files", outputs is not None)
+
+            if outputs is None:
+                outputs = convert_data(buf, options, cache)
+                if cache is not None:
+                    manifest = [(filename, key) for filename, _, key in outputs]
+                    cache.put(file_key, json.dumps(manifest).encode())
+
+            os.makedirs(output_dir, exist_ok=True)
+
+            with instrument.stage("write") as measurement:
+                if bundle_filename is not None:
+                    buffers = bundle.pack_bundle([(filename, data) for filename, data, _ in outputs], bundle_alignment)
+                    with open(os.path.join(output_dir, bundle_filename), "wb") as f:
+                        f.writelines(buffers)
+                        print(f.name, f.tell(), file=sys.stderr)
+                    measurement.bytes_out += sum(map(len, buffers))
+                else:
+                    for filename, data, _ in outputs:
+                        write_output(os.path.join(output_dir, filename), data)
+                        measurement.bytes_out += len(data)
+
+    report = None
+    if recorder is not None:
+        report = {"file": input_filename, **recorder.report()}
+    return (cache.touched if cache is not None else None), report
+
+def total_report(reports):
+    """
+    The reports of every file, slowest first, and their stages and counts
+    summed.
+    """
+    reports = sorted(reports, key=lambda report: -report["stages"]["convert"]["seconds"])
+    stages = dict()
+    counts = dict()
+    for report in reports:
+        for name, stage in report["stages"].items():
+            total = stages.setdefault(name, {"runs": 0, "seconds": 0.0, "bytes_in": 0, "bytes_out": 0})
+            for field in total:
+                total[field] += stage[field]
+        for name, n in report["counts"].items():
+            counts[name] = counts.get(name, 0) + n
+    for total in stages.values():
+        total["ratio"] = total["bytes_out"] / total["bytes_in"] if total["bytes_in"] and total["bytes_out"] else None
+    return {"total": {"stages": stages, "counts": counts}, "files": reports}
+
+def find_inputs(patterns):
+    """
+    Expand each of patterns (a file, a directory or a glob) to .aseprite
+    filenames.
+    """
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                glob.glob(os.path.join(glob.escape(pattern), "*.aseprite"))
+                + glob.glob(os.path.join(glob.escape(pattern), "*.ase"))
+            )
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            raise FileNotFoundError(pattern)
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append(filename)
+    return filenames
+
+def output_dirs(filenames, output_dir):
+    """
+    A single input is converted directly into output_dir; multiple inputs
+    each get a subdirectory named after the input file. Raises ValueError
+    if two inputs have the same name.
+    """
+    if len(filenames) == 1:
+        return [output_dir]
+
+    dirs = []
+    for filename in filenames:
+        name, _ = os.path.splitext(os.path.basename(filename))
+        dirs.append(os.path.join(output_dir, name))
+    duplicates = sorted({d for d in dirs if dirs.count(d) > 1})
+    if duplicates:
+        raise ValueError(f"inputs with the same name would be written to {', '.join(duplicates)}")
+    return dirs
+
+def buffered_stderr(f, *args):
+    """
+    Call f(*args) with stderr buffered, so that a worker's messages can be
+    printed in one piece by the parent process. Returns (stderr text,
+    result of f or None, exception raised by f or None).
+    """
+    messages = io.StringIO()
+    result = error = None
+    with contextlib.redirect_stderr(messages):
+        try:
+            result = f(*args)
+        except Exception as e:
+            error = e
+    return messages.getvalue(), result, error
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert .aseprite files to Saturn VDP2 palette, character pattern and pattern name table data.",
+    )
+    parser.add_argument("inputs", nargs="+",
+                        help=".aseprite files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="output directory (default: current directory)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--cram-mode", type=int, choices=sorted(cram.cram_modes), default=0,
+                        help="color RAM mode: 0 and 1 are RGB555, 2 is RGB888 (default: 0)")
+    parser.add_argument("--quantize", choices=cram.quantize_modes, default="truncate",
+                        help="how RGB555 modes reduce 8-bit color channels (default: truncate)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="merge identical and flipped tiles within and across tilesets of the same tile size")
+    parser.add_argument("--bpp", type=int, choices=(4, 8), default=8,
+                        help="character pattern bits per pixel; 4 assigns each tile to a 16-color palette bank (default: 8)")
+    parser.add_argument("--one-word", action="store_true",
+                        help="write 1-word pattern name tables for layers that fit, 2-word for the others")
+    parser.add_argument("--character-base", type=lambda s: int(s, 0), default=0,
+                        help="character number of the first tile of each tileset, for --one-word (default: 0)")
+    parser.add_argument("--plan", action="store_true",
+                        help="place character patterns and pattern name tables in VRAM, write final character numbers and manifest.json")
+    parser.add_argument("--cram-offset", type=lambda s: int(s, 0), default=0,
+                        help="color RAM index palette.bin is loaded at; added to palette numbers (default: 0)")
+    parser.add_argument("--compress", choices=("rle", "lzss"),
+                        help="compress character patterns and pattern name tables")
+    parser.add_argument("--compress-level", type=int, choices=range(1, 10), default=6, metavar="1-9",
+                        help="lzss match search effort, 1 (fastest) to 9 (smallest) (default: 6)")
+    image_layers = parser.add_mutually_exclusive_group()
+    image_layers.add_argument("--sprites", action="store_true",
+                              help="also write the cels of image layers, cropped and deduplicated, as VDP1 sprites")
+    image_layers.add_argument("--tilize", choices=("8x8", "16x16"),
+                              help="convert image layers to backgrounds, slicing them into tiles of this size")
+    parser.add_argument("--sprite-address", type=lambda s: int(s, 0), default=0,
+                        help="VDP1 VRAM address sprite_characters.bin is loaded at (default: 0)")
+    parser.add_argument("--plane-size", choices=[f"{w}x{h}" for w, h in plane.plane_sizes],
+                        help="plane size in pages (default: the map size for maps of up to 2x2 pages, otherwise 2x2)")
+    parser.add_argument("--tilemap-deltas", action="store_true",
+                        help="also write the pattern name data each later frame changes, for animated tilemaps")
+    parser.add_argument("--vblank-budget", type=lambda s: int(s, 0), default=4096,
+                        help="warn about frames whose tilemap deltas write more than this many bytes (default: 4096)")
+    parser.add_argument("--strips", action="store_true",
+                        help="also write each layer as row and column strips, for streaming maps larger than a plane")
+    parser.add_argument("--bundle", metavar="FILENAME",
+                        help="write all outputs of each input into this single bundle file in its output directory")
+    parser.add_argument("--bundle-alignment", type=lambda s: int(s, 0), default=bundle.default_alignment,
+                        help=f"alignment of each output in the bundle, a multiple of 4 (default: {bundle.default_alignment:#x})")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print tile, palette bank and layout statistics on stderr (always in --report)")
+    parser.add_argument("--report",
+                        help="write the time, bytes in and out, and object counts of every stage of every file to this JSON file")
+    parser.add_argument("--profile-dir",
+                        help="run each conversion under cProfile, writing <input name>.prof stats to this directory")
+    parser.add_argument("--cache-dir",
+                        help="reuse outputs of unchanged inputs, tilesets and layers from this directory")
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="cache size limit in MiB; least recently used outputs are evicted (default: 256)")
+    args = parser.parse_args(argv)
+    if args.tilize is not None and args.tilemap_deltas:
+        parser.error("--tilize only converts the first frame, and cannot be combined with --tilemap-deltas")
+
+    options = Options(
+        cram_mode = args.cram_mode,
+        quantize = args.quantize,
+        dedup = args.dedup,
+        one_word = args.one_word,
+        character_base = args.character_base,
+        plane_size = None if args.plane_size is None else tuple(map(int, args.plane_size.split("x"))),
+        strips = args.strips,
+        bpp = args.bpp,
+        plan = args.plan,
+        cram_offset = args.cram_offset,
+        compress = args.compress,
+        compress_level = args.compress_level,
+        sprites = args.sprites,
+        sprite_address = args.sprite_address,
+        tilemap_deltas = args.tilemap_deltas,
+        vblank_budget = args.vblank_budget,
+        tilize = None if args.tilize is None else tuple(map(int, args.tilize.split("x"))),
+        verbose = args.verbose,
+    )
+
+    filenames = find_inputs(args.inputs)
+    try:
+        dirs = output_dirs(filenames, args.output_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = BuildCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    def job(filename, output_dir):
+        # (function, arguments) converting filename, under cProfile with --profile-dir
+        job_args = (filename, output_dir, options, cache, args.report is not None, args.bundle, args.bundle_alignment)
+        if args.profile_dir is None:
+            return convert, job_args
+        name, _ = os.path.splitext(os.path.basename(filename))
+        return instrument.profiled, (os.path.join(args.profile_dir, f"{name}.prof"), convert, *job_args)
+
+    failed = 0
+    reports = []
+    if len(filenames) == 1:
+        f, job_args = job(filenames[0], dirs[0])
+        _, report = f(*job_args)
+        reports.append(report)
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            futures = dict()
+            for filename, output_dir in zip(filenames, dirs):
+                f, job_args = job(filename, output_dir)
+                futures[executor.submit(buffered_stderr, f, *job_args)] = filename
+            for future in as_completed(futures):
+                try:
+                    messages, result, error = future.result()
+                except Exception as e:
+                    messages, result, error = "", None, e
+                sys.stderr.write(messages)
+                if error is not None:
+                    failed += 1
+                    print(f"{futures[future]}: {type(error).__name__}: {error}", file=sys.stderr)
+                    continue
+                touched, report = result
+                reports.append(report)
+                if cache is not None:
+                    cache.touched.update(touched)
 
-for layer_index, cel_chunk in sorted(cel_chunks.items(), key=itemgetter(0)):
-    filename = f"pattern_name_table__layer_{layer_index}.bin"
-    #layers[layer_index]
-    print(f"layer={layer_index} layer_name={layers[layer_index].layer_name} tileset={layers[layer_index].tileset_index}");
-    tileset_chunk = tilesets[layers[layer_index].tileset_index]
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(total_report(reports), f, indent=2)
 
-    x_cells = 64 // (tileset_chunk.tile_width // 8)
-    y_cells = 64 // (tileset_chunk.tile_height // 8)
+    if cache is not None:
+        cache.update()
 
-    pack_pattern_name_table(filename, cel_chunk, x_cells, y_cells)
+    return 1 if failed else 0
 
-#for layer_index, layer_chunk in enumerate(layers):
-#    print(f"layer={layer_index} layer_name={layer_chunk.layer_name} tileset={layer_chunk.tileset_index}");
+if __name__ == "__main__":
+    sys.exit(main())
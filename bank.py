@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+
+from aseprite import numpy
+import cram
+
+# colors per 4bpp palette bank; slot 0 is transparent
+bank_colors = 16
+
+@dataclass
+class PaletteBanks:
+    # by bank: the palette indices of slots 1 and up
+    banks: list[bytes]
+    # palette index drawn as slot 0
+    transparent_index: int
+
+    def __len__(self):
+        return len(self.banks)
+
+    def translate(self, bank):
+        """
+        bytes.translate() table from palette index to slot in bank.
+        """
+        table = bytearray(256)
+        for slot, index in enumerate(self.banks[bank], 1):
+            table[index] = slot
+        table[self.transparent_index] = 0
+        return bytes(table)
+
+def tile_colors(pixel, tile_size, number_of_tiles, transparent_index=0):
+    """
+    The set of opaque palette indices used by each tile of tile-major pixel
+    data.
+    """
+    colors = []
+    for i in range(number_of_tiles):
+        used = set(pixel[i * tile_size:(i + 1) * tile_size])
+        used.discard(transparent_index)
+        colors.append(frozenset(used))
+    return colors
+
+def assign_banks(colors, transparent_index=0, max_banks=64):
+    """
+    Greedily assign each set of tile colors to a palette bank of up to 15
+    opaque colors, largest sets first, preferring the bank that needs the
+    fewest new colors. Returns (PaletteBanks, bank of each tile). Raises
+    ValueError when a tile uses more than 15 colors or more than max_banks
+    banks are needed.
+    """
+    banks = [] # sets of palette indices
+    assigned = dict() # color set -> bank
+    for used in sorted(set(colors), key=lambda used: (-len(used), sorted(used))):
+        if len(used) > bank_colors - 1:
+            raise ValueError(f"a tile uses {len(used)} colors; 4bpp tiles can use at most {bank_colors - 1} and transparency")
+        best = None
+        for bank, bank_set in enumerate(banks):
+            added = len(used - bank_set)
+            if len(bank_set) + added <= bank_colors - 1 and (best is None or added < best[0]):
+                best = (added, bank)
+                if added == 0:
+                    break
+        if best is None:
+            if len(banks) == max_banks:
+                raise ValueError(f"tiles need more than {max_banks} palette banks")
+            banks.append(set())
+            best = (len(used), len(banks) - 1)
+        _, bank = best
+        banks[bank] |= used
+        assigned[used] = bank
+
+    if not banks:
+        banks.append(set())
+    palette_banks = PaletteBanks(
+        banks = [bytes(sorted(bank_set)) for bank_set in banks],
+        transparent_index = transparent_index,
+    )
+    return palette_banks, [assigned.get(used, 0) for used in colors]
+
+def pack_4bpp(pixel, tile_size, tile_banks, palette_banks):
+    """
+    Convert 8bpp tile-major pixel data (in any order within each tile) to
+    4bpp: each pixel becomes its slot in the bank of its tile, two pixels
+    per byte, the first in the high nibble.
+    """
+    number_of_tiles = len(tile_banks)
+    assert tile_size % 2 == 0, tile_size
+    assert len(pixel) >= tile_size * number_of_tiles, (len(pixel), tile_size, number_of_tiles)
+    tables = [palette_banks.translate(bank) for bank in range(len(palette_banks))]
+
+    if numpy is not None:
+        lookup = numpy.frombuffer(b"".join(tables), dtype=numpy.uint8).reshape(len(tables), 256)
+        a = numpy.frombuffer(pixel, dtype=numpy.uint8, count=tile_size * number_of_tiles)
+        a = a.reshape(number_of_tiles, tile_size)
+        slots = lookup[numpy.array(tile_banks, dtype=numpy.intp)[:, None], a].reshape(-1)
+        return ((slots[0::2] << 4) | slots[1::2]).tobytes()
+
+    slots = bytearray(tile_size * number_of_tiles)
+    for i, bank in enumerate(tile_banks):
+        start = i * tile_size
+        slots[start:start + tile_size] = bytes(pixel[start:start + tile_size]).translate(tables[bank])
+    high = bytes(slots[0::2]).translate(bytes((c << 4) & 0xff for c in range(256)))
+    low = bytes(slots[1::2])
+    n = len(high)
+    return (int.from_bytes(high, "big") | int.from_bytes(low, "big")).to_bytes(n, "big")
+
+def banked_palette(palette, palette_banks):
+    """
+    (first color index, red, green, blue), like cram.palette_rgb(), for the
+    color RAM contents of palette_banks: bank n at color index 16 * n, slot
+    0 holding the transparent color.
+    """
+    _, red, green, blue = _full_rgb(palette)
+    indices = bytearray()
+    for bank in palette_banks.banks:
+        entries = bytes([palette_banks.transparent_index]) + bank
+        indices += entries + bytes([palette_banks.transparent_index]) * (bank_colors - len(entries))
+    return (
+        0,
+        bytes(red[i] for i in indices),
+        bytes(green[i] for i in indices),
+        bytes(blue[i] for i in indices),
+    )
+
+def _full_rgb(palette):
+    first, red, green, blue = cram.palette_rgb(palette)
+    state = [bytearray(256) for _ in range(3)]
+    for channel, values in zip(state, (red, green, blue)):
+        channel[first:first + len(values)] = values
+    return (0, *state)
+
+def banked_changes(palette, changes, palette_banks):
+    """
+    cram.palette_changes() as the banked palette after each change, for
+    cram.palette_deltas().
+    """
+    _, *state = _full_rgb(palette)
+    for frame_index, change in changes:
+        first, red, green, blue = cram.palette_rgb(change)
+        for channel, values in zip(state, (red, green, blue)):
+            channel[first:first + len(values)] = values
+        yield frame_index, banked_palette((0, *state), palette_banks)
@@ -0,0 +1,170 @@
+import sys
+import json
+import time
+import argparse
+
+from aseprite import parse_file, parse_header, parse_cel_chunk, parse_tileset_chunk, iter_file_chunks, numpy
+from background import character_patterns, pattern_name_table
+import synthetic
+
+def best_time(f, repeat):
+    """
+    Shortest of repeat runs of f(), which returns its own elapsed time so
+    that it can leave setup out of it.
+    """
+    best = None
+    for _ in range(repeat):
+        elapsed = f()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchmark(buf, repeat=5):
+    """
+    Time each parser and packer stage on the first frame of the .aseprite
+    file in buf. Returns {stage: {"seconds", "bytes", "tiles", "mb_per_s",
+    "tiles_per_s"}}; bytes are the stage's input, tiles are tiles (or map
+    cells) processed.
+    """
+    chunks = [chunk for frame_index, chunk in iter_file_chunks(buf) if frame_index == 0]
+    tileset_data = [chunk.data for chunk in chunks if chunk.chunk_type == 0x2023]
+    cel_data = [chunk.data for chunk in chunks if chunk.chunk_type == 0x2005]
+
+    def parse_tilesets():
+        return [parse_tileset_chunk(data)[0] for data in tileset_data]
+
+    def parse_cels():
+        # tilemap cels only
+        return [cel_chunk for cel_chunk in (parse_cel_chunk(data)[0] for data in cel_data) if cel_chunk.cel_type == 3]
+
+    tilesets = parse_tilesets()
+    cels = parse_cels()
+    tileset_tiles = sum(t.number_of_tiles for t in tilesets)
+    tileset_bytes = sum(t.number_of_tiles * t.tile_width * t.tile_height for t in tilesets)
+    cells = sum(c.data.width_in_number_of_tiles * c.data.height_in_number_of_tiles for c in cels)
+    file_tilesets, layers, _, _ = parse_file(buf)
+    cel_tilesets = [file_tilesets[layers[c.layer_index].tileset_index] for c in cels]
+
+    def run_parse_header():
+        start = time.perf_counter()
+        for _ in range(1000):
+            parse_header(buf)
+        return time.perf_counter() - start
+
+    def run_parse_tileset_chunk():
+        # parse, then decompress the pixels
+        start = time.perf_counter()
+        for tileset_chunk in parse_tilesets():
+            tileset_chunk.data.pixel
+        return time.perf_counter() - start
+
+    def run_parse_cel_chunk():
+        start = time.perf_counter()
+        for cel_chunk in parse_cels():
+            cel_chunk.data.tile
+        return time.perf_counter() - start
+
+    def run_pack_character_patterns():
+        fresh = parse_tilesets()
+        for tileset_chunk in fresh:
+            tileset_chunk.data.pixel
+        start = time.perf_counter()
+        for tileset_chunk in fresh:
+            character_patterns(tileset_chunk)
+        return time.perf_counter() - start
+
+    def run_pack_pattern_name_table():
+        fresh = parse_cels()
+        for cel_chunk in fresh:
+            cel_chunk.data.tile
+        start = time.perf_counter()
+        for cel_chunk, tileset_chunk in zip(fresh, cel_tilesets):
+            x_cells = 64 // (tileset_chunk.tile_width // 8)
+            y_cells = 64 // (tileset_chunk.tile_height // 8)
+            pattern_name_table(cel_chunk, x_cells, y_cells)
+        return time.perf_counter() - start
+
+    stages = {
+        "parse_header": (run_parse_header, 1000 * 128, 0),
+        "parse_tileset_chunk": (run_parse_tileset_chunk, tileset_bytes, tileset_tiles),
+        "parse_cel_chunk": (run_parse_cel_chunk, cells * 4, cells),
+        "pack_character_patterns": (run_pack_character_patterns, tileset_bytes, tileset_tiles),
+        "pack_pattern_name_table": (run_pack_pattern_name_table, cells * 4, cells),
+    }
+
+    results = dict()
+    for name, (f, size, tiles) in stages.items():
+        seconds = best_time(f, repeat)
+        results[name] = {
+            "seconds": seconds,
+            "bytes": size,
+            "tiles": tiles,
+            "mb_per_s": size / seconds / 1e6,
+            "tiles_per_s": tiles / seconds,
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Yield (stage, ratio of throughput to the baseline, regressed) for
+    every stage in both results and baseline that processed the same
+    number of bytes.
+    """
+    for name, result in results.items():
+        if name not in baseline or baseline[name]["bytes"] != result["bytes"]:
+            continue
+        ratio = result["mb_per_s"] / baseline[name]["mb_per_s"]
+        yield name, ratio, ratio < 1 - tolerance
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the parser and packer stages on a synthetic .aseprite file.")
+    parser.add_argument("--input",
+                        help="benchmark this .aseprite file instead of a synthetic one")
+    parser.add_argument("--map-size", type=synthetic._size, default=(256, 256),
+                        help="synthetic tilemap size in tiles, WxH (default: 256x256)")
+    parser.add_argument("--tiles", type=int, default=1024,
+                        help="tiles in each synthetic tileset (default: 1024)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per stage; the fastest is reported (default: 5)")
+    parser.add_argument("--save",
+                        help="write the results to this JSON file")
+    parser.add_argument("--baseline",
+                        help="compare against results saved with --save; exit with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="throughput loss against the baseline reported as a regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    if args.input is not None:
+        with open(args.input, "rb") as f:
+            buf = f.read()
+    else:
+        buf = synthetic.build(synthetic.SyntheticOptions(
+            tilesets = [(8, 8, args.tiles), (16, 16, args.tiles)],
+            map_size = args.map_size,
+        ))
+
+    results = benchmark(buf, args.repeat)
+    print(f"numpy: {'yes' if numpy is not None else 'no'}")
+    for name, result in results.items():
+        line = f"{name:24} {result['seconds'] * 1000:10.3f} ms {result['mb_per_s']:10.1f} MB/s"
+        if result["tiles"]:
+            line += f" {result['tiles_per_s']:14.0f} tiles/s"
+        print(line)
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    regressed = False
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"against {args.baseline}:")
+        for name, ratio, is_regression in compare(results, baseline, args.tolerance):
+            regressed |= is_regression
+            print(f"{name:24} {ratio:6.2f}x{'  REGRESSION' if is_regression else ''}")
+
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
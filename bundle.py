@@ -0,0 +1,148 @@
+import os
+import sys
+import struct
+import argparse
+from dataclasses import dataclass
+
+from aseprite import map_file
+
+# Big-endian, as read by the Saturn:
+#
+#   header:     4s magic, u16 version, u16 number of entries,
+#               u32 alignment, u32 bundle size
+#   entries:    u16 kind, u16 name size, u32 name offset, u32 offset, u32 size
+#   names:      the name of each entry, not terminated
+#   blobs:      each starting at a multiple of alignment from the start of
+#               the bundle, padded with zeros
+#
+# Offsets are from the start of the bundle.
+magic = b"SATB"
+version = 1
+_header_struct = struct.Struct(">4sHHII")
+_entry_struct = struct.Struct(">HHIII")
+
+# SCU and SH-2 DMA transfer 4-byte units; 32 bytes also keeps character
+# patterns on a character number boundary when copied as a whole
+default_alignment = 0x20
+
+kinds = {
+    "palette": 1,
+    "palette_deltas": 2,
+    "character_pattern": 3,
+    "pattern_name_table": 4,
+    "pattern_name_rows": 5,
+    "pattern_name_columns": 6,
+    "manifest": 7,
+    "sprite_characters": 8,
+    "sprite_table": 9,
+    "pattern_name_deltas": 10,
+}
+kind_names = {kind: name for name, kind in kinds.items()}
+
+def kind_of(filename):
+    """
+    The kind of an output, from its filename (0 for unknown outputs).
+    """
+    name, _ = os.path.splitext(filename)
+    return kinds.get(name.split("__")[0], 0)
+
+def _align(n, alignment):
+    return (n + alignment - 1) // alignment * alignment
+
+def pack_bundle(outputs, alignment=default_alignment):
+    """
+    A bundle of outputs, a list of (filename, data). Returns a list of
+    buffers to write out in order; the data of each output is not copied.
+    """
+    assert alignment > 0 and alignment % 4 == 0, alignment
+    names = [filename.encode() for filename, _ in outputs]
+    table_size = _header_struct.size + _entry_struct.size * len(outputs)
+    names_offset = table_size
+
+    offset = _align(names_offset + sum(map(len, names)), alignment)
+    entries = []
+    blobs = []
+    name_offset = names_offset
+    for name, (filename, data) in zip(names, outputs):
+        entries.append(_entry_struct.pack(kind_of(filename), len(name), name_offset, offset, len(data)))
+        name_offset += len(name)
+        padding = _align(offset + len(data), alignment) - offset - len(data)
+        blobs += [data, bytes(padding)]
+        offset += len(data) + padding
+
+    toc = bytearray(_header_struct.pack(magic, version, len(outputs), alignment, offset))
+    for entry in entries:
+        toc += entry
+    for name in names:
+        toc += name
+    toc += bytes(_align(len(toc), alignment) - len(toc))
+    return [bytes(toc), *blobs]
+
+@dataclass
+class BundleEntry:
+    name: str
+    kind: int
+    offset: int
+    size: int
+
+class Bundle:
+    """
+    The table of contents of a bundle in mem (bytes, or a memoryview as
+    from map_file()); blobs are zero-copy views of mem.
+    """
+
+    def __init__(self, mem):
+        self.mem = memoryview(mem)
+        file_magic, file_version, number_of_entries, self.alignment, size = _header_struct.unpack_from(self.mem, 0)
+        if file_magic != magic:
+            raise ValueError(f"not a bundle: {bytes(file_magic)!r}")
+        if file_version != version:
+            raise ValueError(f"unsupported bundle version {file_version}")
+        if size > len(self.mem):
+            raise ValueError(f"truncated bundle: {len(self.mem)} of {size} bytes")
+
+        self.entries = []
+        for i in range(number_of_entries):
+            kind, name_size, name_offset, offset, size = _entry_struct.unpack_from(
+                self.mem, _header_struct.size + i * _entry_struct.size
+            )
+            name = bytes(self.mem[name_offset:name_offset + name_size]).decode()
+            self.entries.append(BundleEntry(name, kind, offset, size))
+        self.index = {entry.name: entry for entry in self.entries}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        entry = self.index[name]
+        return self.mem[entry.offset:entry.offset + entry.size]
+
+def open_bundle(filename):
+    """
+    Memory-map the bundle in filename.
+    """
+    return Bundle(map_file(filename))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List or extract the contents of a bundle.")
+    parser.add_argument("bundle")
+    parser.add_argument("--extract", metavar="DIR",
+                        help="write every blob to its own file in this directory")
+    args = parser.parse_args(argv)
+
+    b = open_bundle(args.bundle)
+    for entry in b.entries:
+        kind = kind_names.get(entry.kind, str(entry.kind))
+        print(f"{entry.offset:#010x} {entry.size:10} {kind:20} {entry.name}")
+
+    if args.extract is not None:
+        os.makedirs(args.extract, exist_ok=True)
+        for entry in b.entries:
+            with open(os.path.join(args.extract, entry.name), "wb") as f:
+                f.write(b[entry.name])
+
+if __name__ == "__main__":
+    sys.exit(main())
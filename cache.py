@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# bump when the format of any cached output changes
+CACHE_VERSION = 2
+
+class BuildCache:
+    """
+    Content-addressed store for converted outputs.
+
+    Blobs are stored under objects/ by key, and written atomically, so any
+    number of worker processes can get() and put() concurrently. Accesses
+    are recorded in `touched` and merged into the on-disk index (last use
+    time and size of every blob) by the parent process with update(), which
+    also evicts least recently used blobs past max_size.
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.touched = dict() # key -> (size, last used)
+
+    def __getstate__(self):
+        # workers start with an empty record of accesses
+        state = self.__dict__.copy()
+        state["touched"] = dict()
+        return state
+
+    @staticmethod
+    def key(*parts):
+        h = hashlib.sha256()
+        h.update(str(CACHE_VERSION).encode())
+        for part in parts:
+            if isinstance(part, (bytes, bytearray, memoryview)):
+                data = part
+            else:
+                data = json.dumps(part, sort_keys=True).encode()
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, "objects", key[:2], key[2:])
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touched[key] = (len(data), time.time())
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.touched[key] = (len(data), time.time())
+
+    def cached(self, key, build):
+        data = self.get(key)
+        if data is None:
+            data = build()
+            self.put(key, data)
+        return data
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return dict()
+        if index.get("version") != CACHE_VERSION:
+            return dict()
+        return {key: tuple(entry) for key, entry in index["entries"].items()}
+
+    def _save_index(self, entries):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": entries}, f)
+        os.replace(tmp, self._index_path())
+
+    def update(self, touched=None):
+        """
+        Merge touched (by default, this instance's own accesses) into the
+        index, then evict least recently used blobs until the cache fits in
+        max_size.
+        """
+        entries = self._load_index()
+        if touched is None:
+            touched = self.touched
+        for key, (size, last_used) in touched.items():
+            old = entries.get(key)
+            if old is None or old[1] < last_used:
+                entries[key] = (size, last_used)
+
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            del entries[key]
+            total -= size
+
+        self._save_index(entries)
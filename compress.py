@@ -0,0 +1,199 @@
+import struct
+
+# Every compressed blob starts with a big-endian u32: the method in the top
+# byte and the uncompressed size in the low 24 bits.
+#
+# none:  the data, stored when neither method makes it smaller
+#
+# rle:   runs of control byte c, then
+#          c < 0x80:  c + 1 literal bytes
+#          c >= 0x80: one byte, repeated c - 0x80 + 3 times
+#
+# lzss:  groups of a flag byte, then 8 items (fewer at the end), the first
+#        item for the most significant flag bit:
+#          flag 0:  one literal byte
+#          flag 1:  u16 big-endian (length - 3) << 12 | (distance - 1),
+#                   copy length bytes from distance bytes back, one byte at a
+#                   time (the copy may overlap its own output)
+#
+# Both decode with byte loads and stores only, and never look further back
+# than the output already written.
+methods = {
+    "none": 0,
+    "rle": 1,
+    "lzss": 2,
+}
+method_names = {method: name for name, method in methods.items()}
+
+_header_struct = struct.Struct(">I")
+max_size = 0xffffff
+
+_rle_max_literals = 0x80
+_rle_min_run = 3
+_rle_max_run = 0x7f + _rle_min_run
+
+_lzss_min_length = 3
+_lzss_max_length = 0xf + _lzss_min_length
+_lzss_window = 0x1000
+
+def _header(method, size):
+    if size > max_size:
+        raise ValueError(f"{size} bytes are too large to compress (at most {max_size})")
+    return _header_struct.pack(methods[method] << 24 | size)
+
+def rle_compress(data):
+    data = bytes(data)
+    out = bytearray(_header("rle", len(data)))
+    literal_start = 0
+    i = 0
+    while i < len(data):
+        run = 1
+        while i + run < len(data) and run < _rle_max_run and data[i + run] == data[i]:
+            run += 1
+        if run < _rle_min_run:
+            i += run
+            continue
+        for start in range(literal_start, i, _rle_max_literals):
+            literals = data[start:min(i, start + _rle_max_literals)]
+            out.append(len(literals) - 1)
+            out += literals
+        out.append(0x80 + run - _rle_min_run)
+        out.append(data[i])
+        i += run
+        literal_start = i
+    for start in range(literal_start, len(data), _rle_max_literals):
+        literals = data[start:start + _rle_max_literals]
+        out.append(len(literals) - 1)
+        out += literals
+    return bytes(out)
+
+def rle_decompress(data, size):
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        c = data[i]
+        if c < 0x80:
+            out += data[i + 1:i + 2 + c]
+            i += 2 + c
+        else:
+            out += bytes((data[i + 1],)) * (c - 0x80 + _rle_min_run)
+            i += 2
+    assert len(out) == size, (len(out), size)
+    return bytes(out)
+
+def lzss_compress(data, level=6):
+    """
+    Greedy LZSS; level (1 to 9) sets how many earlier occurrences of each
+    3-byte prefix are searched for the longest match, from 1 to 256.
+    """
+    assert 1 <= level <= 9, level
+    max_chain = 1 << (level - 1)
+    data = bytes(data)
+    out = bytearray(_header("lzss", len(data)))
+
+    # most recent position of each 3-byte prefix, and the previous position
+    # with the same prefix as each position
+    head = dict()
+    prev = [-1] * len(data)
+
+    def insert(position):
+        if position + _lzss_min_length <= len(data):
+            prefix = data[position:position + _lzss_min_length]
+            prev[position] = head.get(prefix, -1)
+            head[prefix] = position
+
+    flags_index = None
+    item = 8
+    i = 0
+    while i < len(data):
+        if item == 8:
+            flags_index = len(out)
+            out.append(0)
+            item = 0
+
+        best_length = 0
+        best_distance = 0
+        if i + _lzss_min_length <= len(data):
+            limit = min(_lzss_max_length, len(data) - i)
+            candidate = head.get(data[i:i + _lzss_min_length], -1)
+            chain = max_chain
+            while candidate >= 0 and i - candidate <= _lzss_window and chain:
+                # only a candidate that also matches at best_length can be longer
+                if data[candidate + best_length] == data[i + best_length]:
+                    length = _lzss_min_length
+                    while length < limit and data[candidate + length] == data[i + length]:
+                        length += 1
+                    if length > best_length:
+                        best_length = length
+                        best_distance = i - candidate
+                        if length == limit:
+                            break
+                candidate = prev[candidate]
+                chain -= 1
+
+        if best_length >= _lzss_min_length:
+            out[flags_index] |= 0x80 >> item
+            out += struct.pack(">H", (best_length - _lzss_min_length) << 12 | (best_distance - 1))
+            for position in range(i, i + best_length):
+                insert(position)
+            i += best_length
+        else:
+            out.append(data[i])
+            insert(i)
+            i += 1
+        item += 1
+    return bytes(out)
+
+def lzss_decompress(data, size):
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        flags = data[i]
+        i += 1
+        for item in range(8):
+            if len(out) >= size:
+                break
+            if flags & (0x80 >> item):
+                word = data[i] << 8 | data[i + 1]
+                i += 2
+                start = len(out) - (word & 0xfff) - 1
+                assert start >= 0, start
+                for j in range(start, start + (word >> 12) + _lzss_min_length):
+                    out.append(out[j])
+            else:
+                out.append(data[i])
+                i += 1
+    assert len(out) == size, (len(out), size)
+    return bytes(out)
+
+def compress(data, method, level=6):
+    """
+    data compressed with method, or stored if that is not smaller.
+    """
+    if method == "rle":
+        out = rle_compress(data)
+    elif method == "lzss":
+        out = lzss_compress(data, level)
+    else:
+        assert False, method
+    if len(out) >= _header_struct.size + len(data):
+        return _header("none", len(data)) + bytes(data)
+    return out
+
+def decompress(data):
+    """
+    The original data of a blob from compress(), whichever its method.
+    """
+    word, = _header_struct.unpack_from(data, 0)
+    method = method_names.get(word >> 24)
+    size = word & max_size
+    data = memoryview(data)[_header_struct.size:]
+    if method == "none":
+        assert len(data) == size, (len(data), size)
+        return bytes(data)
+    elif method == "rle":
+        return rle_decompress(data, size)
+    elif method == "lzss":
+        return lzss_decompress(data, size)
+    else:
+        raise ValueError(f"unknown compression method {word >> 24}")
@@ -0,0 +1,183 @@
+import struct
+import sys
+from array import array
+
+from aseprite import PaletteChunk, OldPaletteChunk, iter_file_chunks
+from aseprite import parse_palette_chunk, parse_old_palette_chunk, numpy
+
+# VDP2 color RAM modes: (bytes per color, maximum number of colors)
+#   0: RGB555, 1024 colors
+#   1: RGB555, 2048 colors
+#   2: RGB888, 1024 colors
+cram_modes = {
+    0: (2, 1024),
+    1: (2, 2048),
+    2: (4, 1024),
+}
+
+quantize_modes = ("truncate", "nearest", "ordered")
+
+# 4x4 ordered dither thresholds, applied in palette index order so that
+# gradients (ramps of adjacent palette entries) dither across the ramp
+_bayer_4x4 = (
+     0,  8,  2, 10,
+    12,  4, 14,  6,
+     3, 11,  1,  9,
+    15,  7, 13,  5,
+)
+
+def _table(f):
+    return bytes(f(c) for c in range(256))
+
+# 8-bit to 5-bit channel lookups
+_truncate_5 = _table(lambda c: c >> 3)
+_nearest_5 = _table(lambda c: (c * 31 + 127) // 255)
+_ordered_5 = tuple(
+    _table(lambda c, t=t: min(31, (c * 31 * 16 + t * 255) // (255 * 16)))
+    for t in _bayer_4x4
+)
+
+def palette_rgb(palette):
+    """
+    (first color index, red, green, blue) for a PaletteChunk or
+    OldPaletteChunk, with one byte per entry for each channel. Such a tuple
+    is returned unchanged.
+    """
+    if type(palette) is tuple:
+        return palette
+    elif type(palette) is PaletteChunk:
+        return palette.first_color_index_to_change, palette.red, palette.green, palette.blue
+    elif type(palette) is OldPaletteChunk:
+        colors = palette.packets[0].colors
+        return (
+            0,
+            bytes(color[0] for color in colors),
+            bytes(color[1] for color in colors),
+            bytes(color[2] for color in colors),
+        )
+    else:
+        assert False, type(palette)
+
+def _quantize_5(channel, quantize, first=0):
+    # first is the palette index of channel[0], which the dither follows
+    if quantize == "truncate":
+        return channel.translate(_truncate_5)
+    elif quantize == "nearest":
+        return channel.translate(_nearest_5)
+    elif quantize == "ordered":
+        out = bytearray(len(channel))
+        for i in range(len(_ordered_5)):
+            table = _ordered_5[(first + i) % len(_ordered_5)]
+            out[i::len(_ordered_5)] = channel[i::len(_ordered_5)].translate(table)
+        return bytes(out)
+    else:
+        assert False, quantize
+
+def pack_colors(red, green, blue, cram_mode=0, quantize="truncate", first=0):
+    """
+    Pack channel bytes into big-endian color RAM entries for cram_mode. In
+    the RGB555 modes, quantize selects how 8-bit channels are reduced to 5
+    bits: "truncate", "nearest", or "ordered" (4x4 ordered dither, by
+    palette index, the first color being index first).
+    """
+    assert cram_mode in cram_modes, cram_mode
+    assert len(red) == len(green) == len(blue), (len(red), len(green), len(blue))
+
+    if cram_mode == 2:
+        # 0x00BBGGRR
+        buf = bytearray(4 * len(red))
+        buf[1::4] = blue
+        buf[2::4] = green
+        buf[3::4] = red
+        return bytes(buf)
+
+    red = _quantize_5(bytes(red), quantize, first)
+    green = _quantize_5(bytes(green), quantize, first)
+    blue = _quantize_5(bytes(blue), quantize, first)
+
+    if numpy is not None:
+        r = numpy.frombuffer(red, dtype=numpy.uint8).astype(numpy.uint16)
+        g = numpy.frombuffer(green, dtype=numpy.uint8).astype(numpy.uint16)
+        b = numpy.frombuffer(blue, dtype=numpy.uint8).astype(numpy.uint16)
+        return (r | (g << 5) | (b << 10)).astype(">u2").tobytes()
+
+    words = array("H", [r | (g << 5) | (b << 10) for r, g, b in zip(red, green, blue)])
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tobytes()
+
+def pack_palette(palette, cram_mode=0, quantize="truncate"):
+    """
+    The whole palette as color RAM data, starting at color index 0.
+    """
+    first, red, green, blue = palette_rgb(palette)
+    assert first == 0, first
+    _, max_colors = cram_modes[cram_mode]
+    assert len(red) <= max_colors, (len(red), cram_mode)
+    return pack_colors(red, green, blue, cram_mode, quantize)
+
+def palette_changes(mem):
+    """
+    Yield (frame index, palette chunk) for every palette chunk after the
+    first frame; only palette chunks are parsed.
+    """
+    for frame_index, chunk in iter_file_chunks(mem):
+        if frame_index == 0:
+            continue
+        if chunk.chunk_type == 0x2019:
+            palette, _ = parse_palette_chunk(chunk.data)
+            yield frame_index, palette
+        elif chunk.chunk_type == 0x4:
+            palette, _ = parse_old_palette_chunk(chunk.data)
+            yield frame_index, palette
+
+def palette_deltas(palette, changes, cram_mode=0, quantize="truncate"):
+    """
+    Diff each palette change against the color RAM contents left by the
+    previous one. Yields (frame index, [(first color index, packed
+    entries), ...]) with one run per span of entries that actually changed.
+    """
+    entry_size, _ = cram_modes[cram_mode]
+    state = bytearray(pack_palette(palette, cram_mode, quantize))
+
+    for frame_index, palette in changes:
+        first, red, green, blue = palette_rgb(palette)
+        packed = pack_colors(red, green, blue, cram_mode, quantize, first)
+        end = first * entry_size + len(packed)
+        if end > len(state):
+            state += bytes(end - len(state))
+
+        runs = []
+        run_start = None
+        for i in range(len(red)):
+            old = state[(first + i) * entry_size:(first + i + 1) * entry_size]
+            new = packed[i * entry_size:(i + 1) * entry_size]
+            if old != new and run_start is None:
+                run_start = i
+            elif old == new and run_start is not None:
+                runs.append((first + run_start, packed[run_start * entry_size:i * entry_size]))
+                run_start = None
+        if run_start is not None:
+            runs.append((first + run_start, packed[run_start * entry_size:]))
+
+        state[first * entry_size:end] = packed
+        if runs:
+            yield frame_index, runs
+
+def pack_palette_deltas(deltas, cram_mode=0):
+    """
+    Serialize palette_deltas() as a big-endian stream:
+
+      u16 number of frames
+      per frame:  u16 frame index, u16 number of runs
+      per run:    u16 first color index, u16 number of colors, entries
+    """
+    entry_size, _ = cram_modes[cram_mode]
+    deltas = list(deltas)
+    buf = bytearray(struct.pack(">H", len(deltas)))
+    for frame_index, runs in deltas:
+        buf += struct.pack(">HH", frame_index, len(runs))
+        for first, entries in runs:
+            buf += struct.pack(">HH", first, len(entries) // entry_size)
+            buf += entries
+    return bytes(buf)
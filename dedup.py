@@ -0,0 +1,103 @@
+from array import array
+from dataclasses import dataclass
+
+from aseprite import TilesetChunkInternal, numpy, _uint32_typecode
+
+# pattern name data flip bits (2-word format)
+x_flip_bit = 1 << 30
+y_flip_bit = 1 << 31
+
+@dataclass
+class DeduplicatedTiles:
+    tile_width: int
+    tile_height: int
+    number_of_tiles: int
+    # unique tiles, tile-major and row-major like TilesetChunkInternal.pixel
+    pixel: bytes
+    # by tileset id: for each tile of that tileset, the index of the
+    # surviving tile | x_flip_bit | y_flip_bit
+    remap: dict[int, array]
+
+def flip_tiles(pixel, tile_width, tile_height, x_flip, y_flip):
+    """
+    Flip every tile in tile-major, row-major pixel data.
+    """
+    tile_size = tile_width * tile_height
+    assert len(pixel) % tile_size == 0, (len(pixel), tile_size)
+    if not (x_flip or y_flip):
+        return bytes(pixel)
+
+    if numpy is not None:
+        a = numpy.frombuffer(pixel, dtype=numpy.uint8)
+        a = a.reshape(len(pixel) // tile_size, tile_height, tile_width)
+        a = a[:, ::-1 if y_flip else 1, ::-1 if x_flip else 1]
+        return a.tobytes()
+
+    # one strided copy per byte position within a tile, across every tile
+    buf = bytearray(len(pixel))
+    for y in range(tile_height):
+        src_y = tile_height - 1 - y if y_flip else y
+        for x in range(tile_width):
+            src_x = tile_width - 1 - x if x_flip else x
+            buf[y * tile_width + x::tile_size] = pixel[src_y * tile_width + src_x::tile_size]
+    return bytes(buf)
+
+def deduplicate(tileset_chunks, flips=True):
+    """
+    Merge identical tiles within and across tileset_chunks, which must all
+    have the same tile size. With flips, a tile that is an x, y or xy flip
+    of an earlier tile is also merged, and referenced through the flip
+    bits in remap.
+    """
+    tile_width = tileset_chunks[0].tile_width
+    tile_height = tileset_chunks[0].tile_height
+    tile_size = tile_width * tile_height
+
+    variants = [(0, False, False)]
+    if flips:
+        variants += [
+            (x_flip_bit, True, False),
+            (y_flip_bit, False, True),
+            (x_flip_bit | y_flip_bit, True, True),
+        ]
+
+    unique = dict() # tile pixels -> index of the surviving tile
+    pixel = bytearray()
+    remap = dict()
+
+    for tileset_chunk in tileset_chunks:
+        assert type(tileset_chunk.data) is TilesetChunkInternal
+        assert (tileset_chunk.tile_width, tileset_chunk.tile_height) == (tile_width, tile_height)
+        number_of_tiles = tileset_chunk.number_of_tiles
+        source = memoryview(tileset_chunk.data.pixel)[:tile_size * number_of_tiles]
+
+        flipped = [
+            (bits, flip_tiles(source, tile_width, tile_height, x_flip, y_flip))
+            for bits, x_flip, y_flip in variants
+        ]
+
+        tileset_remap = array(_uint32_typecode, bytes(4 * number_of_tiles))
+        for i in range(number_of_tiles):
+            start = i * tile_size
+            for bits, tiles in flipped:
+                # flips are their own inverse: if the flipped tile survives,
+                # the tile is that survivor flipped the same way
+                index = unique.get(tiles[start:start + tile_size])
+                if index is not None:
+                    tileset_remap[i] = index | bits
+                    break
+            else:
+                index = len(unique)
+                tile = flipped[0][1][start:start + tile_size]
+                unique[tile] = index
+                pixel += tile
+                tileset_remap[i] = index
+        remap[tileset_chunk.tileset_id] = tileset_remap
+
+    return DeduplicatedTiles(
+        tile_width = tile_width,
+        tile_height = tile_height,
+        number_of_tiles = len(unique),
+        pixel = bytes(pixel),
+        remap = remap,
+    )
@@ -0,0 +1,106 @@
+import os
+import time
+import cProfile
+from contextlib import contextmanager
+
+class Measurement:
+    """
+    One timed run of a stage; bytes_out may be set inside the with block.
+    """
+
+    __slots__ = ("bytes_in", "bytes_out")
+
+    def __init__(self, bytes_in=0):
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+
+class Instrument:
+    """
+    Wall time, bytes in and out, and number of runs of each stage, and
+    counts of objects (chunks by type, tiles, ...), for one converted file.
+    """
+
+    def __init__(self):
+        # name -> [runs, seconds, bytes in, bytes out]
+        self.stages = dict()
+        self.counts = dict()
+
+    @contextmanager
+    def stage(self, name, bytes_in=0):
+        measurement = Measurement(bytes_in)
+        start = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            elapsed = time.perf_counter() - start
+            totals = self.stages.setdefault(name, [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] += measurement.bytes_in
+            totals[3] += measurement.bytes_out
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def report(self):
+        stages = dict()
+        for name, (runs, seconds, bytes_in, bytes_out) in self.stages.items():
+            stages[name] = {
+                "runs": runs,
+                "seconds": seconds,
+                "bytes_in": bytes_in,
+                "bytes_out": bytes_out,
+                "ratio": bytes_out / bytes_in if bytes_in and bytes_out else None,
+            }
+        return {"stages": stages, "counts": dict(self.counts)}
+
+# the Instrument that stage() and count() record into; None (the default)
+# makes them no-ops
+_active = None
+
+class _Disabled:
+    def __enter__(self):
+        return Measurement()
+
+    def __exit__(self, *exc_info):
+        return False
+
+_disabled = _Disabled()
+
+def stage(name, bytes_in=0):
+    """
+    Context manager timing one run of the named stage, when instrumentation
+    is active.
+    """
+    if _active is None:
+        return _disabled
+    return _active.stage(name, bytes_in)
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+@contextmanager
+def instrumented():
+    """
+    Record into a new Instrument for the duration of the with block.
+    """
+    global _active
+    previous = _active
+    _active = Instrument()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+def profiled(profile_filename, f, *args, **kwargs):
+    """
+    Call f under cProfile, writing the stats (for pstats or snakeviz) to
+    profile_filename.
+    """
+    os.makedirs(os.path.dirname(profile_filename) or ".", exist_ok=True)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(f, *args, **kwargs)
+    finally:
+        profile.dump_stats(profile_filename)
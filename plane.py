@@ -0,0 +1,163 @@
+from array import array
+from dataclasses import dataclass
+
+from aseprite import numpy
+
+# VDP2 plane sizes, in pages
+plane_sizes = ((1, 1), (2, 1), (2, 2))
+
+@dataclass
+class PlaneLayout:
+    # map size, in cells
+    width: int
+    height: int
+    # page size, in cells: 64x64 for 1x1 cell characters, 32x32 for 2x2
+    x_cells: int
+    y_cells: int
+    # plane size, in pages
+    plane_width: int
+    plane_height: int
+
+    @property
+    def h_pages(self):
+        return (self.width + self.x_cells - 1) // self.x_cells
+
+    @property
+    def v_pages(self):
+        return (self.height + self.y_cells - 1) // self.y_cells
+
+    @property
+    def h_planes(self):
+        return (self.h_pages + self.plane_width - 1) // self.plane_width
+
+    @property
+    def v_planes(self):
+        return (self.v_pages + self.plane_height - 1) // self.plane_height
+
+    @property
+    def page_cells(self):
+        return self.x_cells * self.y_cells
+
+    @property
+    def plane_cells(self):
+        return self.plane_width * self.plane_height * self.page_cells
+
+    @property
+    def number_of_cells(self):
+        return self.h_planes * self.v_planes * self.plane_cells
+
+    def offset(self, x, y):
+        """
+        Index, in page order, of the cell at map position x, y.
+        """
+        h_page, page_x = divmod(x, self.x_cells)
+        v_page, page_y = divmod(y, self.y_cells)
+        h_plane, plane_x = divmod(h_page, self.plane_width)
+        v_plane, plane_y = divmod(v_page, self.plane_height)
+        return (
+            (v_plane * self.h_planes + h_plane) * self.plane_cells
+            + (plane_y * self.plane_width + plane_x) * self.page_cells
+            + page_y * self.x_cells + page_x
+        )
+
+    def __str__(self):
+        return (
+            f"{self.width}x{self.height} cells, {self.h_pages}x{self.v_pages} pages, "
+            f"{self.h_planes}x{self.v_planes} planes of {self.plane_width}x{self.plane_height} pages"
+        )
+
+def plane_layout(width, height, x_cells, y_cells, plane_size=None):
+    """
+    Split a width by height cell map into x_cells by y_cells pages, grouped
+    into planes of plane_size (plane width, plane height) pages. By default
+    planes are the smallest VDP2 plane size that avoids empty pages: 2x2
+    pages, 2x1 for maps one page high and 1x1 for maps one page wide.
+    """
+    layout = PlaneLayout(width, height, x_cells, y_cells, 1, 1)
+    if plane_size is None:
+        plane_width = min(2, layout.h_pages)
+        plane_height = 2 if plane_width == 2 and layout.v_pages > 1 else 1
+        plane_size = (max(1, plane_width), plane_height)
+    else:
+        plane_size = tuple(plane_size)
+        assert plane_size in plane_sizes, plane_size
+    layout.plane_width, layout.plane_height = plane_size
+    return layout
+
+def page_order(pattern, layout):
+    """
+    Reorder row-major pattern name data (a flat numpy array or array) into
+    page order: planes left to right then top to bottom, the pages of each
+    plane likewise, and each page row-major. Cells outside of the map are
+    zero.
+    """
+    width, height = layout.width, layout.height
+    assert len(pattern) == width * height, (len(pattern), width, height)
+
+    if numpy is not None:
+        plane = numpy.zeros(
+            (
+                layout.v_planes, layout.plane_height, layout.y_cells,
+                layout.h_planes, layout.plane_width, layout.x_cells,
+            ),
+            dtype=pattern.dtype,
+        )
+        full = plane.reshape(
+            layout.v_planes * layout.plane_height * layout.y_cells,
+            layout.h_planes * layout.plane_width * layout.x_cells,
+        )
+        full[:height, :width] = pattern.reshape(height, width)
+        return plane.transpose(0, 3, 1, 4, 2, 5).reshape(-1)
+
+    # one slice copy per page row
+    table = array(pattern.typecode, bytes(pattern.itemsize * layout.number_of_cells))
+    for y in range(height):
+        for x in range(0, width, layout.x_cells):
+            row_width = min(layout.x_cells, width - x)
+            src = y * width + x
+            dst = layout.offset(x, y)
+            table[dst:dst + row_width] = pattern[src:src + row_width]
+    return table
+
+def strips(data, entry_size, layout):
+    """
+    Row and column strips of page-ordered pattern name table data, as
+    (rows, columns). Each strip is a whole row (or column) of the map, so
+    entry (x, y) is at (y * width + x) * entry_size in rows and at
+    (x * height + y) * entry_size in columns; a runtime scrolling through a
+    map larger than its planes can copy just the cells entering the window.
+    """
+    width, height = layout.width, layout.height
+    assert len(data) == layout.number_of_cells * entry_size, (len(data), layout.number_of_cells, entry_size)
+
+    if numpy is not None:
+        a = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+            layout.v_planes, layout.h_planes,
+            layout.plane_height, layout.plane_width,
+            layout.y_cells, layout.x_cells,
+            entry_size,
+        )
+        a = a.transpose(0, 2, 4, 1, 3, 5, 6).reshape(
+            layout.v_planes * layout.plane_height * layout.y_cells,
+            layout.h_planes * layout.plane_width * layout.x_cells,
+            entry_size,
+        )[:height, :width]
+        return a.tobytes(), a.transpose(1, 0, 2).tobytes()
+
+    row_size = width * entry_size
+    rows = bytearray(row_size * height)
+    for y in range(height):
+        for x in range(0, width, layout.x_cells):
+            size = min(layout.x_cells, width - x) * entry_size
+            src = layout.offset(x, y) * entry_size
+            dst = y * row_size + x * entry_size
+            rows[dst:dst + size] = data[src:src + size]
+
+    # one strided copy per byte of each column
+    column_size = height * entry_size
+    columns = bytearray(len(rows))
+    for x in range(width):
+        for b in range(entry_size):
+            dst = x * column_size + b
+            columns[dst:dst + column_size:entry_size] = rows[x * entry_size + b::row_size]
+    return bytes(rows), bytes(columns)
@@ -0,0 +1,778 @@
+import io
+import zlib
+import os
+import gc
+import sys
+import random
+import struct
+import weakref
+import tempfile
+import threading
+import contextlib
+
+from aseprite import (
+    parse_file,
+    parse_header,
+    parse_cel_chunk,
+    iter_file_chunks,
+    ChunkIndex,
+    FrameSequence,
+    CelChunk,
+    CelChunk_LinkedCell,
+    CelChunk_RawImageData,
+    ZlibData,
+    TilesetChunk,
+    TilesetChunkInternal,
+    numpy,
+    _header_struct,
+    _layer_header_struct,
+    _cel_header_struct,
+    _cel_image_header_struct,
+)
+from background import Options, convert, convert_data, pattern_name_table, one_word_pattern_name_table
+from cache import BuildCache
+import animation
+import bank
+import compress
+import cram
+import dedup
+import plane
+import sprite
+import writer
+import tilize
+import synthetic
+
+def synthetic_file():
+    return synthetic.build(synthetic.SyntheticOptions(
+        tilesets = [(8, 8, 64), (16, 16, 32)],
+        map_size = (70, 40),
+        frames = 3,
+    ))
+
+def check_compress(buf):
+    rng = random.Random(0)
+    inputs = [
+        b"",
+        b"a",
+        b"aaa",
+        bytes(1000),
+        b"abc" * 1000,
+        bytes(rng.randrange(256) for _ in range(5000)),
+        bytes(rng.choice(b"\0\0\0\1\2") for _ in range(20000)),
+    ]
+    inputs += [data for filename, data, _ in convert_data(buf) if filename.endswith(".bin")]
+    for data in inputs:
+        for method, level in (("rle", 6), ("lzss", 1), ("lzss", 6), ("lzss", 9)):
+            compressed = compress.compress(data, method, level)
+            assert compress.decompress(compressed) == data, (method, level, len(data))
+            assert len(compressed) <= len(data) + 4, (method, level, len(data))
+
+def parsed(source):
+    tilesets, layers, palette, cel_chunks = parse_file(source)
+    return (
+        {i: bytes(t.data.pixel) for i, t in tilesets.items()},
+        [layer.layer_name for layer in layers],
+        {i: list(c.data.tile) for i, c in cel_chunks.items()},
+    )
+
+def check_file_objects(buf):
+    expected = parsed(buf)
+
+    # a regular file is memory-mapped, a BytesIO (no fileno) is read
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "input.aseprite")
+        with open(filename, "wb") as f:
+            f.write(buf)
+        with open(filename, "rb") as f:
+            f.read(10)
+            assert parsed(f) == expected
+    f = io.BytesIO(buf)
+    f.read(10)
+    assert parsed(f) == expected
+
+    # a pipe cannot be mapped or seeked, and is read from where it is
+    read_fd, write_fd = os.pipe()
+    def write():
+        with open(write_fd, "wb") as f:
+            f.write(buf)
+    writer_thread = threading.Thread(target=write)
+    writer_thread.start()
+    with open(read_fd, "rb") as f:
+        assert not f.seekable()
+        assert parsed(f) == expected
+    writer_thread.join()
+
+def check_tilize():
+    rng = random.Random(3)
+    canvas_width, canvas_height = 21, 13
+    for tile_width, tile_height in ((8, 8), (16, 16)):
+        # cels inside the canvas, and overhanging every edge
+        for x, y, width, height in ((2, 3, 10, 7), (-5, -4, 40, 30), (15, 9, 12, 12)):
+            pixel = bytes(rng.randrange(1, 4) for _ in range(width * height))
+            cel_chunk = CelChunk(
+                layer_index = 0,
+                x_position = x,
+                y_position = y,
+                opacity_level = 255,
+                cel_type = 0,
+                z_index = 0,
+                data = CelChunk_RawImageData(width, height, memoryview(pixel)),
+            )
+            tileset_chunk, tilemap_cel_chunk = tilize.tilize_cel(
+                cel_chunk, canvas_width, canvas_height, tile_width, tile_height, 0, 0,
+            )
+            tilemap = tilemap_cel_chunk.data
+            tile_size = tile_width * tile_height
+            tiles = tileset_chunk.data.pixel
+            assert tiles[:tile_size] == bytes(tile_size)
+            assert len(tiles) == tile_size * tileset_chunk.number_of_tiles
+            assert len({tiles[i:i + tile_size] for i in range(0, len(tiles), tile_size)}) == tileset_chunk.number_of_tiles
+            columns = tilemap.width_in_number_of_tiles
+            assert columns * tile_width >= canvas_width > (columns - 1) * tile_width, columns
+            for py in range(tilemap.height_in_number_of_tiles * tile_height):
+                for px in range(columns * tile_width):
+                    tile = tilemap.tile[(py // tile_height) * columns + px // tile_width]
+                    value = tiles[tile * tile_size + (py % tile_height) * tile_width + px % tile_width]
+                    expected = 0
+                    if px < canvas_width and py < canvas_height and 0 <= px - x < width and 0 <= py - y < height:
+                        expected = pixel[(py - y) * width + px - x]
+                    assert value == expected, ((x, y, width, height), px, py)
+
+def apply_tilemap_deltas(table, data):
+    """
+    The table after each frame of a pack_tilemap_deltas() stream, by frame
+    index.
+    """
+    table = bytearray(table)
+    tables = dict()
+    number_of_frames, = struct.unpack_from(">H", data, 0)
+    offset = 2
+    for _ in range(number_of_frames):
+        frame_index, number_of_runs = struct.unpack_from(">HH", data, offset)
+        offset += 4
+        for _ in range(number_of_runs):
+            address, size = struct.unpack_from(">IH", data, offset)
+            offset += 6
+            table[address:address + size] = data[offset:offset + size]
+            offset += size
+        tables[frame_index] = bytes(table)
+    assert offset == len(data), (offset, len(data))
+    return tables
+
+def check_tilemap_deltas(buf):
+    rng = random.Random(1)
+    for entry_size in (2, 4):
+        tables = [bytes(rng.randrange(4) for _ in range(0x20000)) for _ in range(3)]
+        tables.append(tables[0])
+        requested = []
+        def iter_tables():
+            for frame_index, t in enumerate(tables):
+                requested.append(frame_index)
+                yield t
+        table = bytearray(tables[0])
+        for frame_index, runs in animation.tilemap_deltas(iter_tables(), entry_size):
+            # frames are diffed as they stream, without reading ahead
+            if frame_index != 0:
+                assert requested[-1] == frame_index, (requested, frame_index)
+            for offset, data in runs:
+                assert len(data) <= animation.max_run_size and len(data) % entry_size == 0, len(data)
+                table[offset:offset + len(data)] = data
+            assert table == tables[frame_index], frame_index
+        animation.pack_tilemap_deltas(animation.tilemap_deltas(tables, entry_size))
+
+    # the exported deltas rebuild the table of every frame, linked cels
+    # included
+    tilesets, layers, _, _ = parse_file(buf)
+    outputs = {filename: data for filename, data, _ in convert_data(buf, Options(tilemap_deltas=True, vblank_budget=0x100000))}
+    frames = list(FrameSequence(buf))
+    for layer_index, layer_chunk in enumerate(layers):
+        tileset_chunk = tilesets[layer_chunk.tileset_index]
+        x_cells = 64 // (tileset_chunk.tile_width // 8)
+        y_cells = 64 // (tileset_chunk.tile_height // 8)
+        expected = [pattern_name_table(frame.cel_chunks[layer_index], x_cells, y_cells) for frame in frames]
+        first = outputs[f"pattern_name_table__layer_{layer_index}.bin"]
+        assert first == expected[0], layer_index
+        tables = apply_tilemap_deltas(first, outputs[f"pattern_name_deltas__layer_{layer_index}.bin"])
+        table = first
+        for frame_index in list(range(1, len(frames))) + [0]:
+            table = tables.get(frame_index, table)
+            assert table == expected[frame_index], (layer_index, frame_index)
+
+def reference_pattern_name_table(cel_chunk, x_cells, y_cells):
+    """
+    2-word pattern name data of cel_chunk in page order, one cell at a time.
+    """
+    tilemap = cel_chunk.data
+    width = tilemap.width_in_number_of_tiles
+    height = tilemap.height_in_number_of_tiles
+    h_pages = (width + x_cells - 1) // x_cells
+    v_pages = (height + y_cells - 1) // y_cells
+    plane_width = min(2, h_pages)
+    plane_height = 2 if plane_width == 2 and v_pages > 1 else 1
+    h_planes = (h_pages + plane_width - 1) // plane_width
+    v_planes = (v_pages + plane_height - 1) // plane_height
+
+    page_cells = x_cells * y_cells
+    table = [0] * (h_planes * v_planes * plane_width * plane_height * page_cells)
+    for y in range(height):
+        for x in range(width):
+            tile = tilemap.tile[y * width + x]
+            page_x, page_y = x // x_cells, y // y_cells
+            plane_index = (page_y // plane_height) * h_planes + page_x // plane_width
+            page = plane_index * plane_width * plane_height + (page_y % plane_height) * plane_width + page_x % plane_width
+            entry = tile & tilemap.bitmask_for_tile_id
+            if tile & tilemap.bitmask_for_x_flip:
+                entry |= 1 << 30
+            if tile & tilemap.bitmask_for_y_flip:
+                entry |= 1 << 31
+            table[page * page_cells + (y % y_cells) * x_cells + x % x_cells] = entry
+    return struct.pack(f">{len(table)}I", *table)
+
+def check_pattern_name_table(buf):
+    tilesets, layers, _, cel_chunks = parse_file(buf)
+    outputs = {filename: data for filename, data, _ in convert_data(buf)}
+    for layer_index, cel_chunk in cel_chunks.items():
+        tileset_chunk = tilesets[layers[layer_index].tileset_index]
+        x_cells = 64 // (tileset_chunk.tile_width // 8)
+        y_cells = 64 // (tileset_chunk.tile_height // 8)
+        expected = reference_pattern_name_table(cel_chunk, x_cells, y_cells)
+        assert pattern_name_table(cel_chunk, x_cells, y_cells) == expected, layer_index
+        assert outputs[f"pattern_name_table__layer_{layer_index}.bin"] == expected, layer_index
+
+def check_linked_cels():
+    frames = FrameSequence(synthetic.build(synthetic.SyntheticOptions(
+        tilesets = [(8, 8, 16)],
+        map_size = (16, 8),
+        frames = 12,
+    )))
+    # odd frames link the cels of the previous frame
+    for frame_index, frame in enumerate(frames):
+        for layer_index, cel_chunk in frame.cel_chunks.items():
+            assert type(cel_chunk.data) is not CelChunk_LinkedCell, (frame_index, layer_index)
+            source = frame_index - frame_index % 2
+            expected = frames.cel(source, layer_index)
+            assert list(cel_chunk.data.tile) == list(expected.data.tile), (frame_index, layer_index)
+            if frame_index % 2:
+                assert type(frames.cel(frame_index, layer_index).data) is CelChunk_LinkedCell
+
+    # random access resolves links like iteration does
+    assert list(frames[-1].cel_chunks[0].data.tile) == list(frames[10].cel_chunks[0].data.tile)
+
+    # a link target is released once no frame holds it and later links
+    # have pushed it out of the cache
+    target = weakref.ref(frames[1].cel_chunks[0])
+    for frame_index in range(2, len(frames)):
+        frames[frame_index]
+    gc.collect()
+    assert target() is None
+
+def check_cache(buf):
+    # an edited copy of buf, with the tilemap of one cel changed
+    index = ChunkIndex.build(buf)
+    i = index.find(0x2005, frame_index=0)[0]
+    cel_chunk, _ = parse_cel_chunk(index.chunk(buf, i).data)
+    cel_chunk.data.tile = [(t + 1) & 0x1f for t in cel_chunk.data.tile]
+    edited = b"".join(writer.write(buf, {index.offset[i]: cel_chunk}))
+
+    option_sets = [
+        Options(),
+        Options(dedup=True),
+        Options(dedup=True, bpp=4),
+        Options(bpp=4, one_word=True),
+        Options(one_word=True, character_base=0x400),
+        Options(one_word=True, character_base=0x3c0),
+        Options(plan=True),
+        Options(plan=True, one_word=True, dedup=True),
+        Options(plan=True, bpp=4, cram_offset=0x40),
+        Options(cram_mode=1),
+        Options(cram_mode=1, quantize="nearest"),
+        Options(cram_mode=2, quantize="ordered"),
+        Options(plane_size=(1, 1)),
+        Options(strips=True),
+        Options(tilemap_deltas=True),
+        Options(tilemap_deltas=True, one_word=True, plan=True),
+        Options(compress="rle"),
+        Options(compress="lzss", compress_level=1),
+        Options(compress="lzss", compress_level=9),
+        Options(compress="lzss", compress_level=9, dedup=True),
+        Options(verbose=True),
+    ]
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stderr(io.StringIO()):
+        cache = BuildCache(os.path.join(directory, "cache"))
+        input_filename = os.path.join(directory, "input.aseprite")
+        runs = 0
+        for data in (buf, edited):
+            with open(input_filename, "wb") as f:
+                f.write(data)
+            for options in option_sets:
+                expected = [(filename, output) for filename, output, _ in convert_data(data, options)]
+                # a miss, then a hit, each after every other option set
+                # and input have filled the cache; convert() also goes
+                # through the key of the whole file
+                for _ in range(2):
+                    outputs = [(filename, output) for filename, output, _ in convert_data(data, options, cache)]
+                    assert outputs == expected, options
+
+                    runs += 1
+                    output_dir = os.path.join(directory, f"output_{runs}")
+                    convert(input_filename, output_dir, options, cache)
+                    for filename, output in expected:
+                        with open(os.path.join(output_dir, filename), "rb") as f:
+                            assert f.read() == output, (options, filename)
+
+def check_chunk_index(buf):
+    frames = FrameSequence(buf)
+    header, _ = parse_header(buf)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "input.aseprite")
+        sidecar = filename + ".idx"
+        with open(filename, "wb") as f:
+            f.write(buf)
+        os.utime(filename, ns=(1, 1))
+
+        index = ChunkIndex.for_file(filename)
+        assert os.path.exists(sidecar)
+        chunks = [(frame_index, chunk.chunk_type) for frame_index, chunk in iter_file_chunks(buf)]
+        assert list(zip(index.frame_index, index.chunk_type)) == chunks
+        assert [index.chunk(buf, i).chunk_type for i in range(len(index))] == list(index.chunk_type)
+        for frame_index in range(header.frames):
+            for layer_index in range(2):
+                cel_chunk = index.cel(buf, layer_index, frame_index)
+                expected = frames.cel(frame_index, layer_index)
+                assert type(cel_chunk.data) is type(expected.data), (frame_index, layer_index)
+                if type(expected.data) is not CelChunk_LinkedCell:
+                    assert list(cel_chunk.data.tile) == list(expected.data.tile), (frame_index, layer_index)
+
+        # a stale sidecar is only used while the file size and modification
+        # time both match
+        stale = ChunkIndex.build(buf)
+        stale.offset[0] = 0
+        for file_size, mtime_ns, used in (
+            (len(buf), 1, True),
+            (len(buf), 2, False),
+            (len(buf) + 1, 1, False),
+        ):
+            stale.file_size = file_size
+            stale.mtime_ns = mtime_ns
+            stale.save(sidecar)
+            loaded = ChunkIndex.for_file(filename, persist=False)
+            assert (loaded.offset[0] == 0) == used, (file_size, mtime_ns)
+        # a rebuilt index replaces the stale sidecar
+        ChunkIndex.for_file(filename)
+        assert ChunkIndex.load(sidecar, buf, 1).offset[0] == index.offset[0]
+
+def reference_cram_entry(red, green, blue, index, cram_mode, quantize):
+    """
+    The color RAM entry of one color, at palette index index.
+    """
+    if cram_mode == 2:
+        return struct.pack(">I", (blue << 16) | (green << 8) | red)
+    def quantize_5(c):
+        if quantize == "truncate":
+            return c >> 3
+        elif quantize == "nearest":
+            return int(c * 31 / 255 + 0.5)
+        else:
+            threshold = cram._bayer_4x4[index % 16]
+            return min(31, int((c * 31 + threshold * 255 / 16) / 255))
+    return struct.pack(">H", quantize_5(red) | (quantize_5(green) << 5) | (quantize_5(blue) << 10))
+
+def check_cram():
+    rng = random.Random(4)
+    red, green, blue = (bytes(rng.randrange(256) for _ in range(256)) for _ in range(3))
+    for cram_mode in sorted(cram.cram_modes):
+        entry_size, _ = cram.cram_modes[cram_mode]
+        for quantize in cram.quantize_modes:
+            packed = cram.pack_palette((0, red, green, blue), cram_mode, quantize)
+            assert packed == b"".join(
+                reference_cram_entry(red[i], green[i], blue[i], i, cram_mode, quantize) for i in range(256)
+            ), (cram_mode, quantize)
+
+        # apply the delta stream to color RAM, and compare it after every
+        # change with the whole palette packed again
+        quantize = "ordered"
+        state = bytearray(cram.pack_palette((0, red, green, blue), cram_mode, quantize))
+        palette = [bytearray(red), bytearray(green), bytearray(blue)]
+        changes = []
+        expected = dict()
+        for frame_index in range(1, 8):
+            first = rng.randrange(256)
+            count = rng.randrange(1, 257 - first)
+            change = [bytearray(channel[first:first + count]) for channel in palette]
+            # change a few colors, or none at all
+            for _ in range(rng.choice((0, 1, 5))):
+                rng.choice(change)[rng.randrange(count)] = rng.randrange(256)
+            for channel, values in zip(palette, change):
+                channel[first:first + count] = values
+            changes.append((frame_index, (first, *map(bytes, change))))
+            expected[frame_index] = cram.pack_palette((0, *map(bytes, palette)), cram_mode, quantize)
+
+        data = cram.pack_palette_deltas(cram.palette_deltas((0, red, green, blue), changes, cram_mode, quantize), cram_mode)
+        number_of_frames, = struct.unpack_from(">H", data, 0)
+        offset = 2
+        applied = dict()
+        for _ in range(number_of_frames):
+            frame_index, number_of_runs = struct.unpack_from(">HH", data, offset)
+            offset += 4
+            for _ in range(number_of_runs):
+                first, count = struct.unpack_from(">HH", data, offset)
+                offset += 4
+                size = count * entry_size
+                assert state[first * entry_size:first * entry_size + size] != data[offset:offset + size]
+                state[first * entry_size:first * entry_size + size] = data[offset:offset + size]
+                offset += size
+            applied[frame_index] = bytes(state)
+        assert offset == len(data)
+        previous = cram.pack_palette((0, red, green, blue), cram_mode, quantize)
+        for frame_index in range(1, 8):
+            # frames without a change are left out of the stream
+            assert applied.get(frame_index, previous) == expected[frame_index], (cram_mode, frame_index)
+            previous = expected[frame_index]
+
+@contextlib.contextmanager
+def without_numpy(*modules):
+    saved = [module.numpy for module in modules]
+    for module in modules:
+        module.numpy = None
+    try:
+        yield
+    finally:
+        for module, saved_numpy in zip(modules, saved):
+            module.numpy = saved_numpy
+
+def reference_flip(tile, tile_width, tile_height, x_flip, y_flip):
+    return bytes(
+        tile[(tile_height - 1 - y if y_flip else y) * tile_width + (tile_width - 1 - x if x_flip else x)]
+        for y in range(tile_height)
+        for x in range(tile_width)
+    )
+
+def check_dedup(buf):
+    tilesets, _, _, _ = parse_file(buf)
+    rng = random.Random(2)
+    for tileset_chunk in tilesets.values():
+        tile_width, tile_height = tileset_chunk.tile_width, tileset_chunk.tile_height
+        tile_size = tile_width * tile_height
+        tiles = [tileset_chunk.tile(i) for i in range(tileset_chunk.number_of_tiles)]
+        # a second tileset of repeats and x, y and xy flips of the first
+        copies = [
+            reference_flip(rng.choice(tiles), tile_width, tile_height, rng.randrange(2), rng.randrange(2))
+            for _ in range(len(tiles))
+        ]
+        # and a symmetric tile, which is its own flip
+        half = bytes(rng.randrange(256) for _ in range(tile_size // 2))
+        copies.append(half + reference_flip(half, tile_width, tile_height // 2, False, True))
+
+        group = []
+        for tileset_id, group_tiles in enumerate((tiles, copies)):
+            pixel = b"".join(group_tiles)
+            group.append(TilesetChunk(
+                tileset_id = tileset_id,
+                tileset_flags = 1 << 1,
+                number_of_tiles = len(group_tiles),
+                tile_width = tile_width,
+                tile_height = tile_height,
+                base_index = 1,
+                name_of_tileset = f"tileset {tileset_id}",
+                data = TilesetChunkInternal(len(pixel), ZlibData.uncompressed(pixel)),
+            ))
+
+        for use_numpy in (True, False):
+            with contextlib.nullcontext() if use_numpy else without_numpy(dedup):
+                tiles_out = dedup.deduplicate(group)
+            unique = [tiles_out.pixel[i * tile_size:(i + 1) * tile_size] for i in range(tiles_out.number_of_tiles)]
+            # no surviving tile is a flip of another
+            variants = set()
+            for tile in unique:
+                flips = {reference_flip(tile, tile_width, tile_height, x_flip, y_flip) for x_flip in (0, 1) for y_flip in (0, 1)}
+                assert not (flips & variants), tile
+                variants |= flips
+            for tileset_chunk_in, group_tiles in zip(group, (tiles, copies)):
+                remap = tiles_out.remap[tileset_chunk_in.tileset_id]
+                assert len(remap) == len(group_tiles), len(remap)
+                for i, tile in enumerate(group_tiles):
+                    entry = remap[i]
+                    index = entry & ~(dedup.x_flip_bit | dedup.y_flip_bit)
+                    x_flip = int(entry & dedup.x_flip_bit != 0)
+                    y_flip = int(entry & dedup.y_flip_bit != 0)
+                    assert reference_flip(unique[index], tile_width, tile_height, x_flip, y_flip) == tile, (tileset_chunk_in.tileset_id, i)
+
+def reference_one_word_entry(value, supplementary, auxiliary_mode, character_size):
+    """
+    (character number, x flip, y flip, palette bits) of one 1-word pattern
+    name data value, as VDP2 reads it with PNCN set to auxiliary_mode and
+    supplementary.
+    """
+    if auxiliary_mode == 0:
+        field = value & 0x3ff
+        x_flip, y_flip = (value >> 10) & 1, (value >> 11) & 1
+        if character_size == 1:
+            character = (supplementary << 10) | field
+        else:
+            character = ((supplementary >> 2) << 12) | (field << 2) | (supplementary & 3)
+    else:
+        field = value & 0xfff
+        x_flip = y_flip = 0
+        if character_size == 1:
+            character = ((supplementary >> 2) << 12) | field
+        else:
+            character = ((supplementary >> 4) << 14) | (field << 2) | (supplementary & 3)
+    return character, x_flip, y_flip, value >> 12
+
+def check_one_word(buf):
+    tilesets, layers, _, cel_chunks = parse_file(buf)
+    for layer_index, cel_chunk in cel_chunks.items():
+        tileset_chunk = tilesets[layers[layer_index].tileset_index]
+        character_size = tileset_chunk.tile_width // 8
+        character_units = tileset_chunk.tile_width * tileset_chunk.tile_height // 0x20
+        x_cells = 64 // character_size
+        y_cells = 64 // character_size
+        # a base whose characters cross a supplementary character number
+        # boundary in auxiliary mode 0, but not in mode 1
+        crossing_base = {1: 0x3c0, 2: 0xf80}[character_size]
+        tilemap = cel_chunk.data
+        flipped_tile = [int(t) for t in tilemap.tile]
+        unflipped_tile = [t & ~(tilemap.bitmask_for_x_flip | tilemap.bitmask_for_y_flip) for t in flipped_tile]
+
+        for tile, character_base, auxiliary_mode in (
+            (flipped_tile, 0, 0),
+            (flipped_tile, 0x1000, 0),
+            (flipped_tile, 0x4000, 0),
+            (unflipped_tile, crossing_base, 1),
+            (unflipped_tile, 0x4000 + crossing_base, 1),
+        ):
+            tilemap.tile = tile
+            expected = reference_pattern_name_table(cel_chunk, x_cells, y_cells)
+            for colors in (16, 256):
+                table = one_word_pattern_name_table(
+                    cel_chunk, x_cells, y_cells, character_size, character_units, character_base, colors,
+                )
+                key = (layer_index, character_base, colors)
+                assert table.auxiliary_mode == auxiliary_mode, key
+                assert len(table.data) * 2 == len(expected), key
+                values = struct.unpack(f">{len(table.data) // 2}H", table.data)
+                for i, value in enumerate(values):
+                    entry, = struct.unpack_from(">I", expected, i * 4)
+                    assert reference_one_word_entry(
+                        value, table.supplementary_character_number, auxiliary_mode, character_size,
+                    ) == (
+                        character_base + (entry & 0x7fff) * character_units,
+                        (entry >> 30) & 1 if auxiliary_mode == 0 else 0,
+                        (entry >> 31) & 1 if auxiliary_mode == 0 else 0,
+                        0,
+                    ), (key, i)
+
+        # flips cannot be represented once mode 0 does not fit
+        tilemap.tile = flipped_tile
+        for character_base in (crossing_base, 0x7ff0):
+            try:
+                one_word_pattern_name_table(cel_chunk, x_cells, y_cells, character_size, character_units, character_base)
+            except ValueError:
+                pass
+            else:
+                assert False, (layer_index, character_base)
+
+def check_strips(buf):
+    tilesets, layers, _, cel_chunks = parse_file(buf)
+    for plane_size in (None, (1, 1), (2, 1), (2, 2)):
+        outputs = {filename: data for filename, data, _ in convert_data(buf, Options(strips=True, plane_size=plane_size))}
+        for layer_index, cel_chunk in cel_chunks.items():
+            tilemap = cel_chunk.data
+            width = tilemap.width_in_number_of_tiles
+            height = tilemap.height_in_number_of_tiles
+            # 2-word entries in map order
+            entries = []
+            for tile in tilemap.tile:
+                entry = tile & tilemap.bitmask_for_tile_id
+                if tile & tilemap.bitmask_for_x_flip:
+                    entry |= 1 << 30
+                if tile & tilemap.bitmask_for_y_flip:
+                    entry |= 1 << 31
+                entries.append(entry)
+            rows = outputs[f"pattern_name_rows__layer_{layer_index}.bin"]
+            columns = outputs[f"pattern_name_columns__layer_{layer_index}.bin"]
+            assert rows == struct.pack(f">{len(entries)}I", *entries), (plane_size, layer_index)
+            assert columns == struct.pack(
+                f">{len(entries)}I", *(entries[y * width + x] for x in range(width) for y in range(height)),
+            ), (plane_size, layer_index)
+
+            # the pure-Python strips match
+            table = outputs[f"pattern_name_table__layer_{layer_index}.bin"]
+            tileset_chunk = tilesets[layers[layer_index].tileset_index]
+            x_cells = 64 // (tileset_chunk.tile_width // 8)
+            y_cells = 64 // (tileset_chunk.tile_height // 8)
+            layout = plane.plane_layout(width, height, x_cells, y_cells, plane_size)
+            with without_numpy(plane):
+                assert plane.strips(table, 4, layout) == (rows, columns), (plane_size, layer_index)
+
+def check_4bpp(buf):
+    tilesets, _, _, _ = parse_file(buf)
+    header, _ = parse_header(buf)
+    transparent_index = header.transparent_palette_index
+    for tileset_chunk in tilesets.values():
+        tile_size = tileset_chunk.tile_width * tileset_chunk.tile_height
+        number_of_tiles = tileset_chunk.number_of_tiles
+        pixel = tileset_chunk.data.pixel
+        colors = bank.tile_colors(pixel, tile_size, number_of_tiles, transparent_index)
+        palette_banks, tile_banks = bank.assign_banks(colors, transparent_index)
+        for bank_indices in palette_banks.banks:
+            assert len(bank_indices) <= bank.bank_colors - 1, len(bank_indices)
+            assert transparent_index not in bank_indices, bank_indices
+
+        packed = bank.pack_4bpp(pixel, tile_size, tile_banks, palette_banks)
+        with without_numpy(bank):
+            assert bank.pack_4bpp(pixel, tile_size, tile_banks, palette_banks) == packed
+        assert len(packed) * 2 == tile_size * number_of_tiles, len(packed)
+        for i in range(tile_size * number_of_tiles):
+            slot = packed[i // 2] >> 4 if i % 2 == 0 else packed[i // 2] & 0xf
+            tile_bank = palette_banks.banks[tile_banks[i // tile_size]]
+            if slot == 0:
+                assert pixel[i] == transparent_index, i
+            else:
+                assert tile_bank[slot - 1] == pixel[i], i
+
+    # 15 opaque colors fit a bank, 16 do not
+    bank.assign_banks([frozenset(range(1, 16))])
+    for colors, max_banks in (([frozenset(range(1, 17))], 64), ([frozenset(range(1, 16)), frozenset(range(16, 31))], 1)):
+        try:
+            bank.assign_banks(colors, max_banks=max_banks)
+        except ValueError:
+            pass
+        else:
+            assert False, (colors, max_banks)
+
+def check_writer(buf):
+    assert b"".join(writer.write(buf)) == buf
+
+    # replace the tilemap of the first cel, then parse it back
+    index = ChunkIndex.build(buf)
+    i = index.find(0x2005, frame_index=0)[0]
+    cel_chunk, _ = parse_cel_chunk(index.chunk(buf, i).data)
+    tile = [(t + 1) & 0x1f for t in cel_chunk.data.tile]
+    cel_chunk.data.tile = tile
+    out = b"".join(writer.write(buf, {index.offset[i]: cel_chunk}))
+    header, _ = parse_header(out)
+    assert header.file_size == len(out)
+    _, _, _, cel_chunks = parse_file(out)
+    assert list(cel_chunks[cel_chunk.layer_index].data.tile) == tile
+    assert sum(1 for _ in iter_file_chunks(out)) == sum(1 for _ in iter_file_chunks(buf))
+
+def sprite_file():
+    """
+    A 64x48 .aseprite file with two image layers over three frames: cels
+    that overhang the canvas, a cel repeated elsewhere, a linked cel, a
+    missing cel and a fully transparent cel.
+    """
+    rng = random.Random(5)
+    def image(width, height):
+        # opaque pixels surrounded by a transparent border
+        pixel = bytearray(width * height)
+        for y in range(2, height - 3):
+            for x in range(3, width - 1):
+                pixel[y * width + x] = rng.choice((0, 1, 2, 3))
+        pixel[2 * width + 3] = 4
+        return bytes(pixel)
+    def image_cel(layer_index, x, y, width, height, pixel):
+        data = _cel_header_struct.pack(layer_index, x, y, 255, 2, 0)
+        data += _cel_image_header_struct.pack(width, height) + zlib.compress(pixel)
+        return synthetic._chunk(0x2005, data)
+    def layer(name):
+        return synthetic._chunk(0x2004, _layer_header_struct.pack(1, 0, 0, 0, 0, 0, 255) + synthetic._string(name))
+
+    first = image(13, 9)
+    frames = [
+        [
+            synthetic.palette_chunk(rng),
+            layer("a"),
+            layer("b"),
+            image_cel(0, -4, 3, 13, 9, first),
+            image_cel(1, 40, 30, 30, 20, image(30, 20)),
+        ],
+        [
+            image_cel(0, 20, 10, 13, 9, first),
+        ],
+        [
+            synthetic.linked_cel_chunk(0, 0),
+            image_cel(1, 0, 0, 8, 8, bytes(64)),
+        ],
+    ]
+    body = b"".join(synthetic._frame(chunks) for chunks in frames)
+    header = _header_struct.pack(
+        _header_struct.size + len(body), 0xa5e0, len(frames), 64, 48, 8, 1, 100, 0, 256, 1, 1, 0, 0, 16, 16,
+    )
+    return header + body
+
+def check_sprites():
+    buf = sprite_file()
+    address = 0x1000
+    outputs = {filename: data for filename, data, _ in convert_data(buf, Options(sprites=True, sprite_address=address))}
+    characters = outputs["sprite_characters.bin"]
+    table = outputs["sprite_table.bin"]
+    number_of_layers, number_of_frames = struct.unpack_from(">HH", table, 0)
+    assert (number_of_layers, number_of_frames) == (2, 3)
+
+    # draw each sprite and each cel on a canvas with a margin for cels
+    # that overhang it, and compare the opaque pixels
+    margin = 64
+    size = 64 + 2 * margin
+    sources = set()
+    for frame_index, frame in enumerate(FrameSequence(buf)):
+        for layer_index in range(number_of_layers):
+            expected = bytearray(size * size)
+            cel_chunk = frame.cel_chunks.get(layer_index)
+            if cel_chunk is not None:
+                width, height, pixel = sprite.cel_image(cel_chunk)
+                for y in range(height):
+                    for x in range(width):
+                        offset = (cel_chunk.y_position + y + margin) * size + cel_chunk.x_position + x + margin
+                        expected[offset] = pixel[y * width + x]
+
+            drawn = bytearray(size * size)
+            source, character_size, x0, y0 = struct.unpack_from(
+                ">HHhh", table, 4 + (frame_index * number_of_layers + layer_index) * 8,
+            )
+            if character_size:
+                width, height = (character_size >> 8) * 8, character_size & 0xff
+                start = source * 8 - address
+                sources.add(source)
+                character = characters[start:start + width * height]
+                assert len(character) == width * height, (frame_index, layer_index)
+                # cropped to the opaque pixels, up to the padding to 8
+                assert any(character[:width]) and any(character[-width:]), (frame_index, layer_index)
+                assert any(character[y * width] for y in range(height)), (frame_index, layer_index)
+                for y in range(height):
+                    for x in range(width):
+                        drawn[(y0 + y + margin) * size + x0 + x + margin] = character[y * width + x]
+            assert drawn == expected, (frame_index, layer_index)
+
+    # the repeated and the linked cel share the character of the first
+    assert len(sources) == 2, sources
+    entries = {struct.unpack_from(">HH", table, 4 + i * 8) for i in range(number_of_layers * number_of_frames)}
+    assert len(characters) == sum((size >> 8) * 8 * (size & 0xff) for _, size in entries), len(characters)
+
+def main():
+    buf = synthetic_file()
+    print(f"numpy: {'yes' if numpy is not None else 'no'}")
+    for name, check in (
+        ("linked_cels", check_linked_cels),
+        ("pattern_name_table", lambda: check_pattern_name_table(buf)),
+        ("cache", lambda: check_cache(buf)),
+        ("file_objects", lambda: check_file_objects(buf)),
+        ("chunk_index", lambda: check_chunk_index(buf)),
+        ("cram", check_cram),
+        ("dedup", lambda: check_dedup(buf)),
+        ("one_word", lambda: check_one_word(buf)),
+        ("strips", lambda: check_strips(buf)),
+        ("4bpp", lambda: check_4bpp(buf)),
+        ("writer", lambda: check_writer(buf)),
+        ("compress", lambda: check_compress(buf)),
+        ("sprites", check_sprites),
+        ("tilize", check_tilize),
+        ("tilemap_deltas", lambda: check_tilemap_deltas(buf)),
+    ):
+        check()
+        print(f"{name}: ok")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import struct
+from dataclasses import dataclass
+
+from aseprite import FrameSequence, CelChunk_RawImageData, CelChunk_CompressedImage
+
+# VDP1 character patterns are addressed in 8-byte units (CMDSRCA), and are
+# a multiple of 8 pixels wide, at most 504, by at most 255 lines (CMDSIZE)
+vdp1_vram_size = 0x80000
+address_unit = 8
+max_width = 0x3f * 8
+max_height = 0xff
+
+# u16 number of layers, u16 number of frames
+_table_header_struct = struct.Struct(">HH")
+# u16 CMDSRCA, u16 CMDSIZE, s16 x, s16 y
+_table_entry_struct = struct.Struct(">HHhh")
+
+@dataclass
+class Sprite:
+    # position of the cropped character relative to the canvas
+    x: int
+    y: int
+    width: int
+    height: int
+    # index in the atlas of the character
+    character: int
+
+@dataclass
+class SpriteAtlas:
+    # layer indices of the image layers, in table order
+    layers: list
+    # [frame index][position in layers] -> Sprite, or None for no cel
+    frames: list
+    # (address, width, height) of each distinct character
+    characters: list
+    pixel: bytes
+
+def cel_image(cel_chunk):
+    """
+    (width, height, pixel) of an image cel.
+    """
+    data = cel_chunk.data
+    if type(data) is CelChunk_RawImageData:
+        return data.width_in_pixels, data.height_in_pixes, data.pixel
+    elif type(data) is CelChunk_CompressedImage:
+        return data.width_in_pixels, data.height_in_pixels, data.pixel
+    else:
+        assert False, type(data)
+
+def crop(pixel, width, height, transparent_index):
+    """
+    (x, y, width, height) of the smallest rectangle of pixel holding every
+    pixel that is not transparent_index, or None if there is none.
+    """
+    pixel = bytes(pixel)
+    transparent = bytes((transparent_index,))
+    top = None
+    bottom = None
+    left = width
+    right = 0
+    for y in range(height):
+        row = pixel[y * width:(y + 1) * width]
+        stripped = row.lstrip(transparent)
+        if not stripped:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        left = min(left, width - len(stripped))
+        right = max(right, len(row.rstrip(transparent)))
+    if top is None:
+        return None
+    return left, top, right - left, bottom - top
+
+def character(pixel, width, x, y, crop_width, crop_height, transparent_index):
+    """
+    The crop_width x crop_height rectangle at (x, y) of pixel, padded on the
+    right to a multiple of 8 pixels with transparent_index.
+    """
+    pixel = bytes(pixel)
+    padded_width = (crop_width + 7) // 8 * 8
+    padding = bytes((transparent_index,)) * (padded_width - crop_width)
+    rows = []
+    for row in range(y, y + crop_height):
+        start = row * width + x
+        rows.append(pixel[start:start + crop_width] + padding)
+    return b"".join(rows)
+
+def build_atlas(mem, transparent_index=0, address=0):
+    """
+    Crop the cel of every image layer in every frame to its bounding box,
+    and store each distinct cropped image once, one after another from
+    address in VDP1 VRAM.
+    """
+    if transparent_index != 0:
+        # VDP1 only treats color code 0 as transparent
+        raise ValueError(f"sprites need transparent color index 0, not {transparent_index}")
+    if address % address_unit:
+        raise ValueError(f"sprite address {address:#x} is not a multiple of {address_unit}")
+
+    frames = FrameSequence(mem)
+    layers = None
+    sprite_frames = []
+    # (width, height, pixel) -> index in characters
+    characters = dict()
+    pixel = bytearray()
+    for frame in frames:
+        if layers is None:
+            layers = [i for i, layer in enumerate(frame.layers) if layer.layer_type == 0]
+        sprites = []
+        for layer_index in layers:
+            cel_chunk = frame.cel_chunks.get(layer_index)
+            if cel_chunk is None:
+                sprites.append(None)
+                continue
+            width, height, cel_pixel = cel_image(cel_chunk)
+            box = crop(cel_pixel, width, height, transparent_index)
+            if box is None:
+                sprites.append(None)
+                continue
+            x, y, crop_width, crop_height = box
+            if crop_width > max_width or crop_height > max_height:
+                raise ValueError(
+                    f"frame {frame.frame_index} layer {layer_index}: {crop_width}x{crop_height} is larger than "
+                    f"the largest VDP1 character ({max_width}x{max_height})"
+                )
+            data = character(cel_pixel, width, x, y, crop_width, crop_height, transparent_index)
+            padded_width = len(data) // crop_height
+            key = (padded_width, crop_height, data)
+            if key not in characters:
+                characters[key] = len(characters)
+                pixel += data
+            sprites.append(Sprite(
+                cel_chunk.x_position + x,
+                cel_chunk.y_position + y,
+                padded_width,
+                crop_height,
+                characters[key],
+            ))
+        sprite_frames.append(sprites)
+
+    if address + len(pixel) > vdp1_vram_size:
+        raise ValueError(f"{len(pixel):#x} bytes of sprite characters at {address:#x} do not fit in VDP1 VRAM")
+
+    addresses = []
+    offset = address
+    for width, height, _ in characters:
+        addresses.append((offset, width, height))
+        offset += width * height
+    return SpriteAtlas(layers or [], sprite_frames, addresses, bytes(pixel))
+
+def pack_sprite_table(atlas):
+    """
+    Serialize the sprites of atlas as a big-endian table, ready to copy into
+    VDP1 draw commands:
+
+      u16 number of layers, u16 number of frames
+      per frame, per layer:  u16 CMDSRCA, u16 CMDSIZE, s16 x, s16 y
+
+    Entries for layers without a cel in a frame are all zero.
+    """
+    buf = bytearray(_table_header_struct.pack(len(atlas.layers), len(atlas.frames)))
+    for sprites in atlas.frames:
+        for sprite in sprites:
+            if sprite is None:
+                buf += bytes(_table_entry_struct.size)
+                continue
+            address, width, height = atlas.characters[sprite.character]
+            buf += _table_entry_struct.pack(
+                address // address_unit,
+                (width // 8) << 8 | height,
+                sprite.x,
+                sprite.y,
+            )
+    return bytes(buf)
@@ -0,0 +1,174 @@
+import sys
+import zlib
+import random
+import argparse
+from dataclasses import dataclass, field
+
+from aseprite import (
+    _header_struct,
+    _frame_header_struct,
+    _chunk_header_struct,
+    _palette_header_struct,
+    _palette_entry_struct,
+    _tileset_header_struct,
+    _layer_header_struct,
+    _cel_header_struct,
+    _tilemap_header_struct,
+    _word_struct,
+    _dword_struct,
+)
+
+@dataclass
+class SyntheticOptions:
+    # (tile width, tile height, number of tiles) of each tileset
+    tilesets: list = field(default_factory=lambda: [(8, 8, 256), (16, 16, 128)])
+    # (width, height) in tiles of every tilemap
+    map_size: tuple = (128, 64)
+    # tilemap layers, using the tilesets in turn
+    layers: int = 2
+    frames: int = 1
+    # opaque colors per tile, at most 15 so that tiles also fit 4bpp
+    tile_colors: int = 12
+    seed: int = 0
+
+def _string(s):
+    b = s.encode()
+    return _word_struct.pack(len(b)) + b
+
+def _chunk(chunk_type, data):
+    return _chunk_header_struct.pack(_chunk_header_struct.size + len(data), chunk_type) + data
+
+def _frame(chunks, duration=100):
+    body = b"".join(chunks)
+    return _frame_header_struct.pack(
+        _frame_header_struct.size + len(body), 0xf1fa, min(len(chunks), 0xffff), duration, len(chunks),
+    ) + body
+
+def palette_chunk(rng):
+    data = _palette_header_struct.pack(256, 0, 255)
+    for _ in range(256):
+        data += _palette_entry_struct.pack(0, rng.randrange(256), rng.randrange(256), rng.randrange(256), 255)
+    return _chunk(0x2019, data)
+
+def tileset_chunk(tileset_id, tile_width, tile_height, number_of_tiles, tile_colors, rng):
+    # tile 0 is empty; every other tile uses a few colors of one 16-color
+    # range, as pixel art tiles tend to
+    tile_size = tile_width * tile_height
+    pixel = bytearray(tile_size)
+    for _ in range(number_of_tiles - 1):
+        base = rng.randrange(16) * 16
+        colors = [0] + [base + rng.randrange(16) for _ in range(tile_colors)]
+        pixel += bytes(rng.choices(colors, k=tile_size))
+    compressed = zlib.compress(bytes(pixel))
+    data = _tileset_header_struct.pack(tileset_id, 1 << 1, number_of_tiles, tile_width, tile_height, 1)
+    data += _string(f"tileset {tileset_id}")
+    data += _dword_struct.pack(len(compressed)) + compressed
+    return _chunk(0x2023, data)
+
+def layer_chunk(name, tileset_index):
+    data = _layer_header_struct.pack(1, 2, 0, 0, 0, 0, 255)
+    data += _string(name) + _dword_struct.pack(tileset_index)
+    return _chunk(0x2004, data)
+
+def tilemap_cel_chunk(layer_index, width, height, number_of_tiles, rng):
+    # tile ids with random x/y flips; 32 bits per tile
+    tiles = bytearray()
+    for _ in range(width * height):
+        tiles += _dword_struct.pack(rng.randrange(number_of_tiles) | (rng.randrange(4) << 29))
+    data = _cel_header_struct.pack(layer_index, 0, 0, 255, 3, 0)
+    data += _tilemap_header_struct.pack(width, height, 32, 0x1fffffff, 0x20000000, 0x40000000, 0x80000000)
+    data += zlib.compress(bytes(tiles))
+    return _chunk(0x2005, data)
+
+def linked_cel_chunk(layer_index, frame_position):
+    data = _cel_header_struct.pack(layer_index, 0, 0, 255, 1, 0)
+    data += _word_struct.pack(frame_position)
+    return _chunk(0x2005, data)
+
+def build(options=SyntheticOptions()):
+    """
+    A valid indexed .aseprite file with tilesets, tilemap layers and
+    frames as described by options. Odd frames link the cels of the
+    previous frame; even frames have new tilemaps.
+    """
+    rng = random.Random(options.seed)
+    width, height = options.map_size
+
+    chunks = [palette_chunk(rng)]
+    for tileset_id, (tile_width, tile_height, number_of_tiles) in enumerate(options.tilesets):
+        chunks.append(tileset_chunk(tileset_id, tile_width, tile_height, number_of_tiles, options.tile_colors, rng))
+    for layer_index in range(options.layers):
+        chunks.append(layer_chunk(f"layer {layer_index}", layer_index % len(options.tilesets)))
+    for layer_index in range(options.layers):
+        _, _, number_of_tiles = options.tilesets[layer_index % len(options.tilesets)]
+        chunks.append(tilemap_cel_chunk(layer_index, width, height, number_of_tiles, rng))
+    frames = [_frame(chunks)]
+
+    for frame_index in range(1, options.frames):
+        chunks = []
+        for layer_index in range(options.layers):
+            if frame_index % 2:
+                chunks.append(linked_cel_chunk(layer_index, frame_index - 1))
+            else:
+                _, _, number_of_tiles = options.tilesets[layer_index % len(options.tilesets)]
+                chunks.append(tilemap_cel_chunk(layer_index, width, height, number_of_tiles, rng))
+        frames.append(_frame(chunks))
+
+    body = b"".join(frames)
+    tile_width, tile_height, _ = options.tilesets[0]
+    header = _header_struct.pack(
+        _header_struct.size + len(body),
+        0xa5e0,
+        options.frames,
+        width * tile_width,
+        height * tile_height,
+        8,    # color depth: indexed
+        1,    # flags: layer opacity is valid
+        100,  # speed
+        0,    # transparent palette index
+        256,  # number of colors
+        1, 1, # pixel ratio
+        0, 0, # grid position
+        tile_width,
+        tile_height,
+    )
+    return header + body
+
+def _size(s):
+    width, height = s.lower().split("x")
+    return int(width), int(height)
+
+def _tileset(s):
+    size, number_of_tiles = s.split(":")
+    return (*_size(size), int(number_of_tiles))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic .aseprite file with tilesets and tilemap layers.")
+    parser.add_argument("output")
+    parser.add_argument("--tileset", type=_tileset, action="append", dest="tilesets",
+                        help="WxH:TILES, e.g. 8x8:256; repeat for more tilesets (default: 8x8:256 and 16x16:128)")
+    parser.add_argument("--map-size", type=_size, default=(128, 64),
+                        help="tilemap size in tiles, WxH (default: 128x64)")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=1)
+    parser.add_argument("--tile-colors", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    options = SyntheticOptions(
+        map_size = args.map_size,
+        layers = args.layers,
+        frames = args.frames,
+        tile_colors = args.tile_colors,
+        seed = args.seed,
+    )
+    if args.tilesets:
+        options.tilesets = args.tilesets
+
+    data = build(options)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(args.output, len(data), file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+from array import array
+
+from aseprite import (
+    numpy,
+    _uint32_typecode,
+    ZlibData,
+    TilesetChunk,
+    TilesetChunkInternal,
+    CelChunk,
+    CelChunk_CompressedTilemap,
+)
+from sprite import cel_image
+
+def canvas_image(cel_chunk, width, height, transparent_index, padded_width=None, padded_height=None):
+    """
+    The image of cel_chunk placed at its position on a width x height
+    canvas filled with transparent_index, as bytes. The canvas is then
+    padded with transparent_index to padded_width x padded_height, if
+    given; the parts of the cel outside the canvas are never drawn.
+    """
+    cel_width, cel_height, pixel = cel_image(cel_chunk)
+    x = cel_chunk.x_position
+    y = cel_chunk.y_position
+    # the part of the cel on the canvas
+    x0, x1 = max(x, 0), min(x + cel_width, width)
+    y0, y1 = max(y, 0), min(y + cel_height, height)
+    if padded_width is not None:
+        width = padded_width
+    if padded_height is not None:
+        height = padded_height
+
+    if numpy is not None:
+        canvas = numpy.full((height, width), transparent_index, dtype=numpy.uint8)
+        if x0 < x1 and y0 < y1:
+            image = numpy.frombuffer(pixel, dtype=numpy.uint8, count=cel_width * cel_height)
+            image = image.reshape(cel_height, cel_width)
+            canvas[y0:y1, x0:x1] = image[y0 - y:y1 - y, x0 - x:x1 - x]
+        return canvas.tobytes()
+
+    canvas = bytearray(bytes((transparent_index,)) * (width * height))
+    if x0 < x1:
+        for row in range(y0, y1):
+            start = (row - y) * cel_width + x0 - x
+            canvas[row * width + x0:row * width + x1] = pixel[start:start + x1 - x0]
+    return bytes(canvas)
+
+def image_tiles(pixel, width, height, tile_width, tile_height):
+    """
+    Slice a row-major image, a whole number of tiles wide and high, into
+    tile-major, row-major tiles like TilesetChunkInternal.pixel.
+    """
+    assert width % tile_width == 0 and height % tile_height == 0, (width, height)
+    columns = width // tile_width
+    rows = height // tile_height
+
+    if numpy is not None:
+        a = numpy.frombuffer(pixel, dtype=numpy.uint8).reshape(rows, tile_height, columns, tile_width)
+        return a.swapaxes(1, 2).tobytes()
+
+    # per row of tiles, one strided copy per byte position within a tile
+    tile_size = tile_width * tile_height
+    band_size = width * tile_height
+    buf = bytearray(len(pixel))
+    for band in range(0, len(pixel), band_size):
+        for y in range(tile_height):
+            row = pixel[band + y * width:band + (y + 1) * width]
+            for x in range(tile_width):
+                buf[band + y * tile_width + x:band + band_size:tile_size] = row[x::tile_width]
+    return bytes(buf)
+
+def _unique_tiles_numpy(tiles, tile_size):
+    """
+    (unique tiles in order of first appearance, index of each tile among
+    them), hashing each tile to 64 bits and only comparing whole tiles to
+    rule out collisions.
+    """
+    a = numpy.frombuffer(tiles, dtype=numpy.uint8).reshape(-1, tile_size)
+    words = a.view("<u8")
+    h = numpy.zeros(len(a), dtype=numpy.uint64)
+    with numpy.errstate(over="ignore"):
+        for column in range(words.shape[1]):
+            # FNV-1a over 64-bit words
+            h = (h ^ words[:, column]) * numpy.uint64(0x100000001b3)
+    _, first, inverse = numpy.unique(h, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if not (a == a[first[inverse]]).all():
+        # a hash collision; fall back to comparing tiles
+        keys = numpy.ascontiguousarray(a).view(numpy.dtype((numpy.void, tile_size))).reshape(-1)
+        _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+    # renumber from sorted order to order of first appearance
+    order = numpy.argsort(first, kind="stable")
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    return a[first[order]].tobytes(), rank[inverse]
+
+def unique_tiles(tiles, tile_size):
+    """
+    (unique tiles of tile-major pixel data in order of first appearance,
+    index of each tile among them as a sequence of ints).
+    """
+    if numpy is not None and tile_size % 8 == 0:
+        return _unique_tiles_numpy(tiles, tile_size)
+
+    unique = dict() # tile pixels -> index
+    indices = array(_uint32_typecode, bytes(4 * (len(tiles) // tile_size)))
+    for i, start in enumerate(range(0, len(tiles), tile_size)):
+        indices[i] = unique.setdefault(tiles[start:start + tile_size], len(unique))
+    return b"".join(unique), indices
+
+def tilize_cel(cel_chunk, canvas_width, canvas_height, tile_width, tile_height, transparent_index,
+               tileset_id, name_of_tileset=b""):
+    """
+    Slice the image cel_chunk, on a canvas_width x canvas_height canvas,
+    into a TilesetChunk of its unique tiles and a tilemap CelChunk covering
+    the canvas. Tile 0 is the empty tile, as in Aseprite tilesets.
+    """
+    columns = (canvas_width + tile_width - 1) // tile_width
+    rows = (canvas_height + tile_height - 1) // tile_height
+    width = columns * tile_width
+    height = rows * tile_height
+    tile_size = tile_width * tile_height
+
+    pixel = canvas_image(cel_chunk, canvas_width, canvas_height, transparent_index, width, height)
+    empty = bytes((transparent_index,)) * tile_size
+    tiles = empty + image_tiles(pixel, width, height, tile_width, tile_height)
+    unique, indices = unique_tiles(tiles, tile_size)
+
+    tileset_chunk = TilesetChunk(
+        tileset_id = tileset_id,
+        tileset_flags = 1 << 1, # tiles inside this file
+        number_of_tiles = len(unique) // tile_size,
+        tile_width = tile_width,
+        tile_height = tile_height,
+        base_index = 1,
+        name_of_tileset = name_of_tileset,
+        data = TilesetChunkInternal(len(unique), ZlibData.uncompressed(unique)),
+    )
+
+    tilemap = CelChunk_CompressedTilemap(
+        width_in_number_of_tiles = columns,
+        height_in_number_of_tiles = rows,
+        bits_per_tile = 32,
+        bitmask_for_tile_id = 0x1fffffff,
+        bitmask_for_x_flip = 0x20000000,
+        bitmask_for_y_flip = 0x40000000,
+        bitmask_for_diagonal_flip = 0x80000000,
+        compressed = None,
+    )
+    tilemap.tile = indices[1:]
+
+    tilemap_cel_chunk = CelChunk(
+        layer_index = cel_chunk.layer_index,
+        x_position = 0,
+        y_position = 0,
+        opacity_level = cel_chunk.opacity_level,
+        cel_type = 3,
+        z_index = cel_chunk.z_index,
+        data = tilemap,
+    )
+    return tileset_chunk, tilemap_cel_chunk
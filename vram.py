@@ -0,0 +1,84 @@
+from dataclasses import dataclass
+
+# VDP2 VRAM: 512 KiB in four 128 KiB banks
+vram_size = 0x80000
+bank_size = 0x20000
+bank_names = ("A0", "A1", "B0", "B1")
+
+# character numbers count 0x20-byte units
+character_unit = 0x20
+
+@dataclass
+class Placement:
+    name: str
+    kind: str
+    address: int
+    size: int
+
+    @property
+    def end(self):
+        return self.address + self.size
+
+    @property
+    def banks(self):
+        """
+        Names of the banks the data occupies.
+        """
+        if self.size == 0:
+            return []
+        first = self.address // bank_size
+        last = (self.end - 1) // bank_size
+        return [bank_names[bank] for bank in range(first, last + 1)]
+
+    def manifest(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "address": self.address,
+            "size": self.size,
+            "banks": self.banks,
+        }
+
+class VramPlanner:
+    """
+    Place character patterns from the bottom of VRAM up, and pattern name
+    tables from the top down. Display reads character patterns and pattern
+    name data in the same cycles, so keeping them at opposite ends puts them
+    in different banks whenever everything fits in three of the four.
+    """
+
+    def __init__(self, size=vram_size):
+        self.size = size
+        self.low = 0
+        self.high = size
+        self.placements = []
+
+    def _place(self, name, kind, address, size):
+        if address < self.low or address + size > self.high:
+            raise ValueError(
+                f"{name}: {size:#x} bytes do not fit in VRAM "
+                f"({self.high - self.low:#x} bytes free between {self.low:#x} and {self.high:#x})"
+            )
+        placement = Placement(name, kind, address, size)
+        self.placements.append(placement)
+        return placement
+
+    def place_low(self, name, kind, size, alignment=character_unit):
+        address = (self.low + alignment - 1) // alignment * alignment
+        placement = self._place(name, kind, address, size)
+        self.low = placement.end
+        return placement
+
+    def place_high(self, name, kind, size, alignment=character_unit):
+        address = (self.high - size) // alignment * alignment
+        placement = self._place(name, kind, address, size)
+        self.high = placement.address
+        return placement
+
+    def shared_banks(self):
+        """
+        Banks holding both character patterns and pattern name tables.
+        """
+        def banks(kind):
+            return {bank for p in self.placements if p.kind == kind for bank in p.banks}
+        return sorted(banks("character_pattern") & banks("pattern_name_table"))
@@ -0,0 +1,225 @@
+import zlib
+
+from aseprite import (
+    as_memoryview,
+    parse_header,
+    parse_frame_header,
+    iter_chunks,
+    PaletteChunk,
+    OldPaletteChunk,
+    TilesetChunk,
+    TilesetChunkExternal,
+    TilesetChunkInternal,
+    LayerChunk,
+    CelChunk,
+    CelChunk_RawImageData,
+    CelChunk_LinkedCell,
+    CelChunk_CompressedImage,
+    CelChunk_CompressedTilemap,
+    _frame_header_struct,
+    _chunk_header_struct,
+    _old_palette_packet_struct,
+    _palette_header_struct,
+    _palette_entry_struct,
+    _tileset_header_struct,
+    _layer_header_struct,
+    _cel_header_struct,
+    _cel_image_header_struct,
+    _tilemap_header_struct,
+    _dword_struct,
+    _word_struct,
+)
+
+def encode_string(s):
+    return _word_struct.pack(len(s)) + s
+
+def encode_zlib(zlib_data, level=6, recompress=False):
+    """
+    The zlib stream of zlib_data: the original compressed bytes, unless it
+    is new data (or recompress), which is compressed at level.
+    """
+    if zlib_data.compressed is not None and not recompress:
+        return zlib_data.compressed
+    return zlib.compress(zlib_data.data, level)
+
+def encode_palette_chunk(palette_chunk):
+    buf = bytearray(_palette_header_struct.pack(
+        palette_chunk.new_palette_size,
+        palette_chunk.first_color_index_to_change,
+        palette_chunk.last_color_index_to_change,
+    ))
+    if not palette_chunk.color_names:
+        # every entry is the same size
+        entry_size = _palette_entry_struct.size
+        entries = bytearray(len(palette_chunk) * entry_size)
+        entries[2::entry_size] = palette_chunk.red
+        entries[3::entry_size] = palette_chunk.green
+        entries[4::entry_size] = palette_chunk.blue
+        entries[5::entry_size] = palette_chunk.alpha
+        return bytes(buf + entries)
+
+    for entry in palette_chunk.entries:
+        has_name = entry.color_name is not None
+        buf += _palette_entry_struct.pack(int(has_name), entry.red, entry.green, entry.blue, entry.alpha)
+        if has_name:
+            buf += encode_string(entry.color_name)
+    return bytes(buf)
+
+def encode_old_palette_chunk(old_palette_chunk):
+    buf = bytearray(_word_struct.pack(old_palette_chunk.number_of_packets))
+    for packet in old_palette_chunk.packets:
+        buf += _old_palette_packet_struct.pack(packet.entries_to_skip, packet.number_of_colors)
+        for color in packet.colors:
+            buf += bytes(color)
+    return bytes(buf)
+
+def encode_tileset_chunk(tileset_chunk, level=6, recompress=False):
+    buf = bytearray(_tileset_header_struct.pack(
+        tileset_chunk.tileset_id,
+        tileset_chunk.tileset_flags,
+        tileset_chunk.number_of_tiles,
+        tileset_chunk.tile_width,
+        tileset_chunk.tile_height,
+        tileset_chunk.base_index,
+    ))
+    buf += encode_string(tileset_chunk.name_of_tileset)
+    data = tileset_chunk.data
+    if type(data) is TilesetChunkExternal:
+        buf += _dword_struct.pack(data.id_of_external_file)
+        buf += _dword_struct.pack(data.tileset_id_in_external_file)
+    elif type(data) is TilesetChunkInternal:
+        compressed = encode_zlib(data.compressed, level, recompress)
+        buf += _dword_struct.pack(len(compressed))
+        buf += compressed
+    else:
+        assert False, type(data)
+    return bytes(buf)
+
+def encode_layer_chunk(layer_chunk):
+    buf = bytearray(_layer_header_struct.pack(
+        layer_chunk.flags,
+        layer_chunk.layer_type,
+        layer_chunk.layer_child_level,
+        layer_chunk.default_layer_width_in_pixels,
+        layer_chunk.default_layer_height_in_pixels,
+        layer_chunk.blend_mode,
+        layer_chunk.opacity,
+    ))
+    buf += encode_string(layer_chunk.layer_name)
+    if layer_chunk.layer_type == 2:
+        buf += _dword_struct.pack(layer_chunk.tileset_index)
+    if layer_chunk.layer_uuid is not None:
+        buf += layer_chunk.layer_uuid
+    return bytes(buf)
+
+def encode_cel_chunk(cel_chunk, level=6, recompress=False):
+    buf = bytearray(_cel_header_struct.pack(
+        cel_chunk.layer_index,
+        cel_chunk.x_position,
+        cel_chunk.y_position,
+        cel_chunk.opacity_level,
+        cel_chunk.cel_type,
+        cel_chunk.z_index,
+    ))
+    data = cel_chunk.data
+    if type(data) is CelChunk_RawImageData:
+        buf += _cel_image_header_struct.pack(data.width_in_pixels, data.height_in_pixes)
+        buf += data.pixel
+    elif type(data) is CelChunk_LinkedCell:
+        buf += _word_struct.pack(data.frame_position)
+    elif type(data) is CelChunk_CompressedImage:
+        buf += _cel_image_header_struct.pack(data.width_in_pixels, data.height_in_pixels)
+        buf += encode_zlib(data.compressed, level, recompress)
+    elif type(data) is CelChunk_CompressedTilemap:
+        buf += _tilemap_header_struct.pack(
+            data.width_in_number_of_tiles,
+            data.height_in_number_of_tiles,
+            data.bits_per_tile,
+            data.bitmask_for_tile_id,
+            data.bitmask_for_x_flip,
+            data.bitmask_for_y_flip,
+            data.bitmask_for_diagonal_flip,
+        )
+        buf += encode_zlib(data.compressed, level, recompress)
+    else:
+        assert False, type(data)
+    return bytes(buf)
+
+def encode_chunk(obj, level=6, recompress=False):
+    """
+    A whole chunk, header included, for a parsed chunk object.
+    """
+    if type(obj) is PaletteChunk:
+        chunk_type, data = 0x2019, encode_palette_chunk(obj)
+    elif type(obj) is OldPaletteChunk:
+        chunk_type, data = 0x4, encode_old_palette_chunk(obj)
+    elif type(obj) is TilesetChunk:
+        chunk_type, data = 0x2023, encode_tileset_chunk(obj, level, recompress)
+    elif type(obj) is LayerChunk:
+        chunk_type, data = 0x2004, encode_layer_chunk(obj)
+    elif type(obj) is CelChunk:
+        chunk_type, data = 0x2005, encode_cel_chunk(obj, level, recompress)
+    else:
+        assert False, type(obj)
+    return _chunk_header_struct.pack(_chunk_header_struct.size + len(data), chunk_type) + data
+
+def write(mem, replacements=None, level=6, recompress=False):
+    """
+    The .aseprite file in mem with the chunks at the offsets in
+    replacements (as yielded by iter_chunks() or stored in a ChunkIndex)
+    replaced by the encoding of their new chunk object, or removed where
+    the object is None. Returns a list of buffers to write out in order:
+    frames without replacements, and runs of unchanged chunks, are
+    zero-copy views of mem. Zlib data is only compressed (at level) where
+    it is new, or everywhere in the replaced chunks with recompress.
+    """
+    mem = as_memoryview(mem)
+    if replacements is None:
+        replacements = dict()
+    header, offset = parse_header(mem)
+
+    out = [None] # the header, once the file size is known
+    frame_end = offset
+    for _ in range(header.frames):
+        frame_offset = frame_end
+        frame_header, chunks_offset = parse_frame_header(mem, frame_offset)
+        frame_end = frame_offset + frame_header.bytes_in_this_frame
+        chunks = list(iter_chunks(mem, chunks_offset, frame_header.number_of_chunks))
+        if not any(chunk_offset in replacements for chunk_offset, _ in chunks):
+            out.append(mem[frame_offset:frame_end])
+            continue
+
+        body = []
+        number_of_chunks = 0
+        run_start = chunks_offset # start of the current run of unchanged chunks
+        for chunk_offset, chunk in chunks:
+            if chunk_offset not in replacements:
+                number_of_chunks += 1
+                continue
+            if run_start < chunk_offset:
+                body.append(mem[run_start:chunk_offset])
+            run_start = chunk_offset + chunk.chunk_size
+            obj = replacements[chunk_offset]
+            if obj is not None:
+                body.append(encode_chunk(obj, level, recompress))
+                number_of_chunks += 1
+        if run_start < frame_end:
+            body.append(mem[run_start:frame_end])
+
+        _, _, old_number_of_chunks, frame_duration, _ = _frame_header_struct.unpack_from(mem, frame_offset)
+        out.append(_frame_header_struct.pack(
+            _frame_header_struct.size + sum(len(b) for b in body),
+            0xf1fa,
+            min(number_of_chunks, 0xffff),
+            frame_duration,
+            number_of_chunks,
+        ))
+        out += body
+
+    file_size = offset + sum(len(b) for b in out[1:])
+    out[0] = _dword_struct.pack(file_size) + bytes(mem[4:offset])
+    return out
+
+def write_file(filename, mem, replacements=None, level=6, recompress=False):
+    with open(filename, "wb") as f:
+        f.writelines(write(mem, replacements, level, recompress))